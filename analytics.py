@@ -0,0 +1,103 @@
+import pandas as pd
+
+from perf_trace import traced
+
+# ============================================================================
+# WORKSHEET & REPORT AGGREGATIONS
+# ----------------------------------------------------------------------------
+# The numbers behind the worksheet % columns, Tab 2 (Analytics) and Tab 3
+# (Summary), kept out of app.py so the benchmark suite can time them on
+# synthetic data. One groupby per view instead of one filter per brand.
+# ============================================================================
+@traced("calculate_pct")
+def calculate_pct(df, months):
+    """Calculate percentage compared to L3M average"""
+    df_calc = df.copy(deep=False)
+    for m in months:
+        if f'Cons_{m}' in df_calc.columns:
+            # Avoid division by zero
+            mask = df_calc['L3M_Avg'] > 0
+            df_calc.loc[mask, f'{m}_%'] = (
+                df_calc.loc[mask, f'Cons_{m}'] / df_calc.loc[mask, 'L3M_Avg'] * 100
+            ).round(1)
+            df_calc.loc[~mask, f'{m}_%'] = 100  # Default if no L3M data
+    return df_calc
+
+
+@traced("tab2 analytics_frame")
+def analytics_frame(df, months):
+    """Qty_<m> (Consensus, else ROFO) and Val_<m> (Qty x floor price) for every month"""
+    price = pd.to_numeric(df['floor_price'], errors='coerce').fillna(0) if 'floor_price' in df.columns else 0
+    new_cols = {}
+    for m in months:
+        # Source prioritization: Consensus -> Original Horizon Month
+        source_col = f'Cons_{m}' if f'Cons_{m}' in df.columns else m
+        if source_col in df.columns:
+            qty = pd.to_numeric(df[source_col], errors='coerce').fillna(0)
+            new_cols[f'Qty_{m}'] = qty
+            new_cols[f'Val_{m}'] = qty * price
+        else:
+            new_cols[f'Qty_{m}'] = pd.Series(0, index=df.index)
+            new_cols[f'Val_{m}'] = pd.Series(0, index=df.index)
+    return pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis=1) if new_cols else df.copy(deep=False)
+
+
+@traced("tab2 brand_summary")
+def brand_summary(calc_df, months):
+    """Volume and revenue per brand over the given months, highest revenue first"""
+    qty_cols = [f'Qty_{m}' for m in months if f'Qty_{m}' in calc_df.columns]
+    val_cols = [f'Val_{m}' for m in months if f'Val_{m}' in calc_df.columns]
+    totals = pd.DataFrame({
+        'Brand': calc_df['Brand'],
+        'Volume': calc_df[qty_cols].sum(axis=1) if qty_cols else 0,
+        'Revenue': calc_df[val_cols].sum(axis=1) if val_cols else 0,
+    })
+    summary = totals.groupby('Brand', sort=False, dropna=False)[['Volume', 'Revenue']].sum().reset_index()
+    return summary.sort_values("Revenue", ascending=False)
+
+
+@traced("tab2 monthly_by")
+def monthly_by(calc_df, months, dim, val_mode=False):
+    """Long frame [dim, Value, Month] of Qty (or Val) per group and month"""
+    prefix = 'Val_' if val_mode else 'Qty_'
+    cols = [f'{prefix}{m}' for m in months if f'{prefix}{m}' in calc_df.columns]
+    if not cols:
+        return pd.DataFrame(columns=[dim, 'Value', 'Month'])
+    grouped = calc_df.groupby(dim)[cols].sum()
+    grouped.columns = [c[len(prefix):] for c in cols]
+    long = grouped.reset_index().melt(id_vars=dim, var_name='Month', value_name='Value')
+    return long[[dim, 'Value', 'Month']]
+
+
+@traced("tab2 monthly_total")
+def monthly_total(calc_df, months, val_mode=False):
+    """[Month, Value] totals over all rows"""
+    prefix = 'Val_' if val_mode else 'Qty_'
+    return pd.DataFrame([
+        {"Month": m, "Value": calc_df[f'{prefix}{m}'].sum()}
+        for m in months if f'{prefix}{m}' in calc_df.columns
+    ])
+
+
+@traced("tab3 report_totals")
+def report_totals(report_df, adjustment_months):
+    """Report frame with Temp_Total = consensus (or ROFO) over the adjustable months"""
+    adj_cols = [f'Cons_{m}' for m in adjustment_months if f'Cons_{m}' in report_df.columns]
+    # Jika kolom Cons_ belum ada (belum diedit), gunakan kolom bulan asli
+    if not adj_cols:
+        adj_cols = [m for m in adjustment_months if m in report_df.columns]
+    report_df = report_df.copy(deep=False)
+    report_df['Temp_Total'] = report_df[adj_cols].sum(axis=1) if adj_cols else 0
+    return report_df
+
+
+@traced("tab3 risk_counts")
+def risk_counts(report_df):
+    """Rows per stock cover band"""
+    cover = report_df['Month_Cover'].to_numpy(dtype=float)
+    return {
+        "Critical Out (MoS < 0.5)": int((cover < 0.5).sum()),
+        "Understock (0.5 - 1.0)": int(((cover >= 0.5) & (cover < 1.0)).sum()),
+        "Optimal (1.0 - 1.5)": int(((cover >= 1.0) & (cover <= 1.5)).sum()),
+        "Overstock (> 1.5)": int((cover > 1.5).sum()),
+    }
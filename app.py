@@ -1,17 +1,40 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import gspread
-import plotly.graph_objects as go
-import plotly.express as px
-from google.oauth2.service_account import Credentials
+import pyarrow as pa
 import json
+import time
 from datetime import datetime, timedelta
 import re
+from functools import partial
 from dateutil.relativedelta import relativedelta
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode, JsCode
-from streamlit_extras.metric_cards import style_metric_cards
 from streamlit_extras.stylable_container import stylable_container
+# plotly, st_aggrid, gspread and google-auth are imported where they are used,
+# so a new process paints the page before loading them
+from sop_pipeline import (SHEETS, PipelineError, open_spreadsheet, read_records, build_dataset, upsert_rows,
+                          clean_currency_frame, sort_month_columns, standardize_columns)
+from stat_forecast import STAT_MODELS, DEFAULT_STAT_MODEL
+from reconciliation import RECONCILE_LEVELS, ALLOCATION_BASIS, level_codes, levels_above, build_summing_matrix, bottom_up, middle_out
+from sheets_usage import LEDGER, api_method, metered_http_client, READ_QUOTA_PER_MIN, WRITE_QUOTA_PER_MIN
+from perf_trace import span, traced, start_trace, stop_trace, current_tracer, TRACE_BY_DEFAULT
+from analytics import calculate_pct, analytics_frame, brand_summary, monthly_by, monthly_total, report_totals, risk_counts
+from bulk_adjust import BULK_RULES, RULES_WITH_VALUE, bulk_adjust, bulk_preview
+from scenarios import ScenarioStore, BASE_SCENARIO
+from arrow_data import equals_mask, compare_mask, contains_mask, value_counts
+from snapshot_store import (SNAPSHOT_TTL, snapshot_key, read_pointer, read_snapshot, write_snapshot,
+                            invalidate as invalidate_snapshots)
+from history_store import invalidate as invalidate_history
+from dataset_refresher import DatasetRefresher, REFRESH_AFTER
+from shared_data import SharedDataset, session_memory_table
+from merge_audit import cause_counts, audit_to_records, audit_from_records
+from hash_join import compact_report
+from data_quality import issue_summary, issues_from_records, issues_to_records
+from consensus_sync import (KEY_COLS, CONSENSUS_SNAPSHOT, merge_consensus, row_versions, saved_consensus, apply_saved,
+                            sheet_after_push, publish_consensus)
+from rofo_versions import record_version, list_versions, load_version, change_summary
+from sql_query import SQL_ROW_LIMIT, QueryError, connect as sql_connect, run_query, table_columns, example_queries
+from read_api import API_HOST, API_PORT, start_in_background as start_read_api
+from backtest import archive_forecast, list_cycles, load_cycle, actuals_long, cycle_errors, accuracy_table, ACCURACY_LEVELS
 
 # ============================================================================
 # PAGE CONFIG
@@ -23,6 +46,13 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Stage timings and Sheets API requests of this run, shown in the sidebar ⚡ Performance panel
+api_requests_at_start = LEDGER.total_requests
+if st.session_state.get('perf_tracing', TRACE_BY_DEFAULT):
+    start_trace("script run")
+else:
+    stop_trace()
+
 # ============================================================================
 # CSS STYLING - IMPROVED RESPONSIVENESS
 # ============================================================================
@@ -106,26 +136,31 @@ class GSheetConnector:
             st.error("❌ Secrets 'gsheets' not found in Streamlit secrets.")
             self.client = None
 
+    @traced("gsheets.connect")
+    @api_method("connect")
     def connect(self):
         try:
+            import gspread
+            from google.oauth2.service_account import Credentials
             scope = ['https://www.googleapis.com/auth/spreadsheets']
             creds = Credentials.from_service_account_info(self.service_account_info, scopes=scope)
-            self.client = gspread.authorize(creds)
+            self.client = gspread.authorize(creds, http_client=metered_http_client())
             self.sheet = self.client.open_by_key(self.sheet_id)
             return True
         except Exception as e:
             st.error(f"🔌 Connection Error: {str(e)}")
             return False
 
+    @traced("gsheets.get_sheet_data")
+    @api_method("get_sheet_data")
     def get_sheet_data(self, sheet_name):
+        import gspread
         try:
             if not self.client:
                 st.error("Not connected to Google Sheets")
                 return pd.DataFrame()
                 
-            worksheet = self.sheet.worksheet(sheet_name)
-            data = worksheet.get_all_records(value_render_option='FORMATTED_VALUE') 
-            return pd.DataFrame(data)
+            return read_records(self.sheet, sheet_name)
         except gspread.WorksheetNotFound:
             st.warning(f"Worksheet '{sheet_name}' not found")
             return pd.DataFrame()
@@ -133,7 +168,10 @@ class GSheetConnector:
             st.error(f"Error reading {sheet_name}: {str(e)}")
             return pd.DataFrame()
 
+    @traced("gsheets.save_data")
+    @api_method("save_data")
     def save_data(self, df, sheet_name):
+        import gspread
         try:
             if not self.client:
                 return False, "Not connected to Google Sheets"
@@ -157,267 +195,326 @@ class GSheetConnector:
         except Exception as e:
             return False, f"Save error: {str(e)}"
 
+    @traced("gsheets.read_values")
+    @api_method("read_values")
+    def read_values(self, sheet_name):
+        """Raw cell values (header first) for a row-level merge; [] if the sheet is missing"""
+        import gspread
+        if not self.client:
+            raise ConnectionError("Not connected to Google Sheets")
+        try:
+            return self.sheet.worksheet(sheet_name).get_all_values()
+        except gspread.WorksheetNotFound:
+            return []
+
+    @traced("gsheets.upsert_rows")
+    @api_method("upsert_rows")
+    def upsert_rows(self, df, sheet_name, key_cols, existing_values=None):
+        """
+        Write only the given rows, matched on key_cols; every other row and
+        column in the sheet is left untouched. New keys are appended.
+        """
+        import gspread
+        try:
+            if not self.client:
+                return False, "Not connected to Google Sheets"
+            
+            try:
+                worksheet = self.sheet.worksheet(sheet_name)
+            except gspread.WorksheetNotFound:
+                worksheet = self.sheet.add_worksheet(title=sheet_name, rows=df.shape[0] + 100, cols=df.shape[1] + 5)
+            
+            return True, upsert_rows(worksheet, df, key_cols, existing_values)
+        except Exception as e:
+            return False, f"Save error: {str(e)}"
+
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
-def clean_currency(val):
-    """Clean currency values from various formats"""
-    if pd.isna(val) or val == '' or val is None:
-        return 0
-    val_str = str(val)
-    # Remove Rp, spaces, commas, dots (thousand separators)
-    clean_str = re.sub(r'[^0-9]', '', val_str)
-    try:
-        return float(clean_str)
-    except:
-        return 0
-
-def find_matching_column(target_month, available_columns):
-    """Find matching month column with fuzzy matching"""
-    if target_month in available_columns: 
-        return target_month
-    
-    # Create clean versions for comparison
-    target_clean = target_month.lower().replace('-', '').replace(' ', '').replace('_', '')
-    
-    for col in available_columns:
-        col_str = str(col)
-        col_clean = col_str.lower().replace('-', '').replace(' ', '').replace('_', '')
-        if target_clean in col_clean or col_clean in target_clean:
-            return col
-    
-    return None
-
-def parse_month_year(date_str):
-    """Parse month-year string to datetime for sorting"""
-    try:
-        return datetime.strptime(date_str, "%b-%y")
-    except:
-        return datetime(1900, 1, 1)  # Default for invalid dates
-
-def sort_month_columns(columns):
-    """Sort month columns chronologically (Oct-25, Nov-25, Dec-25, etc.)"""
-    month_cols = [c for c in columns if re.match(r'^[A-Za-z]{3}-\d{2}$', str(c))]
-    
-    # Sort by date
-    month_cols.sort(key=lambda x: parse_month_year(x))
-    
-    return month_cols
+# Cleaning and month helpers live in sop_pipeline (shared with the CLI)
 
 # ============================================================================
 # 2. DATA LOADER WITH ENHANCED ERROR HANDLING
 # ============================================================================
-@st.cache_data(ttl=600, show_spinner="Loading data from Google Sheets...")
-def load_data_v5(start_date_str, all_months=False):
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_sheet(sheet_name):
+    """Fetch one worksheet; shared by every start month and view for the TTL"""
+    gs = GSheetConnector()
+    if not gs.client:
+        return pd.DataFrame()
+    df = gs.get_sheet_data(sheet_name)
+    if sheet_name == "rofo_current" and not df.empty:
+        with span("record ROFO version"):
+            record_version(df)
+    return df
+
+def load_data_v5(start_date_str, all_months=False, stat_model=DEFAULT_STAT_MODEL):
     """
     Load and process data from Google Sheets
     all_months: If True, load all 12 months for adjustment
+    stat_model: Statistical baseline model used for the Stat_ columns
+    Returns (merged_df, build info), or (empty frame, None) when the load failed
     """
     try:
-        gs = GSheetConnector()
-        if not gs.client:
-            return pd.DataFrame()
-        
         # Load data
-        with st.spinner("Fetching sales history..."):
-            sales_df = gs.get_sheet_data("sales_history")
-        
-        with st.spinner("Fetching ROFO data..."):
-            rofo_df = gs.get_sheet_data("rofo_current")
-        
-        with st.spinner("Fetching stock data..."):
-            stock_df = gs.get_sheet_data("stock_onhand")
-        
-        # Check if essential data exists
-        if sales_df.empty:
-            st.error("⚠️ Sales history data is empty")
-            return pd.DataFrame()
-        if rofo_df.empty:
-            st.error("⚠️ ROFO data is empty")
-            return pd.DataFrame()
-        
-        # Standardize column names
-        for df in [sales_df, rofo_df, stock_df]:
-            if not df.empty:
-                df.columns = [str(c).strip() for c in df.columns]
-        
-        # Calculate horizon months
-        try:
-            start_date = datetime.strptime(start_date_str, "%b-%y")
-            
-            if all_months:
-                # Show all 12 months for adjustment
-                horizon_months = [(start_date + relativedelta(months=i)).strftime("%b-%y") for i in range(12)]
-                adjustment_months = horizon_months  # All months are adjustable
-            else:
-                # Default: first 3 months for adjustment, next 9 for display only
-                horizon_months = [(start_date + relativedelta(months=i)).strftime("%b-%y") for i in range(12)]
-                adjustment_months = horizon_months[:3]  # Only first 3 are adjustable
-            
-            st.session_state.horizon_months = horizon_months
-            st.session_state.adjustment_months = adjustment_months
-            st.session_state.all_months_mode = all_months
-            
-        except:
-            st.error("Invalid date format")
-            return pd.DataFrame()
-        
-        # Process floor price
-        if 'floor_price' in rofo_df.columns:
-            rofo_df['floor_price'] = rofo_df['floor_price'].apply(clean_currency)
-        else:
-            floor_cols = [c for c in rofo_df.columns if 'floor' in c.lower()]
-            if floor_cols:
-                rofo_df.rename(columns={floor_cols[0]: 'floor_price'}, inplace=True)
-                rofo_df['floor_price'] = rofo_df['floor_price'].apply(clean_currency)
-            else:
-                rofo_df['floor_price'] = 0
-        
-        # Standardize column names
-        key_map = {
-            'Product Name': 'Product_Name', 
-            'Brand Group': 'Brand_Group', 
-            'SKU Tier': 'SKU_Tier',
-            'product name': 'Product_Name',
-            'brand group': 'Brand_Group',
-            'sku tier': 'SKU_Tier'
-        }
-        
-        for df in [sales_df, rofo_df]:
-            df.rename(columns=lambda x: key_map.get(x, x), inplace=True)
-        
-        # Identify common keys for merging
-        possible_keys = ['sku_code', 'Product_Name', 'Brand', 'Brand_Group', 'SKU_Tier', 'Channel']
-        valid_keys = [k for k in possible_keys if k in sales_df.columns and k in rofo_df.columns]
-        
-        if not valid_keys:
-            st.error("❌ No common columns found for merging sales and ROFO data")
-            return pd.DataFrame()
-        
-        # Get sales date columns and sort them chronologically
-        sales_date_cols = [c for c in sales_df.columns if re.search(r'^[A-Za-z]{3}-\d{2}$', str(c))]
-        sales_date_cols = sort_month_columns(sales_date_cols)
-        
-        # Get LAST 3 months for L3M calculation (correct order: Oct-25, Nov-25, Dec-25)
-        if len(sales_date_cols) >= 3:
-            l3m_cols = sales_date_cols[-3:]  # Last 3 months in chronological order
-        else:
-            l3m_cols = sales_date_cols
-        
-        if l3m_cols:
-            # Calculate L3M average correctly
-            sales_df['L3M_Avg'] = sales_df[l3m_cols].applymap(
-                lambda x: clean_currency(x) if pd.notna(x) else 0
-            ).mean(axis=1).round(0)
-        else:
-            sales_df['L3M_Avg'] = 0
-        
-        # Prepare sales subset
-        sales_subset_cols = valid_keys + ['L3M_Avg']
-        if l3m_cols:
-            sales_subset_cols.extend(l3m_cols)
-        sales_subset = sales_df[sales_subset_cols].copy()
-        
-        # Prepare ROFO subset
-        rofo_cols_to_fetch = valid_keys.copy()
-        for extra in ['Channel', 'Product_Focus', 'floor_price', 'category', 'sub_category']:
-            if extra in rofo_df.columns and extra not in rofo_cols_to_fetch:
-                rofo_cols_to_fetch.append(extra)
-        
-        # Map month columns
-        month_mapping = {}
-        missing_months = []
-        for m in horizon_months:
-            real_col = find_matching_column(m, rofo_df.columns)
-            if real_col:
-                month_mapping[m] = real_col
-                if real_col not in rofo_cols_to_fetch:
-                    rofo_cols_to_fetch.append(real_col)
-            else:
-                missing_months.append(m)
-        
-        st.session_state.missing_months = missing_months
+        with st.spinner("Fetching sales history..."), span("fetch sales_history"):
+            sales_df = fetch_sheet("sales_history")
         
-        rofo_subset = rofo_df[rofo_cols_to_fetch].copy()
-        inv_map = {v: k for k, v in month_mapping.items()}
-        rofo_subset.rename(columns=inv_map, inplace=True)
+        with st.spinner("Fetching ROFO data..."), span("fetch rofo_current"):
+            rofo_df = fetch_sheet("rofo_current")
         
-        # Merge data
-        merged_df = pd.merge(sales_subset, rofo_subset, on=valid_keys, how='inner')
+        with st.spinner("Fetching stock data..."), span("fetch stock_onhand"):
+            stock_df = fetch_sheet("stock_onhand")
         
-        if merged_df.empty:
-            st.warning("⚠️ No matching records found after merging sales and ROFO data")
-            return pd.DataFrame()
-        
-        # Handle missing columns
-        if 'Product_Focus' not in merged_df.columns: 
-            merged_df['Product_Focus'] = ""
-        else: 
-            merged_df['Product_Focus'] = merged_df['Product_Focus'].fillna("").astype(str)
-        
-        if 'floor_price' not in merged_df.columns: 
-            merged_df['floor_price'] = 0
-        else: 
-            merged_df['floor_price'] = merged_df['floor_price'].fillna(0)
-        
-        # Ensure all horizon months exist
-        for m in horizon_months:
-            if m not in merged_df.columns:
-                merged_df[m] = 0
-            else:
-                merged_df[m] = merged_df[m].apply(clean_currency)
-        
-        # Merge stock data
-        if not stock_df.empty and 'sku_code' in stock_df.columns:
-            stock_col = next((c for c in ['Stock_Qty', 'stock_qty', 'Stock On Hand', 'stock_on_hand'] 
-                            if c in stock_df.columns), stock_df.columns[1] if len(stock_df.columns) > 1 else 'stock_qty')
-            
-            stock_df_clean = stock_df[['sku_code', stock_col]].copy()
-            stock_df_clean.columns = ['sku_code', 'Stock_Qty']
-            stock_df_clean['Stock_Qty'] = stock_df_clean['Stock_Qty'].apply(clean_currency)
-            
-            merged_df = pd.merge(merged_df, stock_df_clean, on='sku_code', how='left')
-        else:
-            merged_df['Stock_Qty'] = 0
-        
-        merged_df['Stock_Qty'] = merged_df['Stock_Qty'].fillna(0)
-        
-        # Calculate month cover
-        merged_df['Month_Cover'] = np.where(
-            merged_df['L3M_Avg'] > 0,
-            (merged_df['Stock_Qty'] / merged_df['L3M_Avg']).round(1),
-            0
-        )
-        merged_df['Month_Cover'] = merged_df['Month_Cover'].replace([np.inf, -np.inf], 0)
-        
-        # Initialize consensus columns for adjustment months
-        adjustment_months = st.session_state.get('adjustment_months', [])
-        for m in adjustment_months:
-            merged_df[f'Cons_{m}'] = merged_df[m]
+        with span("build_dataset"):
+            merged_df, info = build_dataset(sales_df, rofo_df, stock_df, start_date_str, all_months, stat_model)
         
-        # Add summary columns
-        merged_df['Total_Forecast'] = merged_df[adjustment_months].sum(axis=1)
+        st.session_state.horizon_months = info['horizon_months']
+        st.session_state.adjustment_months = info['adjustment_months']
+        st.session_state.all_months_mode = all_months
         
-        return merged_df
+        return merged_df, info
         
+    except PipelineError as e:
+        (st.warning if e.level == "warning" else st.error)(str(e))
+        return pd.DataFrame(), None
     except Exception as e:
         st.error(f"❌ Error Loading Data: {str(e)}")
         import traceback
         st.error(traceback.format_exc())
+        return pd.DataFrame(), None
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_sales_actuals():
+    """Sales history melted to (sku_code, Channel, Target_Month, Actual)"""
+    sales_df = standardize_columns(fetch_sheet("sales_history"))
+    if sales_df.empty:
         return pd.DataFrame()
+    month_cols = sort_month_columns(sales_df.columns)
+    sales_df[month_cols] = clean_currency_frame(sales_df[month_cols])
+    return actuals_long(sales_df, month_cols)
+
+@st.cache_data(max_entries=16, show_spinner="Comparing ROFO versions...")
+def rofo_changes(old_version, new_version, by):
+    """Diff and waterfall between two stored ROFO versions; versions never change, so no TTL"""
+    return change_summary(load_version(old_version), load_version(new_version), by=by)
+
+@st.cache_data(ttl=600, show_spinner="Scoring archived forecasts...")
+def load_cycle_errors(cycle, archived_mtime):
+    """Backtest errors for one archived cycle; re-scored only when the archive changes"""
+    return cycle_errors(load_cycle(cycle), load_sales_actuals())
+
+def get_scenario_store():
+    """This session's what-if scenarios"""
+    if 'scenarios' not in st.session_state:
+        st.session_state.scenarios = ScenarioStore()
+    return st.session_state.scenarios
+
+def get_edit_journal():
+    """Consensus edit journal of the active scenario"""
+    return get_scenario_store().journal()
+
+def scenario_comparison(baseline_df, row_ids, months, by):
+    """Consensus totals of every scenario per `by` for the given rows"""
+    rows = baseline_df[baseline_df['row_id'].isin(row_ids)]
+    return get_scenario_store().compare(rows, [f'Cons_{m}' for m in months], by)
+
+def session_consensus_start(dataset, df, dataset_key):
+    """
+    This session's starting consensus: the last pushed values in consensus_rofo over the
+    ROFO-initialised Cons_ columns. The read also gives the row versions for optimistic
+    locking; the saved cells are kept per dataset version as a sparse overlay
+    """
+    remote_df = None
+    if 'consensus_seen_versions' not in st.session_state:
+        remote_df = fetch_sheet("consensus_rofo")
+        st.session_state.consensus_seen_versions = row_versions(remote_df)
+        if not remote_df.empty and read_pointer(CONSENSUS_SNAPSHOT) is None:
+            # First read since the snapshots were cleared: give the read API something to serve
+            publish_consensus(remote_df, dataset=dataset_key)
+    cached = st.session_state.get('consensus_saved')
+    if cached is None or cached[0] != dataset.version:
+        if remote_df is None:
+            remote_df = fetch_sheet("consensus_rofo")
+        cons_cols = [c for c in df.columns if c.startswith('Cons_')]
+        cached = (dataset.version, saved_consensus(df, remote_df, cons_cols))
+        st.session_state.consensus_saved = cached
+    return apply_saved(df, cached[1])
+
+def apply_consensus_overlay(df):
+    """Replay this session's journaled consensus edits onto the loaded data"""
+    return get_edit_journal().replay(df)
+
+def record_consensus_changes(df, new_values_by_col):
+    """Journal every Cons_ cell that differs from df as a single undo step"""
+    changes = []
+    row_ids = df['row_id'].to_numpy()
+    for col, new_values in new_values_by_col.items():
+        new_values = np.asarray(new_values, dtype=float)
+        old_values = df[col].to_numpy(dtype=float)
+        changed = ~np.isclose(old_values, new_values)
+        changes.append((row_ids[changed], col, old_values[changed], new_values[changed]))
+    get_edit_journal().record_batch(changes)
+    return sum(len(c[0]) for c in changes)
+
+def grid_consensus_values(base_df, grid_df, cons_cols):
+    """Cons_ values returned by AgGrid, aligned to base_df rows via row_id"""
+    if grid_df.empty or 'row_id' not in grid_df.columns:
+        return {}
+    grid = grid_df.assign(row_id=pd.to_numeric(grid_df['row_id'], errors='coerce'))
+    grid = grid.drop_duplicates('row_id').set_index('row_id')
+    values = {}
+    for col in cons_cols:
+        if col in grid.columns and col in base_df.columns:
+            new = pd.to_numeric(grid[col], errors='coerce').reindex(base_df['row_id'].to_numpy()).to_numpy()
+            base = base_df[col].to_numpy(dtype=float)
+            values[col] = np.where(np.isnan(new), base, new)
+    return values
+
+def render_chart(fig):
+    """st.plotly_chart with a timing span (figure serialisation is often the slow part)"""
+    with span("plotly_chart", traces=len(fig.data)):
+        st.plotly_chart(fig, use_container_width=True)
+
+@api_method("background_refresh")
+def read_raw_sheets(credentials):
+    """Refresher-thread download of the three input sheets (not the st.cache_data copies)"""
+    if credentials is None:
+        raise PipelineError("Secrets 'gsheets' not found in Streamlit secrets.")
+    spreadsheet = open_spreadsheet(*credentials)
+    sheets = [read_records(spreadsheet, name) for name in SHEETS]
+    record_version(sheets[SHEETS.index("rofo_current")])
+    return sheets
+
+def attach_build_info(dataset, info):
+    """Build results shown with the data, kept on the dataset so every session and snapshot reader sees them"""
+    dataset.quality = info['quality']
+    dataset.merge_audit = info['merge_audit']
+    dataset.new_launches = info['new_launches']
+    dataset.missing_months = info['missing_months']
+    dataset.join_reports = {name: compact_report(report) for name, report in info['join_reports'].items()}
+    return dataset
+
+def dataset_from_snapshot(table, pointer):
+    """Snapshot as a SharedDataset, with the build results stored next to it"""
+    dataset = SharedDataset.from_arrow(table, version=pointer['version'], loaded_at=pointer['created'])
+    metadata = pointer.get('metadata', {})
+    dataset.quality = issues_from_records(metadata.get('quality'))
+    dataset.merge_audit = audit_from_records(metadata.get('merge_audit'))
+    dataset.new_launches = metadata.get('new_launches', 0)
+    dataset.join_reports = metadata.get('join_reports') or {}
+    dataset.missing_months = metadata.get('missing_months')
+    return dataset
+
+def snapshot_metadata(dataset, params):
+    """Stored in the pointer: build results shown with the data, and the build parameters for the read API"""
+    return {'quality': issues_to_records(dataset.quality), 'merge_audit': audit_to_records(dataset.merge_audit),
+            'new_launches': dataset.new_launches, 'join_reports': dataset.join_reports,
+            'missing_months': dataset.missing_months, 'params': list(params)}
 
-def calculate_pct(df, months):
-    """Calculate percentage compared to L3M average"""
-    df_calc = df.copy()
-    for m in months:
-        if f'Cons_{m}' in df_calc.columns:
-            # Avoid division by zero
-            mask = df_calc['L3M_Avg'] > 0
-            df_calc.loc[mask, f'{m}_%'] = (
-                df_calc.loc[mask, f'Cons_{m}'] / df_calc.loc[mask, 'L3M_Avg'] * 100
-            ).round(1)
-            df_calc.loc[~mask, f'{m}_%'] = 100  # Default if no L3M data
-    return df_calc
+def rebuild_dataset(params, inputs):
+    """Refresher-thread build of one parameter set; no st.* calls"""
+    key = snapshot_key(*params)
+    # Another server process may have built this key already
+    table, pointer = read_snapshot(key, max_age=REFRESH_AFTER)
+    if table is not None:
+        return dataset_from_snapshot(table, pointer)
+    sales_df, rofo_df, stock_df = inputs()
+    df, info = build_dataset(sales_df, rofo_df, stock_df, *params)
+    dataset = attach_build_info(SharedDataset(df), info)
+    if not dataset.empty:
+        dataset.version = write_snapshot(dataset.table, key, metadata=snapshot_metadata(dataset, params))['version']
+    return dataset
+
+@st.cache_resource(show_spinner=False)
+def get_read_api():
+    """Read API next to the dashboard, once per server process, when SOP_API_PORT is set"""
+    return start_read_api(API_HOST, API_PORT) if API_PORT else None
+
+def sheets_quota_low():
+    """Refresher deferral: leave the read quota to interactive requests"""
+    return "waiting for Sheets quota" if LEDGER.low_headroom('read') else None
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_refresher():
+    """One background refresher per server process"""
+    credentials = None
+    if "gsheets" in st.secrets:
+        credentials = (st.secrets["gsheets"]["sheet_id"], json.loads(st.secrets["gsheets"]["service_account_info"]))
+    return DatasetRefresher(fetch=partial(read_raw_sheets, credentials), build=rebuild_dataset,
+                            defer=sheets_quota_low)
+
+def neighbour_params(start_date_str, all_months, stat_model, start_options):
+    """Parameter sets one click away: adjacent start months in both month modes, same model"""
+    i = start_options.index(start_date_str)
+    return {snapshot_key(start, mode, stat_model): (start, mode, stat_model)
+            for start in start_options[max(0, i - 1):i + 2] for mode in (False, True)
+            if (start, mode) != (start_date_str, all_months)}
+
+def load_shared_dataset(start_date_str, all_months=False, stat_model=DEFAULT_STAT_MODEL):
+    """
+    Merged dataset shared by every session in the process
+    The refresher keeps it current in the background; only the first request
+    for a parameter set with no snapshot on disk waits for Google Sheets
+    """
+    refresher = get_dataset_refresher()
+    key = snapshot_key(start_date_str, all_months, stat_model)
+    dataset = refresher.get(key)
+    if dataset is not None:
+        return dataset
+    
+    with refresher.loading(key):
+        # Another session may have loaded it while we waited
+        dataset = refresher.get(key)
+        if dataset is not None:
+            return dataset
+        # A snapshot of any age beats waiting; the refresher revalidates it straight away
+        with span("snapshot read"):
+            table, pointer = read_snapshot(key, max_age=None)
+        if table is not None:
+            dataset = dataset_from_snapshot(table, pointer)
+        else:
+            with st.spinner("Loading data from Google Sheets..."):
+                df, info = load_data_v5(start_date_str, all_months, stat_model)
+            with span("to Arrow"):
+                dataset = SharedDataset(df)
+            if info is not None:
+                attach_build_info(dataset, info)
+            if not dataset.empty:
+                try:
+                    with span("snapshot write"):
+                        pointer = write_snapshot(dataset.table, key, metadata=snapshot_metadata(
+                            dataset, (start_date_str, all_months, stat_model)))
+                    dataset.version = pointer['version']
+                except OSError as e:
+                    st.warning(f"⚠️ Could not write dataset snapshot: {e}")
+        if not dataset.empty:
+            refresher.publish(key, (start_date_str, all_months, stat_model), dataset)
+    return dataset
+
+def freshness_badge(key, shown_version):
+    """Age of the data on screen and what the background refresher is doing"""
+    status = get_dataset_refresher().status(key)
+    if status is None:
+        return
+    age_min = status['age'] / 60
+    if status['version'] != shown_version:
+        st.info("🆕 Newer data was loaded in the background; it is shown on your next action.")
+        if st.button("Show latest data", key="freshness_reload"):
+            st.rerun(scope="app")
+    elif status['refreshing']:
+        st.caption(f"🔄 Refreshing in the background · showing data from {age_min:,.0f} min ago")
+    elif status['error'] or status['deferred']:
+        reason = status['deferred'] or f"last refresh failed ({status['error']})"
+        message = f"🟡 Data is {age_min:,.0f} min old · {reason}"
+        (st.warning if status['age'] > SNAPSHOT_TTL else st.caption)(message)
+    else:
+        st.caption(f"🟢 Data loaded {age_min:,.0f} min ago · next background refresh in "
+                   f"{status['next_refresh_in'] / 60:,.0f} min")
+
+if hasattr(st, "fragment"):
+    # Re-checks on its own so the badge stays current between interactions
+    freshness_badge = st.fragment(run_every=30)(freshness_badge)
 
 # ============================================================================
 # SIDEBAR WITH IMPROVED UX
@@ -453,6 +550,13 @@ with st.sidebar:
         help="If checked, all 12 months will be editable. Default: only first 3 months editable"
     )
     
+    stat_model = st.selectbox(
+        "📐 Statistical Baseline",
+        options=list(STAT_MODELS.keys()),
+        index=list(STAT_MODELS.keys()).index(DEFAULT_STAT_MODEL),
+        help="Model used for the Stat_ columns shown next to ROFO in the worksheet"
+    )
+    
     # Calculate cycle months based on selection
     try:
         start_date = datetime.strptime(selected_start_str, "%b-%y")
@@ -482,25 +586,64 @@ with st.sidebar:
     except:
         st.error("Invalid date selected")
     
+    planner_name = st.text_input(
+        "👤 Planner",
+        value=st.session_state.get('planner_name', "S&OP Dashboard"),
+        help="Recorded as Updated_By on the consensus rows you push"
+    )
+    st.session_state.planner_name = planner_name
+    
+    # What-if scenarios (copy-on-write consensus versions)
+    scenario_store = get_scenario_store()
+    with st.expander("🧪 What-if Scenarios", expanded=len(scenario_store.names) > 1):
+        active_scenario = st.selectbox(
+            "Active Scenario",
+            options=scenario_store.names,
+            index=scenario_store.names.index(scenario_store.active),
+            help="Edits, allocations and bulk adjustments go to the active scenario"
+        )
+        scenario_store.switch(active_scenario)
+        
+        new_scenario = st.text_input("New scenario name", placeholder="e.g. Promo Push")
+        sc1, sc2 = st.columns(2)
+        with sc1:
+            if st.button("➕ Fork", use_container_width=True, disabled=not new_scenario.strip(),
+                         help=f"Copy '{active_scenario}' into a new scenario"):
+                try:
+                    scenario_store.create(new_scenario, from_name=active_scenario)
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+        with sc2:
+            if st.button("🗑️ Delete", use_container_width=True, disabled=active_scenario == BASE_SCENARIO):
+                scenario_store.delete(active_scenario)
+                st.rerun()
+        st.caption(f"{len(scenario_store.names)} scenarios · {scenario_store.nbytes / 1024:,.1f} KB of edits")
+    
     st.markdown("---")
     
     # Data management
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("🔄 Refresh Data", use_container_width=True):
+        if st.button("🔄 Refresh Data", use_container_width=True,
+                     help="Reload the sheets in the background; the current data stays on screen meanwhile"):
             st.cache_data.clear()
-            st.rerun()
+            invalidate_snapshots(keep=(CONSENSUS_SNAPSHOT,))  # The read API keeps serving the last push
+            get_dataset_refresher().request_refresh(
+                snapshot_key(selected_start_str, show_all_months, stat_model))
+            st.toast("🔄 Refreshing data in the background...")
     
     with col2:
         if st.button("📊 Clear Cache", use_container_width=True):
             st.cache_data.clear()
+            invalidate_snapshots(keep=(CONSENSUS_SNAPSHOT,))  # The read API keeps serving the last push
+            get_dataset_refresher().forget()
+            invalidate_history()
             st.success("Cache cleared!")
     
     with st.expander("🔍 Data Quality Check", expanded=False):
-        if 'missing_months' in st.session_state and st.session_state.missing_months:
-            st.error(f"❌ Missing months in ROFO: {', '.join(st.session_state.missing_months)}")
-        else:
-            st.success("✅ All months mapped successfully")
+        # Filled in once the dataset is loaded: the checks ran with its build
+        quality_slot = st.container()
 
 # ============================================================================
 # MAIN DASHBOARD
@@ -513,9 +656,11 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # Load data dengan parameter all_months
-all_df = load_data_v5(selected_start_str, show_all_months)
+dataset_key = snapshot_key(selected_start_str, show_all_months, stat_model)
+with span("load_shared_dataset"):
+    shared_ds = load_shared_dataset(selected_start_str, show_all_months, stat_model)
 
-if all_df.empty:
+if shared_ds.empty:
     st.error("""
     ⚠️ **No data loaded.** Possible issues:
     1. Google Sheets connection failed
@@ -526,6 +671,70 @@ if all_df.empty:
     """)
     st.stop()
 
+freshness_badge(dataset_key, shared_ds.version)
+
+with quality_slot:
+    missing_months = shared_ds.missing_months
+    if missing_months:
+        st.error(f"❌ Missing months in ROFO: {', '.join(missing_months)}")
+    elif missing_months is not None:
+        st.success("✅ All months mapped successfully")
+    elif shared_ds.quality is not None:
+        # Snapshots written before the full month list was stored: only the rule's count is exact
+        missing_rule = shared_ds.quality[shared_ds.quality['Rule'] == "Missing ROFO month"]
+        if not missing_rule.empty:
+            st.error(f"❌ Months missing in ROFO: {int(missing_rule['Count'].iloc[0]):,} "
+                     "(Refresh Data to list them)")
+    
+    sales_rofo, stock = shared_ds.join_reports.get('sales x rofo'), shared_ds.join_reports.get('stock')
+    if sales_rofo:
+        if sales_rofo['left_dropped'] or sales_rofo['right_dropped']:
+            st.warning(f"🔁 Duplicate keys dropped (first row kept): {sales_rofo['left_dropped']:,} rows in "
+                       f"sales_history, {sales_rofo['right_dropped']:,} in rofo_current")
+            st.dataframe(pd.concat([pd.DataFrame(sales_rofo['left_duplicates']).assign(Sheet='sales_history'),
+                                    pd.DataFrame(sales_rofo['right_duplicates']).assign(Sheet='rofo_current')]).head(50),
+                         hide_index=True, use_container_width=True)
+    merge_audit = shared_ds.merge_audit
+    if merge_audit is not None and not merge_audit.empty:
+        launches = shared_ds.new_launches
+        st.warning(f"🧩 {len(merge_audit):,} keys did not match between sales_history and rofo_current"
+                   + (f" ({launches:,} new launches kept with L3M 0)" if launches else ""))
+        st.dataframe(cause_counts(merge_audit), hide_index=True, use_container_width=True)
+        key_cols = [c for c in merge_audit.columns if c not in ('Sheet', 'Cause', 'Hint')]
+        st.dataframe(merge_audit[['Sheet', 'Cause'] + key_cols + ['Hint']],
+                     hide_index=True, use_container_width=True)
+        st.download_button("📥 Unmatched keys (CSV)", merge_audit.to_csv(index=False), file_name="unmatched_keys.csv",
+                           mime="text/csv", use_container_width=True)
+    elif sales_rofo:
+        st.success("✅ Every sales and ROFO key matched")
+    if stock:
+        if stock['right_dropped']:
+            st.warning(f"🔁 {stock['right_dropped']:,} duplicate SKU rows dropped in stock_onhand (first row kept)")
+        st.caption(f"{stock['left_unmatched_count']:,} SKUs have no stock row (Stock_Qty = 0)")
+    
+    quality = shared_ds.quality
+    if quality is None:
+        st.caption("ℹ️ Quality rules have not run on this snapshot yet; they run on the next refresh")
+    elif quality.empty:
+        st.success("✅ No data-quality issues")
+    else:
+        (st.error if (quality['Severity'] == 'error').any() else st.warning)(
+            f"🧪 Data-quality rules: {issue_summary(quality)}")
+        st.dataframe(quality[['Severity', 'Rule', 'Sheet', 'Count', 'Examples']], hide_index=True,
+                     use_container_width=True, column_config={'Examples': st.column_config.TextColumn(width="large")})
+        st.download_button("📥 Quality issues (CSV)", quality.to_csv(index=False), file_name="quality_issues.csv",
+                           mime="text/csv", use_container_width=True)
+
+# Build the cycles a planner is likely to flip to next while they read this one
+get_dataset_refresher().prefetch(neighbour_params(selected_start_str, show_all_months, stat_model, start_options))
+read_api = get_read_api()
+
+# Shared read-only baseline, resumed from the last pushed consensus, plus this session's sparse edit overlay
+with span("resume consensus"):
+    baseline_df = session_consensus_start(shared_ds, shared_ds.view(), dataset_key)
+with span("apply_consensus_overlay"):
+    all_df = apply_consensus_overlay(baseline_df)
+
 # Display quick stats
 total_skus = len(all_df)
 total_brands = all_df['Brand'].nunique() if 'Brand' in all_df.columns else 0
@@ -566,18 +775,18 @@ with st.expander("🔍 Channel Data Debug", expanded=False):
     if 'Channel' in all_df.columns:
         st.write("### Channel Information")
         
-        # Tampilkan distribusi channel
-        channel_dist = all_df['Channel'].value_counts()
+        # Tampilkan distribusi channel (Arrow compute on the shared table, no pandas copies)
+        channel_dist = value_counts(shared_ds.table, 'Channel')
         st.write("**Channel Distribution:**")
-        st.write(channel_dist)
+        st.dataframe(pa.table({'Channel': [c for c, _ in channel_dist], 'count': [n for _, n in channel_dist]}),
+                     hide_index=True)
         
         # Tampilkan sample data per channel
         st.write("**Sample Data per Channel:**")
-        unique_channels = all_df['Channel'].dropna().unique()
-        for channel in unique_channels:
-            channel_data = all_df[all_df['Channel'] == channel].head(2)
-            st.write(f"**{channel}** (Total: {len(all_df[all_df['Channel'] == channel])} SKUs):")
-            st.dataframe(channel_data[['sku_code', 'Product_Name', 'Brand', 'L3M_Avg']], 
+        for channel, channel_total in channel_dist:
+            channel_rows = np.flatnonzero(equals_mask(shared_ds.table, 'Channel', channel))
+            st.write(f"**{channel}** (Total: {channel_total} SKUs):")
+            st.dataframe(shared_ds.arrow(channel_rows[:2], ['sku_code', 'Product_Name', 'Brand', 'L3M_Avg']), 
                         hide_index=True, use_container_width=True)
     else:
         st.error("⚠️ 'Channel' column not found in data")
@@ -602,8 +811,8 @@ with stylable_container(
     
     # Tampilkan informasi Channel sebelum filter
     if 'Channel' in all_df.columns:
-        channel_counts = all_df['Channel'].value_counts()
-        st.caption(f"📊 Available Channels: {', '.join([f'{k} ({v} SKUs)' for k, v in channel_counts.items()])}")
+        channel_counts = value_counts(shared_ds.table, 'Channel')
+        st.caption(f"📊 Available Channels: {', '.join([f'{k} ({v} SKUs)' for k, v in channel_counts])}")
     
     col1, col2, col3, col4, col5, col6 = st.columns(6)
     
@@ -624,7 +833,7 @@ with stylable_container(
             
             # Show count for selected channel
             if sel_channel != "ALL":
-                count = len(all_df[all_df['Channel'] == sel_channel])
+                count = int(equals_mask(shared_ds.table, 'Channel', sel_channel).sum())
                 st.caption(f"📈 {count} SKUs")
         else:
             st.error("⚠️ Channel column not found")
@@ -665,67 +874,59 @@ with stylable_container(
 # ============================================================================
 # APPLY FILTERS - DENGAN DEBUGGING
 # ============================================================================
-filtered_df = all_df.copy()
-filter_log = []
-
-# Apply Channel filter - PERBAIKAN UTAMA
-if sel_channel != "ALL" and 'Channel' in filtered_df.columns:
-    before = len(filtered_df)
-    filtered_df = filtered_df[filtered_df['Channel'] == sel_channel]
-    after = len(filtered_df)
-    filter_log.append(f"Channel='{sel_channel}': {before} → {after} rows")
-else:
-    filter_log.append(f"Channel: ALL selected")
-
-# Apply other filters
-if sel_brand != "ALL" and 'Brand' in filtered_df.columns:
-    before = len(filtered_df)
-    filtered_df = filtered_df[filtered_df['Brand'] == sel_brand]
-    after = len(filtered_df)
-    filter_log.append(f"Brand='{sel_brand}': {before} → {after} rows")
-
-if sel_group != "ALL" and 'Brand_Group' in filtered_df.columns:
-    before = len(filtered_df)
-    filtered_df = filtered_df[filtered_df['Brand_Group'] == sel_group]
-    after = len(filtered_df)
-    filter_log.append(f"Brand_Group='{sel_group}': {before} → {after} rows")
-
-if sel_tier != "ALL" and 'SKU_Tier' in filtered_df.columns:
-    before = len(filtered_df)
-    filtered_df = filtered_df[filtered_df['SKU_Tier'] == sel_tier]
-    after = len(filtered_df)
-    filter_log.append(f"SKU_Tier='{sel_tier}': {before} → {after} rows")
-
-if sel_cover != "ALL":
-    before = len(filtered_df)
-    if sel_cover == "Overstock (>1.5)":
-        filtered_df = filtered_df[filtered_df['Month_Cover'] > 1.5]
-    elif sel_cover == "Healthy (0.5-1.5)":
-        filtered_df = filtered_df[(filtered_df['Month_Cover'] >= 0.5) & (filtered_df['Month_Cover'] <= 1.5)]
-    elif sel_cover == "Low (<0.5)":
-        filtered_df = filtered_df[filtered_df['Month_Cover'] < 0.5]
-    elif sel_cover == "Out of Stock (0)":
-        filtered_df = filtered_df[filtered_df['Month_Cover'] == 0]
-    after = len(filtered_df)
-    filter_log.append(f"Cover='{sel_cover}': {before} → {after} rows")
-
-if sel_focus != "ALL" and 'Product_Focus' in filtered_df.columns:
-    before = len(filtered_df)
-    if sel_focus == "Yes":
-        filtered_df = filtered_df[filtered_df['Product_Focus'].str.contains('Yes', case=False, na=False)]
+# Filters build one boolean row mask over the shared Arrow table (filter
+# columns are never edited, so the overlay does not matter here); the session
+# keeps only the resulting selection vector
+with span("filter block"):
+    row_mask = np.ones(len(all_df), dtype=bool)
+    filter_log = []
+
+    def apply_filter(label, condition):
+        """AND one condition into the row mask and log the row counts"""
+        before = int(row_mask.sum())
+        np.logical_and(row_mask, np.asarray(condition, dtype=bool), out=row_mask)
+        filter_log.append(f"{label}: {before} → {int(row_mask.sum())} rows")
+
+    # Apply Channel filter - PERBAIKAN UTAMA
+    if sel_channel != "ALL" and 'Channel' in all_df.columns:
+        apply_filter(f"Channel='{sel_channel}'", equals_mask(shared_ds.table, 'Channel', sel_channel))
     else:
-        filtered_df = filtered_df[~filtered_df['Product_Focus'].str.contains('Yes', case=False, na=False)]
-    after = len(filtered_df)
-    filter_log.append(f"Focus='{sel_focus}': {before} → {after} rows")
-
-# Show filter results
-if filtered_df.empty:
-    st.warning(f"⚠️ No data matches all filters. Showing all data instead.")
-    filtered_df = all_df.copy()
-    filter_summary = "Showing all data (no filters matched)"
-else:
-    filtered_skus = len(filtered_df)
-    filter_summary = f"✅ Showing {filtered_skus:,} of {total_skus:,} SKUs ({filtered_skus/total_skus*100:.1f}%)"
+        filter_log.append(f"Channel: ALL selected")
+
+    # Apply other filters
+    if sel_brand != "ALL" and 'Brand' in all_df.columns:
+        apply_filter(f"Brand='{sel_brand}'", equals_mask(shared_ds.table, 'Brand', sel_brand))
+
+    if sel_group != "ALL" and 'Brand_Group' in all_df.columns:
+        apply_filter(f"Brand_Group='{sel_group}'", equals_mask(shared_ds.table, 'Brand_Group', sel_group))
+
+    if sel_tier != "ALL" and 'SKU_Tier' in all_df.columns:
+        apply_filter(f"SKU_Tier='{sel_tier}'", equals_mask(shared_ds.table, 'SKU_Tier', sel_tier))
+
+    if sel_cover != "ALL":
+        cover_conditions = {
+            "Overstock (>1.5)": lambda t: compare_mask(t, 'Month_Cover', '>', 1.5),
+            "Healthy (0.5-1.5)": lambda t: compare_mask(t, 'Month_Cover', '>=', 0.5) & compare_mask(t, 'Month_Cover', '<=', 1.5),
+            "Low (<0.5)": lambda t: compare_mask(t, 'Month_Cover', '<', 0.5),
+            "Out of Stock (0)": lambda t: compare_mask(t, 'Month_Cover', '==', 0),
+        }
+        apply_filter(f"Cover='{sel_cover}'", cover_conditions[sel_cover](shared_ds.table))
+
+    if sel_focus != "ALL" and 'Product_Focus' in all_df.columns:
+        is_focus = contains_mask(shared_ds.table, 'Product_Focus', 'Yes')
+        apply_filter(f"Focus='{sel_focus}'", is_focus if sel_focus == "Yes" else ~is_focus)
+
+    # Show filter results
+    if not row_mask.any():
+        st.warning(f"⚠️ No data matches all filters. Showing all data instead.")
+        row_mask[:] = True
+        filter_summary = "Showing all data (no filters matched)"
+    else:
+        filtered_skus = int(row_mask.sum())
+        filter_summary = f"✅ Showing {filtered_skus:,} of {total_skus:,} SKUs ({filtered_skus/total_skus*100:.1f}%)"
+
+    st.session_state.row_selection = np.flatnonzero(row_mask).astype(np.int32)
+    filtered_df = all_df.iloc[st.session_state.row_selection]
 
 st.info(f"**Filter Summary:** {filter_summary}")
 
@@ -737,16 +938,32 @@ with st.expander("📋 Filter Steps", expanded=False):
 # ============================================================================
 # CREATE TABS
 # ============================================================================
-tab1, tab2, tab3 = st.tabs([
+tab_labels = [
     "📝 Forecast Worksheet", 
     "📈 Analytics Dashboard", 
-    "📊 Summary Reports" 
-])
+    "📊 Summary Reports",
+    "🎯 Forecast Accuracy",
+    "🔀 ROFO Changes",
+    "🧮 SQL"
+]
+try:
+    # Only the selected tab's body runs (and loads plotly) on Streamlit versions with lazy tabs
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(tab_labels, key="main_tabs", on_change="rerun")
+except TypeError:
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(tab_labels)
+
+def tab_open(tab):
+    """False only when lazy tabs are on and this tab is not selected"""
+    return getattr(tab, 'open', None) is not False
+
+# The worksheet always runs: the other tabs read its unsaved grid edits
 
 # ============================================================================
 # TAB 1: FORECAST WORKSHEET
 # ============================================================================
-with tab1:
+with tab1, span("tab1 Worksheet"):
+    from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
+    
     if filtered_df.empty:
         st.warning("⚠️ No data matches the selected filters. Please adjust your filters.")
     else:
@@ -774,15 +991,103 @@ with tab1:
                 - 🔵 **Editable Cells:** Blue border
                 """)
         
+        # Hierarchical allocation: set a number at an aggregate level and flow it down
+        with st.expander("🏛️ **Hierarchical Allocation (Top-Down / Middle-Out)**", expanded=False):
+            level_options = [l for l, cols in RECONCILE_LEVELS.items() if all(c in all_df.columns for c in cols)]
+            adjustment_months = st.session_state.get('adjustment_months', [])
+            
+            if not level_options or not adjustment_months:
+                st.info("No hierarchy columns available for allocation")
+            else:
+                rc1, rc2, rc3, rc4 = st.columns(4)
+                with rc1:
+                    rec_level = st.selectbox("🏛️ Level", level_options, key="rec_level")
+                rec_cols = RECONCILE_LEVELS[rec_level]
+                node_codes, node_labels = level_codes(all_df, rec_cols)
+                node_names = [' × '.join(l) if isinstance(l, tuple) else str(l) for l in node_labels]
+                with rc2:
+                    rec_node = st.selectbox("🎯 Node", range(len(node_names)),
+                                            format_func=lambda i: node_names[i], key="rec_node")
+                with rc3:
+                    rec_month = st.selectbox("🗓️ Month", adjustment_months, key="rec_month")
+                with rc4:
+                    rec_basis = st.selectbox("⚖️ Allocate by", ALLOCATION_BASIS, key="rec_basis",
+                                             help="Leaves get the target in proportion to this column")
+                
+                cons_col = f'Cons_{rec_month}'
+                current_cons = all_df[[cons_col]].to_numpy(dtype=float)
+                basis_col = {'L3M_Avg': 'L3M_Avg', 'ROFO': rec_month, 'Consensus': cons_col}[rec_basis]
+                node_total = current_cons[node_codes == rec_node].sum()
+                
+                rec_target = st.number_input(
+                    f"Target for **{node_names[rec_node]}** in {rec_month} (current: {node_total:,.0f})",
+                    min_value=0.0, value=float(node_total), step=100.0, key="rec_target")
+                
+                targets = pd.DataFrame({0: [rec_target]}, index=node_labels[[rec_node]])
+                rec_upper = levels_above(rec_cols)
+                new_cons, upper_after = middle_out(all_df, rec_cols, targets, current_cons,
+                                                   all_df[basis_col].to_numpy(dtype=float), upper_levels=rec_upper)
+                
+                # Bottom-up view of the levels above, before vs after
+                S_upper, upper_nodes = build_summing_matrix(all_df, levels=rec_upper)
+                upper_rows = (upper_nodes['Level'] != 'Leaf').to_numpy()
+                preview = upper_nodes[upper_rows].reset_index(drop=True)
+                preview['Before'] = bottom_up(S_upper[upper_rows], current_cons)[:, 0]
+                preview['After'] = upper_after[0].to_numpy()
+                preview['Δ'] = preview['After'] - preview['Before']
+                
+                changed_rows = int((~np.isclose(new_cons[:, 0], current_cons[:, 0])).sum())
+                st.caption(f"{changed_rows:,} SKU × Channel rows change. Totals of the levels above are re-aggregated "
+                           f"bottom-up (Total, {', '.join(rec_upper) or 'no other level'}); the Total row is always shown:")
+                st.dataframe(preview[(preview['Level'] == 'Total') | (preview['Δ'] != 0)],
+                             hide_index=True, use_container_width=True)
+                
+                if st.button("✅ Apply Allocation", key="rec_apply"):
+                    record_consensus_changes(all_df, {cons_col: new_cons[:, 0]})
+                    st.rerun()
+        
+        # Bulk adjustment: one rule over the current filter selection
+        with st.expander("⚡ **Bulk Adjustment (Current Filter)**", expanded=False):
+            bulk_mask = all_df['row_id'].isin(filtered_df['row_id']).to_numpy()
+            st.caption(f"Applies to the {int(bulk_mask.sum()):,} SKU × Channel rows in the current filter selection.")
+            
+            bc1, bc2, bc3 = st.columns([2, 2, 1])
+            with bc1:
+                bulk_months = st.multiselect("🗓️ Target Months", adjustment_months,
+                                             default=adjustment_months[:1], key="bulk_months")
+            with bc2:
+                bulk_rule = st.selectbox("📐 Rule", list(BULK_RULES.keys()), key="bulk_rule")
+            with bc3:
+                bulk_value = st.number_input("Value", value=RULES_WITH_VALUE.get(bulk_rule, 0.0),
+                                             disabled=bulk_rule not in RULES_WITH_VALUE, key="bulk_value")
+            
+            if bulk_months:
+                bulk_new = bulk_adjust(all_df, bulk_mask, bulk_months, bulk_rule, bulk_value)
+                st.dataframe(
+                    bulk_preview(all_df, bulk_mask, bulk_months, bulk_new),
+                    column_config={
+                        "Before": st.column_config.NumberColumn("Before", format="%d"),
+                        "After": st.column_config.NumberColumn("After", format="%d"),
+                        "Δ": st.column_config.NumberColumn("Δ", format="%+d"),
+                        "Δ %": st.column_config.NumberColumn("Δ %", format="%+.1f%%"),
+                    },
+                    hide_index=True,
+                    use_container_width=True
+                )
+                
+                if st.button("✅ Apply Bulk Adjustment", key="bulk_apply"):
+                    record_consensus_changes(all_df, {f'Cons_{m}': bulk_new[:, j] for j, m in enumerate(bulk_months)})
+                    st.rerun()
+        
         # Process data for worksheet
-        edit_df = filtered_df.copy()
+        edit_df = filtered_df
         
         # Calculate percentage hanya untuk adjustment months
         adjustment_months = st.session_state.get('adjustment_months', [])
         edit_df = calculate_pct(edit_df, adjustment_months)
         
         # Define columns to display
-        base_cols = ['sku_code', 'Product_Name', 'Channel', 'Brand', 'SKU_Tier', 'Product_Focus', 'floor_price']
+        base_cols = ['sku_code', 'Product_Name', 'Channel', 'Brand', 'SKU_Tier', 'Product_Focus', 'floor_price', 'row_id']
         
         # Get horizon months
         horizon_months = st.session_state.get('horizon_months', [])
@@ -804,7 +1109,10 @@ with tab1:
             display_cols.extend(hist_cols)
         
         display_cols.extend(['L3M_Avg', 'Stock_Qty', 'Month_Cover'])
-        display_cols.extend(horizon_months)
+        
+        # ROFO month followed by its statistical baseline
+        for m in horizon_months:
+            display_cols.extend([m, f'Stat_{m}'])
         
         # Tambah persentase hanya untuk adjustment months
         display_cols.extend([f'{m}_%' for m in adjustment_months])
@@ -940,8 +1248,18 @@ with tab1:
             }
         """)
         
+        # Consensus cells that differ from ROFO (resumed from consensus_rofo or edited) in amber
         js_edit = JsCode("""
             function(params) {
+                var rofo = params.data[params.colDef.field.substring(5)];
+                if (rofo !== undefined && Number(params.value) !== Number(rofo)) {
+                    return {
+                        'backgroundColor': '#FEF3C7',
+                        'border': '2px solid #F59E0B',
+                        'fontWeight': 'bold',
+                        'color': '#92400E'
+                    };
+                }
                 return {
                     'backgroundColor': '#EFF6FF',
                     'border': '2px solid #60A5FA',
@@ -952,141 +1270,152 @@ with tab1:
         """)
         
         # Configure GridOptions
-        gb = GridOptionsBuilder.from_dataframe(ag_df)
-        
-        # Grid configuration
-        gb.configure_grid_options(
-            rowHeight=38,
-            headerHeight=45,
-            suppressHorizontalScroll=False,
-            domLayout='normal',
-            enableRangeSelection=True,
-            suppressRowClickSelection=False,
-            rowSelection='single',
-            animateRows=True,
-            suppressColumnMoveAnimation=False,
-            enableCellTextSelection=True,
-            ensureDomOrder=True
-        )
+        with span("grid options", rows=len(ag_df)):
+            gb = GridOptionsBuilder.from_dataframe(ag_df)
+        
+            # Grid configuration
+            gb.configure_grid_options(
+                rowHeight=38,
+                headerHeight=45,
+                suppressHorizontalScroll=False,
+                domLayout='normal',
+                enableRangeSelection=True,
+                suppressRowClickSelection=False,
+                rowSelection='single',
+                animateRows=True,
+                suppressColumnMoveAnimation=False,
+                enableCellTextSelection=True,
+                ensureDomOrder=True
+            )
         
-        # Default column configuration
-        gb.configure_default_column(
-            resizable=True,
-            filterable=True,
-            sortable=True,
-            editable=False,
-            minWidth=85,
-            maxWidth=180,
-            flex=1,
-            suppressSizeToFit=False,
-            autoHeight=False,
-            wrapText=False
-        )
+            # Default column configuration
+            gb.configure_default_column(
+                resizable=True,
+                filterable=True,
+                sortable=True,
+                editable=False,
+                minWidth=85,
+                maxWidth=180,
+                flex=1,
+                suppressSizeToFit=False,
+                autoHeight=False,
+                wrapText=False
+            )
         
-        # Configure specific columns
-        # Pinned columns (left side)
-        gb.configure_column("sku_code",
-                          pinned="left",
-                          width=95,
-                          maxWidth=110,
-                          cellStyle=js_sku_focus,
-                          suppressSizeToFit=True,
-                          headerName="SKU Code")
-        
-        gb.configure_column("Product_Name",
-                          pinned="left",
-                          minWidth=180,
-                          maxWidth=300,
-                          flex=2,
-                          suppressSizeToFit=False,
-                          headerName="Product Name",
-                          tooltipField="Product_Name")
-        
-        gb.configure_column("Channel",
-                          pinned="left",
-                          width=110,
-                          maxWidth=130,
-                          cellStyle=js_channel,
-                          suppressSizeToFit=True,
-                          headerName="Channel")
-        
-        # Hidden columns
-        gb.configure_column("Product_Focus", hide=True)
-        gb.configure_column("floor_price", hide=True)
-        
-        # Brand column with coloring
-        gb.configure_column("Brand",
-                          width=110,
-                          maxWidth=140,
-                          cellStyle=js_brand,
-                          flex=1,
-                          suppressSizeToFit=False,
-                          headerName="Brand")
-        
-        # Month cover
-        gb.configure_column("Month_Cover",
-                          width=95,
-                          maxWidth=110,
-                          cellStyle=js_cover,
-                          type=["numericColumn"],
-                          valueFormatter="params.value ? params.value.toFixed(1) : ''",
-                          suppressSizeToFit=True,
-                          headerName="Month Cover")
-        
-        # Sembunyikan bulan-bulan yang tidak dalam adjustment jika mode default
-        if not show_all_months:
+            # Configure specific columns
+            # Pinned columns (left side)
+            gb.configure_column("sku_code",
+                              pinned="left",
+                              width=95,
+                              maxWidth=110,
+                              cellStyle=js_sku_focus,
+                              suppressSizeToFit=True,
+                              headerName="SKU Code")
+        
+            gb.configure_column("Product_Name",
+                              pinned="left",
+                              minWidth=180,
+                              maxWidth=300,
+                              flex=2,
+                              suppressSizeToFit=False,
+                              headerName="Product Name",
+                              tooltipField="Product_Name")
+        
+            gb.configure_column("Channel",
+                              pinned="left",
+                              width=110,
+                              maxWidth=130,
+                              cellStyle=js_channel,
+                              suppressSizeToFit=True,
+                              headerName="Channel")
+        
+            # Hidden columns
+            gb.configure_column("Product_Focus", hide=True)
+            gb.configure_column("floor_price", hide=True)
+            gb.configure_column("row_id", hide=True)
+        
+            # Brand column with coloring
+            gb.configure_column("Brand",
+                              width=110,
+                              maxWidth=140,
+                              cellStyle=js_brand,
+                              flex=1,
+                              suppressSizeToFit=False,
+                              headerName="Brand")
+        
+            # Month cover
+            gb.configure_column("Month_Cover",
+                              width=95,
+                              maxWidth=110,
+                              cellStyle=js_cover,
+                              type=["numericColumn"],
+                              valueFormatter="params.value ? params.value.toFixed(1) : ''",
+                              suppressSizeToFit=True,
+                              headerName="Month Cover")
+        
+            # Sembunyikan bulan-bulan yang tidak dalam adjustment jika mode default
+            if not show_all_months:
+                for m in horizon_months:
+                    if m not in adjustment_months:
+                        gb.configure_column(m, hide=True)
+                        gb.configure_column(f'Stat_{m}', hide=True)
+        
+            # Configure numeric columns (historical and forecast months)
+            for col in display_cols:
+                if col not in ['sku_code', 'Product_Name', 'Channel', 'Brand', 'SKU_Tier', 
+                              'Month_Cover', 'Product_Focus', 'floor_price', 'row_id'] and '%' not in col:
+                    gb.configure_column(col,
+                                      type=["numericColumn"],
+                                      valueFormatter="params.value ? params.value.toLocaleString() : ''",
+                                      minWidth=95,
+                                      maxWidth=130,
+                                      flex=1,
+                                      suppressSizeToFit=False)
+        
+            # Statistical baseline columns
             for m in horizon_months:
-                if m not in adjustment_months:
-                    gb.configure_column(m, hide=True)
-        
-        # Configure numeric columns (historical and forecast months)
-        for col in display_cols:
-            if col not in ['sku_code', 'Product_Name', 'Channel', 'Brand', 'SKU_Tier', 
-                          'Month_Cover', 'Product_Focus', 'floor_price'] and '%' not in col:
-                gb.configure_column(col,
-                                  type=["numericColumn"],
-                                  valueFormatter="params.value ? params.value.toLocaleString() : ''",
-                                  minWidth=95,
-                                  maxWidth=130,
-                                  flex=1,
-                                  suppressSizeToFit=False)
-        
-        # Percentage columns hanya untuk adjustment months
-        for m in adjustment_months:
-            pct_col = f'{m}_%'
-            if pct_col in display_cols:
-                gb.configure_column(pct_col,
-                                  headerName=f"{m} %",
-                                  type=["numericColumn"],
-                                  valueFormatter="params.value ? params.value.toFixed(1) + '%' : ''",
-                                  cellStyle=js_pct,
-                                  minWidth=85,
-                                  maxWidth=100,
-                                  suppressSizeToFit=True)
-        
-        # Editable consensus columns untuk SEMUA adjustment months
-        for m in adjustment_months:
-            cons_col = f'Cons_{m}'
-            if cons_col in display_cols:
-                gb.configure_column(cons_col,
-                                  headerName=f"✏️ {m}",
-                                  editable=True,
-                                  cellStyle=js_edit,
-                                  width=105,
-                                  maxWidth=120,
-                                  pinned="right",
-                                  type=["numericColumn"],
-                                  valueFormatter="params.value ? params.value.toLocaleString() : ''",
-                                  suppressSizeToFit=True)
-        
-        # Configure selection
-        gb.configure_selection('single',
-                             use_checkbox=False,
-                             pre_selected_rows=[],
-                             suppressRowDeselection=False)
-        
-        # Build grid options
-        grid_options = gb.build()
+                stat_col = f'Stat_{m}'
+                if stat_col in display_cols:
+                    gb.configure_column(stat_col,
+                                      headerName=f"📐 {m}",
+                                      headerTooltip=f"Statistical baseline ({stat_model})")
+        
+            # Percentage columns hanya untuk adjustment months
+            for m in adjustment_months:
+                pct_col = f'{m}_%'
+                if pct_col in display_cols:
+                    gb.configure_column(pct_col,
+                                      headerName=f"{m} %",
+                                      type=["numericColumn"],
+                                      valueFormatter="params.value ? params.value.toFixed(1) + '%' : ''",
+                                      cellStyle=js_pct,
+                                      minWidth=85,
+                                      maxWidth=100,
+                                      suppressSizeToFit=True)
+        
+            # Editable consensus columns untuk SEMUA adjustment months
+            for m in adjustment_months:
+                cons_col = f'Cons_{m}'
+                if cons_col in display_cols:
+                    gb.configure_column(cons_col,
+                                      headerName=f"✏️ {m}",
+                                      editable=True,
+                                      cellStyle=js_edit,
+                                      width=105,
+                                      maxWidth=120,
+                                      pinned="right",
+                                      type=["numericColumn"],
+                                      valueFormatter="params.value ? params.value.toLocaleString() : ''",
+                                      suppressSizeToFit=True)
+        
+            # Configure selection
+            gb.configure_selection('single',
+                                 use_checkbox=False,
+                                 pre_selected_rows=[],
+                                 suppressRowDeselection=False)
+        
+            # Build grid options
+            grid_options = gb.build()
         
         # Display the grid
         mode_label = "ALL 12 Months" if show_all_months else f"First {len(adjustment_months)} Months"
@@ -1109,21 +1438,22 @@ with tab1:
             }
             """
         ):
-            grid_response = AgGrid(
-                ag_df,
-                gridOptions=grid_options,
-                allow_unsafe_jscode=True,
-                update_mode=GridUpdateMode.VALUE_CHANGED,
-                height=600,
-                theme='alpine',
-                key='forecast_worksheet',
-                use_container_width=True,
-                fit_columns_on_grid_load=True,
-                enable_enterprise_modules=False,
-                reload_data=False,
-                try_to_convert_back_to_original_types=False,
-                allow_unsafe_html=True
-            )
+            with span("AgGrid", rows=len(ag_df)):
+                grid_response = AgGrid(
+                    ag_df,
+                    gridOptions=grid_options,
+                    allow_unsafe_jscode=True,
+                    update_mode=GridUpdateMode.VALUE_CHANGED,
+                    height=600,
+                    theme='alpine',
+                    key='forecast_worksheet',
+                    use_container_width=True,
+                    fit_columns_on_grid_load=True,
+                    enable_enterprise_modules=False,
+                    reload_data=False,
+                    try_to_convert_back_to_original_types=False,
+                    allow_unsafe_html=True
+                )
         
         # Get updated data
         updated_df = pd.DataFrame(grid_response['data'])
@@ -1132,46 +1462,107 @@ with tab1:
         st.markdown("---")
         st.markdown("### 💾 Data Management")
         
-        col_save, col_push, col_export, col_info = st.columns([1, 1, 1, 2])
+        # Grid edits that are not in the journal yet
+        journal = get_edit_journal()
+        cons_cols = [f'Cons_{m}' for m in adjustment_months]
+        grid_values = grid_consensus_values(ag_df, updated_df, cons_cols)
+        pending_edits = sum(
+            int((~np.isclose(ag_df[col].to_numpy(dtype=float), vals)).sum()) for col, vals in grid_values.items()
+        )
+        
+        col_save, col_push, col_export, col_undo, col_info = st.columns([1, 1, 1, 1, 2])
         
         with col_save:
             if st.button("💾 **Save Locally**", type="primary", use_container_width=True):
-                st.session_state.edited_v5 = updated_df.copy()
-                st.success("✅ Data saved to session state!")
+                saved = record_consensus_changes(ag_df, grid_values)
+                st.success(f"✅ {saved:,} edits saved to session journal!")
         
         with col_push:
             if st.button("☁️ **Push to GSheets**", type="secondary", use_container_width=True):
-                if 'edited_v5' not in st.session_state:
+                if pending_edits:
                     st.warning("⚠️ Please save locally first!")
                 else:
-                    with st.spinner("Uploading to Google Sheets..."):
+                    with st.spinner("Merging with the latest consensus_rofo..."):
                         # Prepare data for export
                         keep_cols = ['sku_code', 'Product_Name', 'Channel', 'Brand', 'SKU_Tier', 'Product_Focus']
-                        keep_cols.extend([f'Cons_{m}' for m in adjustment_months])
+                        keep_cols.extend(cons_cols)
                         
-                        final_df = st.session_state.edited_v5[keep_cols].copy()
-                        final_df['Last_Update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        final_df['Updated_By'] = "S&OP Dashboard"
+                        push_base = baseline_df.set_index('row_id').loc[ag_df['row_id'], keep_cols].reset_index(drop=True)
+                        push_local = ag_df[keep_cols].reset_index(drop=True)
                         
                         gs = GSheetConnector()
-                        success, message = gs.save_data(final_df, "consensus_rofo")
+                        try:
+                            remote_values = gs.read_values("consensus_rofo")
+                            remote_df = pd.DataFrame(remote_values[1:], columns=remote_values[0]) if remote_values else pd.DataFrame()
+                            merge = merge_consensus(
+                                push_local, push_base, remote_df, cons_cols,
+                                seen_versions=st.session_state.get('consensus_seen_versions'),
+                                pushed_df=st.session_state.get('consensus_pushed'),
+                                updated_by=st.session_state.get('planner_name', "S&OP Dashboard")
+                            )
+                            if merge.to_write.empty:
+                                success, message = True, "Nothing new to write"
+                            else:
+                                success, message = gs.upsert_rows(merge.to_write, "consensus_rofo", KEY_COLS,
+                                                                  existing_values=remote_values)
+                        except Exception as e:
+                            success, message, merge = False, f"Save error: {str(e)}", None
                         
                         if success:
+                            # Remember what this session wrote so its own rows are not seen as foreign edits
+                            written = merge.to_write.set_index(KEY_COLS)[cons_cols]
+                            pushed = st.session_state.get('consensus_pushed', pd.DataFrame())
+                            st.session_state.consensus_pushed = pd.concat(
+                                [pushed[~pushed.index.isin(written.index)], written]) if not pushed.empty else written
+                            # Sessions started from now on resume from this push; API readers see it too
+                            fetch_sheet.clear("consensus_rofo")
+                            sheet_df = sheet_after_push(remote_df, merge.to_write)
+                            if not merge.to_write.empty:
+                                publish_consensus(sheet_df, dataset=dataset_key)
+                            
+                            # Keep this cycle's numbers for the accuracy backtest, as the sheet now has them
+                            # (cells kept from other planners included)
+                            try:
+                                archive_forecast(apply_saved(ag_df, saved_consensus(ag_df, sheet_df, cons_cols)),
+                                                 selected_start_str, horizon_months)
+                            except Exception as e:
+                                st.warning(f"⚠️ Pushed, but the backtest archive was not updated: {str(e)}")
                             st.balloons()
-                            st.success("✅ Successfully uploaded to Google Sheets!")
+                            st.success(f"✅ Successfully uploaded to Google Sheets! {merge.written_cells:,} cells written. {message}")
+                            if merge.accepted_remote:
+                                st.info(f"🤝 Kept {merge.accepted_remote:,} cells edited by other planners.")
                         else:
                             st.error(f"❌ {message}")
+                        
+                        if merge is not None and not merge.conflicts.empty:
+                            st.warning(f"⚠️ {len(merge.conflicts):,} cells were changed by another planner since you loaded. "
+                                       "Their values were kept; re-apply yours if needed.")
+                            st.dataframe(merge.conflicts, hide_index=True, use_container_width=True)
         
         with col_export:
             if st.button("📥 **Export CSV**", use_container_width=True):
-                if 'edited_v5' in st.session_state:
-                    csv_data = st.session_state.edited_v5.to_csv(index=False)
-                    st.download_button(
-                        label="Download CSV",
-                        data=csv_data,
-                        file_name=f"forecast_consensus_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                        mime="text/csv"
-                    )
+                csv_data = ag_df.drop(columns=['row_id']).to_csv(index=False)
+                st.download_button(
+                    label="Download CSV",
+                    data=csv_data,
+                    file_name=f"forecast_consensus_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                    mime="text/csv"
+                )
+        
+        with col_undo:
+            col_u, col_r = st.columns(2)
+            with col_u:
+                if st.button("↩️", help="Undo last saved edit", disabled=not journal.can_undo, use_container_width=True):
+                    journal.undo()
+                    st.rerun()
+            with col_r:
+                if st.button("↪️", help="Redo", disabled=not journal.can_redo, use_container_width=True):
+                    journal.redo()
+                    st.rerun()
+            resumed = sum(len(positions) for positions, _ in st.session_state.consensus_saved[1].values())
+            st.caption(f"🧾 {len(journal):,} edits · {journal.nbytes / 1024:,.1f} KB"
+                       + (f" · ✏️ {pending_edits:,} unsaved" if pending_edits else "")
+                       + (f" · ☁️ {resumed:,} resumed from consensus_rofo" if resumed else ""))
         
         with col_info:
             # Calculate totals for adjustment months
@@ -1186,293 +1577,511 @@ with tab1:
                 f"{total_consensus:,.0f}",
                 f"Adjustable Months: {', '.join(adjustment_months[:3])}" + ("..." if len(adjustment_months) > 3 else "")
             )
+        
+        with st.expander("🧾 Edit History", expanded=False):
+            if len(journal):
+                history = journal.to_frame().merge(all_df[['row_id', 'sku_code', 'Channel']], on='row_id', how='left')
+                st.dataframe(history.drop(columns=['row_id']).tail(200).iloc[::-1], hide_index=True, use_container_width=True)
+            else:
+                st.caption("No saved edits in this session yet.")
 
 # ============================================================================
 # TAB 2: ANALYTICS DASHBOARD
 # ============================================================================
-with tab2:
-    # --- Analytics Header ---
-    st.markdown("""
-        <div style="background-color: #f8fafc; padding: 10px; border-radius: 10px; border-left: 5px solid #1E40AF; margin-bottom: 20px;">
-            <h3 style="margin:0;">📊 Strategic Forecast Analytics</h3>
-            <p style="margin:0; color: #64748b; font-size: 0.9rem;">Deep dive into volume trends, revenue projections, and brand performance.</p>
-        </div>
-    """, unsafe_allow_html=True)
+with tab2, span("tab2 Analytics"):
+    if tab_open(tab2):
+        import plotly.express as px
+        from streamlit_extras.metric_cards import style_metric_cards
+        
+        # --- Analytics Header ---
+        st.markdown("""
+            <div style="background-color: #f8fafc; padding: 10px; border-radius: 10px; border-left: 5px solid #1E40AF; margin-bottom: 20px;">
+                <h3 style="margin:0;">📊 Strategic Forecast Analytics</h3>
+                <p style="margin:0; color: #64748b; font-size: 0.9rem;">Deep dive into volume trends, revenue projections, and brand performance.</p>
+            </div>
+        """, unsafe_allow_html=True)
     
-    # Use updated data if available
-    base_df = updated_df if 'updated_df' in locals() and not updated_df.empty else filtered_df
+        # Use updated data if available
+        base_df = updated_df if 'updated_df' in locals() and not updated_df.empty else filtered_df
     
-    if base_df.empty:
-        st.warning("No data available for analytics. Please check filters or load data.")
-        st.stop()
+        if base_df.empty:
+            st.warning("No data available for analytics. Please check filters or load data.")
+            st.stop()
 
-    full_horizon = st.session_state.get('horizon_months', [])
+        full_horizon = st.session_state.get('horizon_months', [])
     
-    # --- Top Controls ---
-    col_ctrl1, col_ctrl2, col_ctrl3 = st.columns([2, 1, 1])
-    with col_ctrl1:
-        chart_view = st.segmented_control(
-            "**Dimension View:**",
-            ["Total Volume", "Brand Performance", "Channel Mix"],
-            default="Brand Performance"
-        )
-    with col_ctrl2:
-        val_mode = st.toggle("💰 Show in Value (IDR)", value=False)
-    with col_ctrl3:
-        show_2026_only = st.checkbox("📅 2026 Only", value=True)
+        # --- Top Controls ---
+        col_ctrl1, col_ctrl2, col_ctrl3 = st.columns([2, 1, 1])
+        with col_ctrl1:
+            chart_view = st.segmented_control(
+                "**Dimension View:**",
+                ["Total Volume", "Brand Performance", "Channel Mix"],
+                default="Brand Performance"
+            )
+        with col_ctrl2:
+            val_mode = st.toggle("💰 Show in Value (IDR)", value=False)
+        with col_ctrl3:
+            show_2026_only = st.checkbox("📅 2026 Only", value=True)
 
-    # Filter months
-    active_months = [m for m in full_horizon if "-26" in m] if show_2026_only else full_horizon
+        # Filter months
+        active_months = [m for m in full_horizon if "-26" in m] if show_2026_only else full_horizon
     
-    # --- Data Processing for Analytics ---
-    calc_df = base_df.copy()
-    for m in active_months:
-        # Source prioritization: Consensus -> Original Horizon Month
-        source_col = f'Cons_{m}' if f'Cons_{m}' in calc_df.columns else m
-        if source_col in calc_df.columns:
-            calc_df[f'Qty_{m}'] = pd.to_numeric(calc_df[source_col], errors='coerce').fillna(0)
-            calc_df[f'Val_{m}'] = calc_df[f'Qty_{m}'] * calc_df.get('floor_price', 0)
-        else:
-            calc_df[f'Qty_{m}'] = 0
-            calc_df[f'Val_{m}'] = 0
+        # --- Data Processing for Analytics ---
+        calc_df = analytics_frame(base_df, active_months)
 
-    # --- Metrics Section ---
-    total_vol = sum(calc_df[f'Qty_{m}'].sum() for m in active_months if f'Qty_{m}' in calc_df.columns)
-    total_rev = sum(calc_df[f'Val_{m}'].sum() for m in active_months if f'Val_{m}' in calc_df.columns)
+        # --- Metrics Section ---
+        total_vol = sum(calc_df[f'Qty_{m}'].sum() for m in active_months if f'Qty_{m}' in calc_df.columns)
+        total_rev = sum(calc_df[f'Val_{m}'].sum() for m in active_months if f'Val_{m}' in calc_df.columns)
     
-    # Comparison M1-M3 vs L3M
-    m1_m3 = adjustment_months[:3]
-    m1_m3_vol = sum(calc_df[f'Qty_{m}'].sum() for m in m1_m3 if f'Qty_{m}' in calc_df.columns)
-    l3m_total_avg = calc_df['L3M_Avg'].sum() * 3 if 'L3M_Avg' in calc_df.columns else 0
-    growth_vs_l3m = ((m1_m3_vol / l3m_total_avg) - 1) if l3m_total_avg > 0 else 0
-
-    m1, m2, m3 = st.columns(3)
-    with m1:
-        st.metric("📦 Projected Volume", f"{total_vol:,.0f} units", delta=f"{len(active_months)} Months")
-    with m2:
-        st.metric("💰 Projected Revenue", f"Rp {total_rev:,.0f}", delta="Estimated", delta_color="normal")
-    with m3:
-        st.metric("📈 Growth (M1-M3 vs L3M)", f"{growth_vs_l3m:+.1%}", 
-                  delta="Target > 10%" if growth_vs_l3m > 0.1 else "Below Target",
-                  delta_color="normal" if growth_vs_l3m > 0.1 else "inverse")
+        # Comparison M1-M3 vs L3M
+        m1_m3 = adjustment_months[:3]
+        m1_m3_vol = sum(calc_df[f'Qty_{m}'].sum() for m in m1_m3 if f'Qty_{m}' in calc_df.columns)
+        l3m_total_avg = calc_df['L3M_Avg'].sum() * 3 if 'L3M_Avg' in calc_df.columns else 0
+        growth_vs_l3m = ((m1_m3_vol / l3m_total_avg) - 1) if l3m_total_avg > 0 else 0
+
+        m1, m2, m3 = st.columns(3)
+        with m1:
+            st.metric("📦 Projected Volume", f"{total_vol:,.0f} units", delta=f"{len(active_months)} Months")
+        with m2:
+            st.metric("💰 Projected Revenue", f"Rp {total_rev:,.0f}", delta="Estimated", delta_color="normal")
+        with m3:
+            st.metric("📈 Growth (M1-M3 vs L3M)", f"{growth_vs_l3m:+.1%}", 
+                      delta="Target > 10%" if growth_vs_l3m > 0.1 else "Below Target",
+                      delta_color="normal" if growth_vs_l3m > 0.1 else "inverse")
     
-    style_metric_cards(background_color="#FFFFFF", border_left_color="#1E40AF", border_size_px=1, box_shadow=True)
+        style_metric_cards(background_color="#FFFFFF", border_left_color="#1E40AF", border_size_px=1, box_shadow=True)
 
-    # --- Visual Analysis Section ---
-    st.markdown("---")
+        # --- Visual Analysis Section ---
+        st.markdown("---")
     
-    if chart_view == "Brand Performance":
-        col_table, col_chart = st.columns([1, 1])
-        
-        # 1. Prepare Brand Table Data
-        brand_data = []
-        if 'Brand' in calc_df.columns:
-            for brand in calc_df['Brand'].unique():
-                b_vol = sum(calc_df[calc_df['Brand'] == brand][f'Qty_{m}'].sum() for m in active_months if f'Qty_{m}' in calc_df.columns)
-                b_rev = sum(calc_df[calc_df['Brand'] == brand][f'Val_{m}'].sum() for m in active_months if f'Val_{m}' in calc_df.columns)
-                brand_data.append({"Brand": brand, "Volume": b_vol, "Revenue": b_rev})
-        
-        if brand_data:
-            brand_summary = pd.DataFrame(brand_data).sort_values("Revenue", ascending=False)
-            brand_summary['Share %'] = (brand_summary['Revenue'] / total_rev * 100).round(1) if total_rev > 0 else 0
+        if chart_view == "Brand Performance":
+            col_table, col_chart = st.columns([1, 1])
+        
+            # 1. Prepare Brand Table Data
+            brand_table = brand_summary(calc_df, active_months) if 'Brand' in calc_df.columns else pd.DataFrame()
+        
+            if not brand_table.empty:
+                brand_table['Share %'] = (brand_table['Revenue'] / total_rev * 100).round(1) if total_rev > 0 else 0
             
-            with col_table:
-                st.markdown("##### 🏆 Ranking by Revenue Share")
-                st.dataframe(
-                    brand_summary,
-                    column_config={
-                        "Brand": st.column_config.TextColumn("Brand Name"),
-                        "Volume": st.column_config.NumberColumn("Total Qty", format="%d"),
-                        "Revenue": st.column_config.NumberColumn("Total IDR", format="Rp %d"),
-                        "Share %": st.column_config.ProgressColumn("Market Share", min_value=0, max_value=100, format="%.1f%%")
-                    },
-                    hide_index=True,
-                    use_container_width=True
-                )
-        else:
-            with col_table:
-                st.warning("No brand data available")
-
-        with col_chart:
-            st.markdown("##### 📈 Trend Analysis")
-            if 'Brand' in calc_df.columns:
-                # Pivot data for chart
-                plot_list = []
-                for m in active_months:
-                    if f'Val_{m}' if val_mode else f'Qty_{m}' in calc_df.columns:
-                        temp = calc_df.groupby('Brand')[f'Val_{m}' if val_mode else f'Qty_{m}'].sum().reset_index()
-                        temp['Month'] = m
-                        temp.columns = ['Brand', 'Value', 'Month']
-                        plot_list.append(temp)
+                with col_table:
+                    st.markdown("##### 🏆 Ranking by Revenue Share")
+                    st.dataframe(
+                        brand_table,
+                        column_config={
+                            "Brand": st.column_config.TextColumn("Brand Name"),
+                            "Volume": st.column_config.NumberColumn("Total Qty", format="%d"),
+                            "Revenue": st.column_config.NumberColumn("Total IDR", format="Rp %d"),
+                            "Share %": st.column_config.ProgressColumn("Market Share", min_value=0, max_value=100, format="%.1f%%")
+                        },
+                        hide_index=True,
+                        use_container_width=True
+                    )
+            else:
+                with col_table:
+                    st.warning("No brand data available")
+
+            with col_chart:
+                st.markdown("##### 📈 Trend Analysis")
+                if 'Brand' in calc_df.columns:
+                    # Pivot data for chart
+                    plot_df = monthly_by(calc_df, active_months, 'Brand', val_mode)
                 
-                if plot_list:
-                    plot_df = pd.concat(plot_list)
+                    if not plot_df.empty:
                     
-                    fig = px.line(plot_df, x='Month', y='Value', color='Brand', markers=True,
-                                 color_discrete_sequence=px.colors.qualitative.Prism)
-                    fig.update_layout(
-                        margin=dict(l=20, r=20, t=20, b=20),
-                        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                        hovermode="x unified"
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
+                        fig = px.line(plot_df, x='Month', y='Value', color='Brand', markers=True,
+                                     color_discrete_sequence=px.colors.qualitative.Prism)
+                        fig.update_layout(
+                            margin=dict(l=20, r=20, t=20, b=20),
+                            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                            hovermode="x unified"
+                        )
+                        render_chart(fig)
+                    else:
+                        st.info("No data available for trend analysis")
                 else:
-                    st.info("No data available for trend analysis")
-            else:
-                st.warning("Brand column not found")
-
-    elif chart_view == "Channel Mix":
-        st.markdown("##### 🛒 Channel Contribution over Time")
-        if 'Channel' in calc_df.columns:
-            chan_list = []
-            for m in active_months:
-                if f'Val_{m}' if val_mode else f'Qty_{m}' in calc_df.columns:
-                    temp = calc_df.groupby('Channel')[f'Val_{m}' if val_mode else f'Qty_{m}'].sum().reset_index()
-                    temp['Month'] = m
-                    temp.columns = ['Channel', 'Value', 'Month']
-                    chan_list.append(temp)
+                    st.warning("Brand column not found")
+
+        elif chart_view == "Channel Mix":
+            st.markdown("##### 🛒 Channel Contribution over Time")
+            if 'Channel' in calc_df.columns:
+                chan_df = monthly_by(calc_df, active_months, 'Channel', val_mode)
             
-            if chan_list:
-                chan_df = pd.concat(chan_list)
-                fig = px.bar(chan_df, x='Month', y='Value', color='Channel', 
-                             text_auto='.2s', barmode='group',
-                             color_discrete_map={'E-commerce': '#F97316', 'Reseller': '#0EA5E9', 'Clinical': '#8B5CF6'})
-                st.plotly_chart(fig, use_container_width=True)
+                if not chan_df.empty:
+                    fig = px.bar(chan_df, x='Month', y='Value', color='Channel', 
+                                 text_auto='.2s', barmode='group',
+                                 color_discrete_map={'E-commerce': '#F97316', 'Reseller': '#0EA5E9', 'Clinical': '#8B5CF6'})
+                    render_chart(fig)
+                else:
+                    st.info("No channel data available")
             else:
-                st.info("No channel data available")
-        else:
-            st.warning("Channel column not found")
-
-    else: # Total Volume View
-        st.markdown("##### 📦 Monthly Aggregate Demand")
-        agg_data = []
-        for m in active_months:
-            if f'Val_{m}' if val_mode else f'Qty_{m}' in calc_df.columns:
-                agg_data.append({
-                    "Month": m,
-                    "Value": calc_df[f'Val_{m}' if val_mode else f'Qty_{m}'].sum()
-                })
-        
-        if agg_data:
-            agg_df = pd.DataFrame(agg_data)
+                st.warning("Channel column not found")
+
+        else: # Total Volume View
+            st.markdown("##### 📦 Monthly Aggregate Demand")
+            agg_df = monthly_total(calc_df, active_months, val_mode)
+        
+            if not agg_df.empty:
             
-            fig = px.area(agg_df, x='Month', y='Value', 
-                          color_discrete_sequence=['#1E40AF'],
-                          labels={'Value': 'Revenue (IDR)' if val_mode else 'Volume (Units)'})
-            fig.update_traces(fillcolor="rgba(30, 64, 175, 0.2)", line_width=4)
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("No monthly data available")
+                fig = px.area(agg_df, x='Month', y='Value', 
+                              color_discrete_sequence=['#1E40AF'],
+                              labels={'Value': 'Revenue (IDR)' if val_mode else 'Volume (Units)'})
+                fig.update_traces(fillcolor="rgba(30, 64, 175, 0.2)", line_width=4)
+                render_chart(fig)
+            else:
+                st.info("No monthly data available")
 
-    # --- Insight Expander ---
-    with st.expander("💡 Key Strategic Insights", expanded=True):
-        try:
-            # 1. Cari SKU Terpopuler
-            qty_cols_available = [c for c in calc_df.columns if c.startswith('Qty_')]
+        # --- Scenario Comparison ---
+        if len(get_scenario_store().names) > 1 and 'Brand' in baseline_df.columns:
+            st.markdown("---")
+            st.markdown(f"##### 🧪 Scenario Comparison by Brand ({', '.join(adjustment_months[:3])}{'...' if len(adjustment_months) > 3 else ''})")
+            brand_cmp = scenario_comparison(baseline_df, filtered_df['row_id'], adjustment_months, 'Brand')
+        
+            cmp_table, cmp_chart = st.columns([1, 1])
+            with cmp_table:
+                st.dataframe(brand_cmp, hide_index=True, use_container_width=True,
+                             column_config={n: st.column_config.NumberColumn(n, format="%d") for n in get_scenario_store().names})
+            with cmp_chart:
+                cmp_long = brand_cmp.melt(id_vars='Brand', var_name='Scenario', value_name='Volume')
+                fig = px.bar(cmp_long, x='Brand', y='Volume', color='Scenario', barmode='group',
+                             color_discrete_sequence=px.colors.qualitative.Prism)
+                fig.update_layout(margin=dict(l=20, r=20, t=20, b=20),
+                                  legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+                render_chart(fig)
+
+        # --- Insight Expander ---
+        with st.expander("💡 Key Strategic Insights", expanded=True):
+            try:
+                # 1. Cari SKU Terpopuler
+                qty_cols_available = [c for c in calc_df.columns if c.startswith('Qty_')]
             
-            if qty_cols_available and not calc_df.empty:
-                temp_total = calc_df[qty_cols_available].sum(axis=1)
-                if not temp_total.empty and temp_total.max() > 0:
-                    top_idx = temp_total.idxmax()
-                    top_sku_name = calc_df.loc[top_idx, 'Product_Name'] if 'Product_Name' in calc_df.columns else f"SKU-{top_idx}"
-                    top_sku_val = temp_total.max()
+                if qty_cols_available and not calc_df.empty:
+                    temp_total = calc_df[qty_cols_available].sum(axis=1)
+                    if not temp_total.empty and temp_total.max() > 0:
+                        top_idx = temp_total.idxmax()
+                        top_sku_name = calc_df.loc[top_idx, 'Product_Name'] if 'Product_Name' in calc_df.columns else f"SKU-{top_idx}"
+                        top_sku_val = temp_total.max()
                     
-                    st.write(f"🌟 **Leading SKU:** `{top_sku_name}` adalah pendorong volume terbesar dengan proyeksi **{top_sku_val:,.0f} units**.")
+                        st.write(f"🌟 **Leading SKU:** `{top_sku_name}` adalah pendorong volume terbesar dengan proyeksi **{top_sku_val:,.0f} units**.")
+                    else:
+                        st.write("🌟 **Leading SKU:** Tidak ada data volume yang signifikan.")
                 else:
-                    st.write("🌟 **Leading SKU:** Tidak ada data volume yang signifikan.")
-            else:
-                st.write("🌟 **Leading SKU:** Belum ada data volume yang terhitung.")
+                    st.write("🌟 **Leading SKU:** Belum ada data volume yang terhitung.")
 
-            # 2. Analisis Stok
-            if 'Month_Cover' in calc_df.columns:
-                low_stock_count = len(calc_df[calc_df['Month_Cover'] < 0.5])
-                if low_stock_count > 0:
-                    st.warning(f"⚠️ **Stock Alert:** Ada {low_stock_count} SKU dengan level stok kritis (<0.5 MoS).")
-                else:
-                    st.success("✅ **Inventory Health:** Tidak ada proyeksi stock-out kritis pada filter ini.")
+                # 2. Analisis Stok
+                if 'Month_Cover' in calc_df.columns:
+                    low_stock_count = len(calc_df[calc_df['Month_Cover'] < 0.5])
+                    if low_stock_count > 0:
+                        st.warning(f"⚠️ **Stock Alert:** Ada {low_stock_count} SKU dengan level stok kritis (<0.5 MoS).")
+                    else:
+                        st.success("✅ **Inventory Health:** Tidak ada proyeksi stock-out kritis pada filter ini.")
             
-            # 3. Revenue Insight
-            if total_rev > 0:
-                st.info(f"💰 **Revenue Focus:** Total estimasi revenue sebesar **Rp {total_rev:,.0f}** terkonsentrasi pada `{len(active_months)}` bulan aktif.")
+                # 3. Revenue Insight
+                if total_rev > 0:
+                    st.info(f"💰 **Revenue Focus:** Total estimasi revenue sebesar **Rp {total_rev:,.0f}** terkonsentrasi pada `{len(active_months)}` bulan aktif.")
 
-        except Exception as e:
-            st.error(f"Pesan teknis: Insights belum bisa dimuat karena perbedaan struktur kolom.")
+            except Exception as e:
+                st.error(f"Pesan teknis: Insights belum bisa dimuat karena perbedaan struktur kolom.")
 
 # ============================================================================
 # TAB 3: SUMMARY REPORTS
 # ============================================================================
-with tab3:
-    st.markdown("### 📋 Executive Summary Reports")
+with tab3, span("tab3 Summary"):
+    if tab_open(tab3):
+        import plotly.express as px
+        
+        st.markdown("### 📋 Executive Summary Reports")
     
-    report_df = updated_df if 'updated_df' in locals() and not updated_df.empty else filtered_df
+        report_df = updated_df if 'updated_df' in locals() and not updated_df.empty else filtered_df
     
-    if report_df.empty:
-        st.warning("Data kosong. Silakan sesuaikan filter.")
-    else:
-        # Hitung ulang Total_Forecast
-        adj_cols = [f'Cons_{m}' for m in adjustment_months if f'Cons_{m}' in report_df.columns]
-        # Jika kolom Cons_ belum ada (belum diedit), gunakan kolom bulan asli
-        if not adj_cols:
-            adj_cols = [m for m in adjustment_months if m in report_df.columns]
-        
-        # Buat kolom temporary untuk sorting di Tab 3
-        report_df = report_df.copy()
-        if adj_cols:
-            report_df['Temp_Total'] = report_df[adj_cols].sum(axis=1)
+        if report_df.empty:
+            st.warning("Data kosong. Silakan sesuaikan filter.")
         else:
-            report_df['Temp_Total'] = 0
-        
-        # --- Metrics Calculation ---
-        total_f_qty = report_df['Temp_Total'].sum()
-        total_l3m_qty = (report_df['L3M_Avg'].sum() * len(adjustment_months)) if 'L3M_Avg' in report_df.columns else 0
-        growth_pct = ((total_f_qty / total_l3m_qty) - 1) * 100 if total_l3m_qty > 0 else 0
-
-        r1, r2 = st.columns([2, 1])
-        with r1:
-            st.info(f"💡 **S&OP Perspective:** Forecast periode ini menunjukkan tren **{'Naik' if growth_pct > 0 else 'Turun'} {abs(growth_pct):.1f}%** dibandingkan rata-rata penjualan 3 bulan terakhir.")
-        
-        # 1. Top 10 SKU
-        st.markdown("#### 🎯 Focus Area: Top SKU Contribution")
-        top_10_skus = report_df.nlargest(10, 'Temp_Total')
-        
-        st.dataframe(
-            top_10_skus[['sku_code', 'Product_Name', 'Brand', 'L3M_Avg', 'Temp_Total', 'Month_Cover']],
-            column_config={
-                "Temp_Total": st.column_config.NumberColumn("Total Forecast", format="%d 📦"),
-                "L3M_Avg": st.column_config.NumberColumn("L3M Avg", format="%d"),
-                "Month_Cover": st.column_config.NumberColumn("MoS", format="%.1f Mo"),
-            },
-            use_container_width=True,
-            hide_index=True
-        )
+            # Hitung ulang Total_Forecast (kolom temporary untuk sorting di Tab 3)
+            report_df = report_totals(report_df, adjustment_months)
+        
+            # --- Metrics Calculation ---
+            total_f_qty = report_df['Temp_Total'].sum()
+            total_l3m_qty = (report_df['L3M_Avg'].sum() * len(adjustment_months)) if 'L3M_Avg' in report_df.columns else 0
+            growth_pct = ((total_f_qty / total_l3m_qty) - 1) * 100 if total_l3m_qty > 0 else 0
 
-        st.markdown("---")
-        c1, c2 = st.columns(2)
-        with c1:
-            st.markdown("##### 📦 Inventory Risk Matrix")
-            if 'Month_Cover' in report_df.columns:
-                risk_counts = {
-                    "Critical Out (MoS < 0.5)": len(report_df[report_df['Month_Cover'] < 0.5]),
-                    "Understock (0.5 - 1.0)": len(report_df[(report_df['Month_Cover'] >= 0.5) & (report_df['Month_Cover'] < 1.0)]),
-                    "Optimal (1.0 - 1.5)": len(report_df[(report_df['Month_Cover'] >= 1.0) & (report_df['Month_Cover'] <= 1.5)]),
-                    "Overstock (> 1.5)": len(report_df[report_df['Month_Cover'] > 1.5])
-                }
-                for label, count in risk_counts.items():
-                    color = "red" if "Critical" in label else "orange" if "Under" in label else "green" if "Optimal" in label else "blue"
-                    st.markdown(f"- **{label}**: :{color}[{count} SKUs]")
+            r1, r2 = st.columns([2, 1])
+            with r1:
+                st.info(f"💡 **S&OP Perspective:** Forecast periode ini menunjukkan tren **{'Naik' if growth_pct > 0 else 'Turun'} {abs(growth_pct):.1f}%** dibandingkan rata-rata penjualan 3 bulan terakhir.")
+        
+            # 1. Top 10 SKU
+            st.markdown("#### 🎯 Focus Area: Top SKU Contribution")
+            top_10_skus = report_df.nlargest(10, 'Temp_Total')
+        
+            st.dataframe(
+                top_10_skus[['sku_code', 'Product_Name', 'Brand', 'L3M_Avg', 'Temp_Total', 'Month_Cover']],
+                column_config={
+                    "Temp_Total": st.column_config.NumberColumn("Total Forecast", format="%d 📦"),
+                    "L3M_Avg": st.column_config.NumberColumn("L3M Avg", format="%d"),
+                    "Month_Cover": st.column_config.NumberColumn("MoS", format="%.1f Mo"),
+                },
+                use_container_width=True,
+                hide_index=True
+            )
+
+            st.markdown("---")
+            c1, c2 = st.columns(2)
+            with c1:
+                st.markdown("##### 📦 Inventory Risk Matrix")
+                if 'Month_Cover' in report_df.columns:
+                    for label, count in risk_counts(report_df).items():
+                        color = "red" if "Critical" in label else "orange" if "Under" in label else "green" if "Optimal" in label else "blue"
+                        st.markdown(f"- **{label}**: :{color}[{count} SKUs]")
+                else:
+                    st.warning("Month_Cover column not found")
+
+            with c2:
+                st.markdown("##### 🏷️ Brand Concentration")
+                if 'Brand' in report_df.columns and 'Temp_Total' in report_df.columns:
+                    brand_pie = px.pie(report_df, values='Temp_Total', names='Brand', hole=0.4,
+                                     color_discrete_sequence=px.colors.qualitative.Safe)
+                    brand_pie.update_layout(margin=dict(l=0, r=0, t=0, b=0), height=200, showlegend=False)
+                    render_chart(brand_pie)
+                else:
+                    st.warning("Brand or Temp_Total column not found")
+        
+            # Scenario totals per channel
+            if len(get_scenario_store().names) > 1 and 'Channel' in baseline_df.columns:
+                st.markdown("---")
+                st.markdown("##### 🧪 Scenario Comparison by Channel")
+                chan_cmp = scenario_comparison(baseline_df, report_df['row_id'], adjustment_months, 'Channel')
+                scenario_names = get_scenario_store().names
+                for name in scenario_names[1:]:
+                    chan_cmp[f'{name} vs {BASE_SCENARIO} %'] = np.where(
+                        chan_cmp[BASE_SCENARIO] > 0,
+                        ((chan_cmp[name] / chan_cmp[BASE_SCENARIO].where(chan_cmp[BASE_SCENARIO] > 0, 1)) - 1) * 100, 0).round(1)
+                st.dataframe(chan_cmp, hide_index=True, use_container_width=True,
+                             column_config={n: st.column_config.NumberColumn(n, format="%d") for n in scenario_names})
+
+# ============================================================================
+# TAB 4: FORECAST ACCURACY
+# ============================================================================
+with tab4, span("tab4 Accuracy"):
+    if tab_open(tab4):
+        st.markdown("### 🎯 Forecast Accuracy Backtest")
+        st.caption("Archived ROFO / consensus from each push, scored against actuals in sales_history.")
+    
+        archived_cycles = list_cycles()
+        if not archived_cycles:
+            st.info("No archived cycles yet. Every **Push to GSheets** stores that cycle's forecast for backtesting.")
+        else:
+            acc1, acc2, acc3 = st.columns([2, 1, 1])
+            with acc1:
+                cycle_labels = [c for c, _ in archived_cycles]
+                sel_cycles = st.multiselect("🗓️ Cycles", cycle_labels, default=cycle_labels)
+            with acc2:
+                acc_level = st.selectbox("📊 Level", list(ACCURACY_LEVELS.keys()), index=1)
+            with acc3:
+                sel_lags = st.multiselect("⏱️ Lag", [1, 2, 3], default=[1, 2, 3], format_func=lambda l: f"M{l}")
+        
+            cycle_mtimes = dict(archived_cycles)
+            error_frames = [load_cycle_errors(c, cycle_mtimes[c]) for c in sel_cycles]
+            error_frames = [e for e in error_frames if not e.empty]
+        
+            errors_df = pd.concat(error_frames, ignore_index=True) if error_frames else pd.DataFrame()
+        
+            # Headline numbers across all selected lags
+            overall_df = accuracy_table(errors_df, level='Total', lags=sel_lags, by_lag=False)
+        
+            if overall_df.empty:
+                st.warning("Selected cycles have no months with actuals yet for the chosen lags.")
             else:
-                st.warning("Month_Cover column not found")
-
-        with c2:
-            st.markdown("##### 🏷️ Brand Concentration")
-            if 'Brand' in report_df.columns and 'Temp_Total' in report_df.columns:
-                brand_pie = px.pie(report_df, values='Temp_Total', names='Brand', hole=0.4,
-                                 color_discrete_sequence=px.colors.qualitative.Safe)
-                brand_pie.update_layout(margin=dict(l=0, r=0, t=0, b=0), height=200, showlegend=False)
-                st.plotly_chart(brand_pie, use_container_width=True)
+                overall = overall_df.fillna(0).iloc[0]
+            
+                a1, a2, a3, a4 = st.columns(4)
+                with a1:
+                    st.metric("WMAPE ROFO", f"{overall['WMAPE_ROFO']:.1f}%")
+                with a2:
+                    st.metric("WMAPE Consensus", f"{overall['WMAPE_Consensus']:.1f}%")
+                with a3:
+                    st.metric("Bias Consensus", f"{overall['Bias_Consensus']:+.1f}%")
+                with a4:
+                    st.metric("FVA vs ROFO", f"{overall['FVA_vs_ROFO']:+.1f} pts",
+                              delta="Consensus adds value" if overall['FVA_vs_ROFO'] > 0 else "Consensus adds error",
+                              delta_color="normal" if overall['FVA_vs_ROFO'] > 0 else "inverse")
+            
+                acc_df = accuracy_table(errors_df, level=acc_level, lags=sel_lags)
+                acc_df['Lag'] = 'M' + acc_df['Lag'].astype(str)
+                st.dataframe(
+                    acc_df,
+                    column_config={
+                        "Actual": st.column_config.NumberColumn("Actual Qty", format="%d"),
+                        "FVA_vs_ROFO": st.column_config.NumberColumn("FVA vs ROFO", format="%+.1f"),
+                        "FVA_vs_Stat": st.column_config.NumberColumn("FVA vs Stat", format="%+.1f"),
+                    },
+                    hide_index=True,
+                    use_container_width=True
+                )
+
+# ============================================================================
+# TAB 5: ROFO CHANGES
+# ============================================================================
+with tab5, span("tab5 ROFO Changes"):
+    if tab_open(tab5):
+        st.markdown("### 🔀 ROFO Changes Between Versions")
+        st.caption("Every rofo_current read that differs from the last one is kept as a version.")
+    
+        versions = list_versions()
+        if len(versions) < 2:
+            st.info("Only one ROFO version stored so far. A new version is kept whenever rofo_current changes.")
+        else:
+            version_labels = {v: datetime.fromtimestamp(created).strftime('%d %b %Y %H:%M') for v, created in versions}
+            ids = [v for v, _ in versions]
+            rc1, rc2, rc3 = st.columns([2, 2, 1])
+            with rc1:
+                old_version = st.selectbox("📁 From", ids, index=len(ids) - 2, format_func=version_labels.get)
+            with rc2:
+                new_version = st.selectbox("📂 To", ids, index=len(ids) - 1, format_func=version_labels.get)
+            with rc3:
+                change_by = st.selectbox("📊 By", ['Brand', 'Brand_Group', 'Channel', 'SKU_Tier'])
+        
+            diff_df, waterfall_df, totals = rofo_changes(old_version, new_version, change_by)
+            if not totals['months']:
+                st.warning("The two versions have no month columns in common.")
             else:
-                st.warning("Brand or Temp_Total column not found")
+                added = diff_df.loc[diff_df['Change'] == "Added SKU", ['sku_code', 'Channel']].drop_duplicates()
+                removed = diff_df.loc[diff_df['Change'] == "Removed SKU", ['sku_code', 'Channel']].drop_duplicates()
+                net = totals['new'] - totals['old']
+                w1, w2, w3, w4 = st.columns(4)
+                with w1:
+                    st.metric("Net Change", f"{net:+,.0f}",
+                              delta=f"{net / totals['old'] * 100:+.1f}%" if totals['old'] else None)
+                with w2:
+                    st.metric("Added SKUs", f"{len(added):,}")
+                with w3:
+                    st.metric("Removed SKUs", f"{len(removed):,}")
+                with w4:
+                    st.metric("Cells Changed", f"{len(diff_df):,}")
+                st.caption(f"Compared months: {totals['months'][0]} - {totals['months'][-1]}")
+            
+                import plotly.graph_objects as go
+                fig = go.Figure(go.Waterfall(
+                    x=waterfall_df['Step'], y=waterfall_df['Value'], measure=waterfall_df['Measure'],
+                    text=[f"{v:+,.0f}" if m == 'relative' else f"{v:,.0f}"
+                          for v, m in zip(waterfall_df['Value'], waterfall_df['Measure'])],
+                    textposition="outside", connector={"line": {"color": "#94a3b8"}},
+                    increasing={"marker": {"color": "#10B981"}}, decreasing={"marker": {"color": "#EF4444"}},
+                    totals={"marker": {"color": "#3B82F6"}}))
+                fig.update_layout(title=f"ROFO Volume Bridge by {change_by}", height=450, showlegend=False)
+                render_chart(fig)
+            
+                if diff_df.empty:
+                    st.success("✅ No quantity changes between these versions")
+                else:
+                    top_changes = diff_df.reindex(diff_df['Delta'].abs().sort_values(ascending=False).index).head(200)
+                    st.dataframe(top_changes, hide_index=True, use_container_width=True,
+                                 column_config={"Old": st.column_config.NumberColumn("Old", format="%d"),
+                                                "New": st.column_config.NumberColumn("New", format="%d"),
+                                                "Delta": st.column_config.NumberColumn("Δ", format="%+d")})
+                    st.download_button("📥 All changes (CSV)", diff_df.to_csv(index=False),
+                                       file_name=f"rofo_changes_{old_version}_{new_version}.csv",
+                                       mime="text/csv", use_container_width=True)
 
+# ============================================================================
+# TAB 6: SQL
+# ============================================================================
+with tab6, span("tab6 SQL"):
+    if tab_open(tab6):
+        st.markdown("### 🧮 Ad-hoc SQL")
+        st.caption("Read-only DuckDB over this session's plan (unsaved edits included). "
+                   "Tables: plan, plan_long (one row per month), cube (sums over every Brand / Channel / "
+                   "SKU_Tier / Month combination, NULL = all), actuals.")
+        
+        examples = example_queries(st.session_state.get('adjustment_months') or horizon_months)
+        example = st.selectbox("📚 Example", list(examples), key="sql_example")
+        with st.form("sql_form"):
+            sql_text = st.text_area("SQL", value=examples[example], height=160, key=f"sql_text_{example}")
+            run_sql = st.form_submit_button("▶️ Run", type="primary")
+        
+        if run_sql:
+            with st.spinner("Running query..."), span("sql query"):
+                try:
+                    # The plan is handed over afresh each run (it carries this session's edits), so the
+                    # reported time includes that setup, not just the query
+                    setup_start = time.perf_counter()
+                    con = sql_connect(all_df, horizon_months, {'actuals': load_sales_actuals()})
+                    setup_ms = (time.perf_counter() - setup_start) * 1000
+                    try:
+                        st.session_state.sql_result = run_query(con, sql_text) + (setup_ms, table_columns(con))
+                    finally:
+                        con.close()
+                except QueryError as e:
+                    st.session_state.sql_result = None
+                    st.error(f"❌ {e}")
+        
+        sql_result = st.session_state.get('sql_result')
+        if sql_result is not None:
+            result_df, elapsed_ms, truncated, setup_ms, schema_df = sql_result
+            st.caption(f"⚡ {len(result_df):,} rows in {elapsed_ms + setup_ms:,.0f} ms "
+                       f"({setup_ms:,.0f} ms loading the tables, {elapsed_ms:,.0f} ms query)"
+                       + (f" · first {SQL_ROW_LIMIT:,} shown" if truncated else ""))
+            st.dataframe(result_df, hide_index=True, use_container_width=True)
+            st.download_button("📥 Result (CSV)", result_df.to_csv(index=False), file_name="sop_query.csv",
+                               mime="text/csv", use_container_width=True)
+            with st.expander("🗂️ Tables & columns", expanded=False):
+                st.dataframe(schema_df, hide_index=True, use_container_width=True)
+
+# ============================================================================
+# PERFORMANCE PANEL (sidebar, rendered last so it sees this run's state)
+# ============================================================================
+with st.sidebar:
+    with st.expander("⚡ Performance", expanded=False):
+        st.toggle("⏱️ Record stage timings", value=TRACE_BY_DEFAULT, key="perf_tracing",
+                  help="Times every stage of this script run (fetch, merge, filters, grid, tabs, charts)")
+        run_trace = current_tracer()
+        if run_trace is not None and run_trace.spans:
+            st.markdown(f"**⏱️ Stage Timings** ({run_trace.total * 1000:,.0f} ms traced)")
+            st.dataframe(run_trace.summary(), hide_index=True, use_container_width=True,
+                         column_config={"Total ms": st.column_config.NumberColumn("Total ms", format="%.1f"),
+                                        "Max ms": st.column_config.NumberColumn("Max ms", format="%.1f")})
+            exp_json, exp_trace = st.columns(2)
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            with exp_json:
+                st.download_button("📥 JSON", run_trace.to_json(), file_name=f"sop_timings_{stamp}.json",
+                                   mime="application/json", use_container_width=True)
+            with exp_trace:
+                st.download_button("📥 Trace", run_trace.to_trace_events(), file_name=f"sop_trace_{stamp}.json",
+                                   mime="application/json", use_container_width=True,
+                                   help="Chrome trace-event format (chrome://tracing, Perfetto)")
+        elif run_trace is not None:
+            st.caption("No stages recorded yet.")
+        else:
+            st.caption("Switch on to time the next run.")
+        
+        st.markdown("**📡 Sheets API**")
+        quota = LEDGER.headroom()
+        st.caption(f"Source: {shared_ds.source} · "
+                   f"this run: {LEDGER.total_requests - api_requests_at_start} requests · "
+                   f"last 60s: {quota['reads']}/{READ_QUOTA_PER_MIN} reads, {quota['writes']}/{WRITE_QUOTA_PER_MIN} writes")
+        headroom = min(quota['read_headroom'], quota['write_headroom'])
+        st.progress(headroom, text=f"Quota headroom {headroom:.0%}" + (f" · {quota['throttled']} throttled" if quota['throttled'] else ""))
+        api_summary = LEDGER.summary()
+        if not api_summary.empty:
+            st.dataframe(api_summary, hide_index=True, use_container_width=True,
+                         column_config={c: st.column_config.NumberColumn(c, format="%.1f")
+                                        for c in ['KB In', 'KB Out', 'p50 ms', 'p95 ms', 'Max ms']})
+        
+        if read_api is not None:
+            st.caption(f"🔌 Read API: http://{API_HOST}:{read_api.server_address[1]}/v1/ (consensus, rofo, cube)")
+        
+        st.markdown("**🧠 Memory**")
+        st.caption(f"Shared dataset (once per process): {shared_ds.nbytes / 1024 / 1024:,.2f} MB · "
+                   f"{len(shared_ds):,} rows · v{shared_ds.version}")
+        cache = get_dataset_refresher().cache_info()
+        queued = f", {cache['pending']} queued" if cache['pending'] else ""
+        st.caption(f"Dataset cache: {cache['datasets']} cycles ({cache['speculative']} precomputed, unopened{queued}) · "
+                   f"{cache['nbytes'] / 1024 / 1024:,.1f} of {cache['budget'] / 1024 / 1024:,.0f} MB · "
+                   f"{cache['hits']} precompute hits")
+        session_mem = session_memory_table(st.session_state)
+        st.caption(f"This session: {session_mem['Bytes'].sum() / 1024:,.1f} KB "
+                   f"(edit overlay {get_scenario_store().nbytes / 1024:,.1f} KB, "
+                   f"selection {st.session_state.row_selection.nbytes / 1024:,.1f} KB)")
+        st.dataframe(session_mem.head(10), hide_index=True, use_container_width=True,
+                     column_config={"Bytes": st.column_config.NumberColumn("Bytes", format="%d")})
 
 # ============================================================================
 # FOOTER
@@ -0,0 +1,76 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# ============================================================================
+# ARROW DATA PATH
+# ----------------------------------------------------------------------------
+# The shared dataset lives as a pyarrow Table. Projections are zero-copy
+# column selections, contiguous row ranges are zero-copy slices, and filter
+# masks are computed with Arrow compute kernels. Streamlit serialises Arrow
+# tables directly, so display tables never go through pandas.
+# ============================================================================
+
+
+def to_arrow(df):
+    """Convert the merged frame once at load time"""
+    # gspread numericises cells one by one, so key columns can mix ints and
+    # strings; Arrow needs one type per column
+    df = df.copy(deep=False)
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].astype(str)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def to_pandas_view(table):
+    """
+    pandas frame over the Arrow buffers; primitive columns without nulls
+    are zero-copy (read-only), strings are materialised once
+    """
+    return table.to_pandas(split_blocks=True, zero_copy_only=False)
+
+
+def project(table, columns):
+    """Zero-copy column projection (missing columns are skipped)"""
+    return table.select([c for c in columns if c in table.column_names])
+
+
+def take_rows(table, positions):
+    """Rows for a selection vector; a contiguous range stays a zero-copy slice"""
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return table.slice(0, 0)
+    start, stop = int(positions[0]), int(positions[-1]) + 1
+    if stop - start == len(positions) and np.all(np.diff(positions) == 1):
+        return table.slice(start, len(positions))
+    return table.take(pa.array(positions))
+
+
+def _to_mask(result):
+    return pc.fill_null(result, False).to_numpy(zero_copy_only=False).astype(bool)
+
+
+def equals_mask(table, column, value):
+    """Boolean numpy mask of column == value"""
+    return _to_mask(pc.equal(table[column], pa.scalar(value, type=table.schema.field(column).type)))
+
+
+def compare_mask(table, column, op, value):
+    """Boolean numpy mask for a numeric comparison ('>', '>=', '<', '<=', '==')"""
+    kernels = {'>': pc.greater, '>=': pc.greater_equal, '<': pc.less, '<=': pc.less_equal, '==': pc.equal}
+    return _to_mask(kernels[op](table[column], value))
+
+
+def contains_mask(table, column, pattern, ignore_case=True):
+    """Boolean numpy mask of substring match on a string column"""
+    values = pc.cast(table[column], pa.string())
+    return _to_mask(pc.match_substring(values, pattern, ignore_case=ignore_case))
+
+
+def value_counts(table, column):
+    """(value, count) pairs, most frequent first"""
+    counts = pc.value_counts(table[column].drop_null()).to_pylist()
+    return sorted(((c['values'], c['counts']) for c in counts), key=lambda vc: -vc[1])
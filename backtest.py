@@ -0,0 +1,177 @@
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# FORECAST ARCHIVE & ACCURACY BACKTEST
+# ----------------------------------------------------------------------------
+# consensus_rofo is overwritten on every push, so each push also drops a
+# long-format snapshot (one row per SKU x Channel x target month) into a
+# local archive. Backtests line those snapshots up against sales_history.
+# ============================================================================
+ARCHIVE_DIR = os.environ.get("SOP_ARCHIVE_DIR", os.path.join(".sop_data", "forecast_archive"))
+ARCHIVE_KEYS = ['sku_code', 'Product_Name', 'Brand', 'Brand_Group', 'SKU_Tier', 'Channel']
+FORECAST_SOURCES = ['ROFO', 'Consensus', 'Stat']
+ACCURACY_LEVELS = {'SKU': ['sku_code', 'Channel'], 'Brand': ['Brand'], 'Channel': ['Channel']}
+
+
+def _archive_path(cycle, archive_dir=None):
+    return os.path.join(archive_dir or ARCHIVE_DIR, f"forecast_{cycle}.csv.gz")
+
+
+def archive_forecast(df, cycle, horizon_months, archive_dir=None):
+    """
+    Store one cycle's forecasts in long format
+    df: worksheet frame with ROFO month columns, Stat_ and Cons_ columns
+    cycle: forecast start month label (e.g. 'Feb-26'); lag 1 is that month
+    Rows already archived for the cycle are kept unless df has the same
+    key and target month, so pushing one filtered slice after another
+    (Reseller, then E-commerce) accumulates instead of replacing
+    """
+    keys = [k for k in ARCHIVE_KEYS if k in df.columns]
+    parts = []
+    for lag, m in enumerate(horizon_months, start=1):
+        if m not in df.columns:
+            continue
+        rofo = pd.to_numeric(df[m], errors='coerce').fillna(0)
+        cons = pd.to_numeric(df.get(f'Cons_{m}', rofo), errors='coerce').fillna(0)
+        stat = pd.to_numeric(df.get(f'Stat_{m}', np.nan), errors='coerce')
+        part = df[keys].copy()
+        part['Target_Month'] = m
+        part['Lag'] = lag
+        part['ROFO'] = rofo.values
+        part['Consensus'] = cons.values
+        part['Stat'] = stat.values if np.ndim(stat) else stat
+        parts.append(part)
+
+    if not parts:
+        return None
+
+    out = pd.concat(parts, ignore_index=True)
+    out['Cycle'] = cycle
+    out['Archived_At'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    existing = load_cycle(cycle, archive_dir)
+    match_cols = keys + ['Target_Month']
+    if not existing.empty and set(match_cols) <= set(existing.columns):
+        def _index(frame):
+            return pd.MultiIndex.from_frame(frame[match_cols].astype(str).apply(lambda s: s.str.strip()))
+        kept = existing[~_index(existing).isin(_index(out))]
+        out = pd.concat([kept, out], ignore_index=True)
+
+    path = _archive_path(cycle, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    out.to_csv(tmp_path, index=False, compression='gzip')
+    os.replace(tmp_path, path)
+    return path
+
+
+def list_cycles(archive_dir=None):
+    """Archived cycles with their file modification time, oldest first"""
+    archive_dir = archive_dir or ARCHIVE_DIR
+    if not os.path.isdir(archive_dir):
+        return []
+    cycles = []
+    for name in os.listdir(archive_dir):
+        match = re.match(r'^forecast_(.+)\.csv\.gz$', name)
+        if match:
+            cycles.append((match.group(1), os.path.getmtime(os.path.join(archive_dir, name))))
+    cycles.sort(key=lambda c: _month_key(c[0]))
+    return cycles
+
+
+def load_cycle(cycle, archive_dir=None):
+    """Read one archived cycle"""
+    path = _archive_path(cycle, archive_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_csv(path, dtype={k: str for k in ARCHIVE_KEYS})
+
+
+def _month_key(label):
+    try:
+        return datetime.strptime(label, "%b-%y")
+    except ValueError:
+        return datetime(1900, 1, 1)
+
+
+def actuals_long(sales_df, month_cols):
+    """
+    Melt sales_history into (keys, Target_Month, Actual)
+    month_cols values must already be numeric
+    """
+    keys = [k for k in ['sku_code', 'Channel'] if k in sales_df.columns]
+    actuals = sales_df[keys + list(month_cols)].melt(
+        id_vars=keys, var_name='Target_Month', value_name='Actual')
+    # Duplicate key rows in the sheet are summed rather than double-joined
+    return actuals.groupby(keys + ['Target_Month'], as_index=False, sort=False)['Actual'].sum()
+
+
+def cycle_errors(archive_df, actuals):
+    """
+    Row-level forecast errors for one archived cycle
+    Only target months that already have actuals are kept
+    """
+    if archive_df.empty or actuals.empty:
+        return pd.DataFrame()
+
+    keys = [k for k in ['sku_code', 'Channel'] if k in archive_df.columns and k in actuals.columns]
+    errors = archive_df.merge(actuals, on=keys + ['Target_Month'], how='inner')
+    for src in FORECAST_SOURCES:
+        if src not in errors.columns:
+            errors[src] = np.nan
+        errors[f'Err_{src}'] = errors[src] - errors['Actual']
+    return errors
+
+
+def accuracy_table(errors, level='Brand', lags=(1, 2, 3), by_lag=True):
+    """
+    MAPE, WMAPE, bias and forecast value added per group and lag
+    FVA = WMAPE(reference) - WMAPE(Consensus); positive means the
+    consensus step improved on the reference forecast
+    level: key of ACCURACY_LEVELS, 'Total' for a single pooled row
+    """
+    if errors.empty:
+        return pd.DataFrame()
+
+    data = errors[errors['Lag'].isin(lags)].copy()
+    if data.empty:
+        return pd.DataFrame()
+
+    if level == 'Total':
+        data['Total'] = 'All'
+        group_cols = ['Total']
+    else:
+        group_cols = [c for c in ACCURACY_LEVELS.get(level, [level]) if c in data.columns]
+    if by_lag:
+        group_cols = group_cols + ['Lag']
+
+    has_actual = data['Actual'] > 0
+    agg_cols = {'Actual': 'sum', 'N': 'sum', 'N_Stat': 'sum'}
+    data['N'] = 1
+    data['N_Stat'] = data['Stat'].notna().astype(int)
+    for src in FORECAST_SOURCES:
+        err = data[f'Err_{src}']
+        data[f'AbsErr_{src}'] = err.abs()
+        # APE is undefined when there were no sales; those rows are excluded from MAPE
+        data[f'APE_{src}'] = np.where(has_actual, err.abs() / data['Actual'].where(has_actual, 1), np.nan)
+        agg_cols.update({f'AbsErr_{src}': 'sum', f'Err_{src}': 'sum', f'APE_{src}': 'mean'})
+
+    grouped = data.groupby(group_cols, as_index=False).agg(agg_cols)
+    actual = grouped['Actual'].replace(0, np.nan)
+
+    result = grouped[group_cols + ['N', 'Actual']].copy()
+    for src in FORECAST_SOURCES:
+        result[f'MAPE_{src}'] = (grouped[f'APE_{src}'] * 100).round(1)
+        result[f'WMAPE_{src}'] = (grouped[f'AbsErr_{src}'] / actual * 100).round(1)
+        result[f'Bias_{src}'] = (grouped[f'Err_{src}'] / actual * 100).round(1)
+    # Cycles archived before the Stat_ columns existed have no baseline to score
+    no_stat = grouped['N_Stat'] == 0
+    result.loc[no_stat, ['MAPE_Stat', 'WMAPE_Stat', 'Bias_Stat']] = np.nan
+    result['FVA_vs_ROFO'] = (result['WMAPE_ROFO'] - result['WMAPE_Consensus']).round(1)
+    result['FVA_vs_Stat'] = (result['WMAPE_Stat'] - result['WMAPE_Consensus']).round(1)
+    return result
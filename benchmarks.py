@@ -0,0 +1,216 @@
+"""
+Benchmark suite for the load / merge / filter / aggregate path
+
+    python benchmarks.py --sizes 5000 50000 200000
+    python benchmarks.py --sizes 50000 --compare .sop_data/benchmarks/bench_<old>.json
+
+Runs each stage on synthetic sheets (synthetic_data.py) and stores the
+timings as JSON, so two versions can be compared. --compare prints the
+ratio per stage and exits 1 when a stage got slower than --threshold.
+"""
+import argparse
+import ast
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from synthetic_data import generate_sheets
+from sop_pipeline import clean_currency_frame, sort_month_columns, build_dataset
+from stat_forecast import DEFAULT_STAT_MODEL, forecast_baseline
+from shared_data import SharedDataset
+from arrow_data import equals_mask, compare_mask, contains_mask
+from perf_trace import start_trace, stop_trace
+from analytics import calculate_pct, analytics_frame, brand_summary, monthly_by, monthly_total, report_totals, risk_counts
+
+RESULTS_DIR = os.path.join(".sop_data", "benchmarks")
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Imported lazily by app.py; measured on top of its startup imports
+DEFERRED_MODULES = ['plotly.express', 'st_aggrid', 'gspread', 'google.oauth2.service_account',
+                    'scipy.sparse', 'streamlit_extras.metric_cards', 'duckdb']
+DEFAULT_SIZES = [5000, 50000, 200000]
+START_MONTH = "Feb-26"
+
+
+def _time(fn, repeat):
+    """(result of the last run, [seconds per run])"""
+    runs, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - t0)
+    return result, runs
+
+
+def _filter_block(dataset):
+    """Same masks the worksheet filter bar builds (channel, brand, cover, focus)"""
+    table = dataset.table
+    row_mask = np.ones(table.num_rows, dtype=bool)
+    np.logical_and(row_mask, equals_mask(table, 'Channel', 'Reseller'), out=row_mask)
+    np.logical_and(row_mask, equals_mask(table, 'Brand_Group', 'Acne'), out=row_mask)
+    np.logical_and(row_mask, compare_mask(table, 'Month_Cover', '>=', 0.5)
+                   & compare_mask(table, 'Month_Cover', '<=', 1.5), out=row_mask)
+    np.logical_and(row_mask, ~contains_mask(table, 'Product_Focus', 'Yes'), out=row_mask)
+    selection = np.flatnonzero(row_mask).astype(np.int32)
+    return dataset.view().iloc[selection]
+
+
+def run_size(n_rows, repeat=3, stat_model=DEFAULT_STAT_MODEL):
+    """Timings (seconds) per stage for one dataset size"""
+    sheets, gen_runs = _time(lambda: generate_sheets(n_rows, START_MONTH), 1)
+    sales_df = sheets['sales_history']
+    month_cols = sort_month_columns(sales_df.columns)
+
+    stages = {}
+
+    def stage(name, fn):
+        result, runs = _time(fn, repeat)
+        stages[name] = runs
+        return result
+
+    hist = stage('clean_currency_frame (history)', lambda: clean_currency_frame(sales_df[month_cols]))
+    stage(f'forecast_baseline ({stat_model})',
+          lambda: forecast_baseline(hist.to_numpy(), list(range(1, 13)), model=stat_model))
+    df, info = stage('load_data_v5 (build_dataset)',
+                     lambda: build_dataset(sheets['sales_history'], sheets['rofo_current'], sheets['stock_onhand'],
+                                           START_MONTH, stat_model=stat_model))
+    adjustment_months, horizon_months = info['adjustment_months'], info['horizon_months']
+
+    # One traced run for the breakdown inside build_dataset
+    tracer = start_trace("benchmark")
+    build_dataset(sheets['sales_history'], sheets['rofo_current'], sheets['stock_onhand'],
+                  START_MONTH, stat_model=stat_model)
+    stop_trace()
+    breakdown = {s['name']: s['duration'] for s in tracer.spans}
+
+    dataset = stage('SharedDataset (to Arrow)', lambda: SharedDataset(df))
+    stage('calculate_pct', lambda: calculate_pct(df, adjustment_months))
+    stage('filter block', lambda: _filter_block(dataset))
+
+    calc_df = stage('tab2 analytics_frame', lambda: analytics_frame(df, horizon_months))
+    stage('tab2 brand_summary', lambda: brand_summary(calc_df, horizon_months))
+    stage('tab2 monthly_by Brand', lambda: monthly_by(calc_df, horizon_months, 'Brand'))
+    stage('tab2 monthly_by Channel', lambda: monthly_by(calc_df, horizon_months, 'Channel'))
+    stage('tab2 monthly_total', lambda: monthly_total(calc_df, horizon_months))
+    report_df = stage('tab3 report_totals', lambda: report_totals(df, adjustment_months))
+    stage('tab3 top 10 + risk', lambda: (report_df.nlargest(10, 'Temp_Total'), risk_counts(report_df)))
+
+    return {
+        'rows': len(df),
+        'generate_seconds': gen_runs[0],
+        'stages': {name: {'min': min(runs), 'median': float(np.median(runs)), 'runs': runs}
+                   for name, runs in stages.items()},
+        'build_dataset_spans': breakdown,
+    }
+
+
+def _importtime(code):
+    """{module: cumulative ms} from python -X importtime for a snippet run in the app directory"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=APP_DIR,
+                          capture_output=True, text=True, timeout=300)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # top-level entries only; nested ones are included in them
+            times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def import_times():
+    """Startup import cost of app.py (module-level imports) and of each deferred module"""
+    tree = ast.parse(open(os.path.join(APP_DIR, 'app.py'), encoding='utf-8').read())
+    startup = "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+    startup_times = _importtime(startup)
+    deferred = {}
+    for module in DEFERRED_MODULES:
+        times = _importtime(f"{startup}\nimport {module}")
+        deferred[module] = sum(ms for name, ms in times.items() if name not in startup_times)
+    return {'startup_ms': sum(startup_times.values()), 'deferred_ms': deferred}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'pyarrow': pa.__version__,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print min-time ratios per stage; returns the stages slower than threshold"""
+    regressions = []
+    for size, result in current['results'].items():
+        old = baseline.get('results', {}).get(size)
+        if not old:
+            continue
+        print(f"\n{size} rows (vs {baseline['environment'].get('commit') or 'baseline'})")
+        for name, timing in result['stages'].items():
+            if name not in old['stages']:
+                continue
+            ratio = timing['min'] / max(old['stages'][name]['min'], 1e-9)
+            flag = "  <-- slower" if ratio > threshold else ""
+            print(f"  {name:<44} {old['stages'][name]['min'] * 1000:>10.1f} ms -> {timing['min'] * 1000:>10.1f} ms  x{ratio:.2f}{flag}")
+            if flag:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the S&OP pipeline stages on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="SKU x Channel rows")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stat-model", default=DEFAULT_STAT_MODEL)
+    parser.add_argument("--out", help="Result file (default: .sop_data/benchmarks/bench_<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--imports", action="store_true", help="Also measure app.py startup import time")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for n in args.sizes:
+        print(f"Benchmarking {n:,} rows...", file=sys.stderr)
+        results[str(n)] = run_size(n, args.repeat, args.stat_model)
+        for name, timing in results[str(n)]['stages'].items():
+            print(f"  {name:<44} {timing['min'] * 1000:>10.1f} ms", file=sys.stderr)
+
+    output = {'environment': environment(), 'results': results}
+    if args.imports:
+        output['imports'] = import_times()
+        print(f"app.py startup imports: {output['imports']['startup_ms']:,.0f} ms", file=sys.stderr)
+        for module, ms in output['imports']['deferred_ms'].items():
+            print(f"  deferred {module:<36} {ms:>8,.0f} ms", file=sys.stderr)
+    out = args.out or os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(output, json.load(f), args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# BULK ADJUSTMENT RULES
+# ----------------------------------------------------------------------------
+# Each rule maps the (n_rows x n_months) consensus block of a slice to its
+# new values in one array expression. Rows outside the slice are untouched.
+# ============================================================================
+BULK_RULES = {
+    "Percent Uplift (%)": lambda cons, rofo, l3m, v: cons * (1 + v / 100),
+    "Absolute Delta (units)": lambda cons, rofo, l3m, v: cons + v,
+    "Set to ROFO": lambda cons, rofo, l3m, v: rofo,
+    "Set to L3M × Multiple": lambda cons, rofo, l3m, v: l3m[:, None] * v,
+    "Floor at Zero": lambda cons, rofo, l3m, v: np.maximum(cons, 0),
+}
+RULES_WITH_VALUE = {
+    "Percent Uplift (%)": 10.0,
+    "Absolute Delta (units)": 100.0,
+    "Set to L3M × Multiple": 1.0,
+}
+
+
+def bulk_adjust(df, row_mask, months, rule, value=0.0):
+    """
+    Apply one rule to the Cons_ columns of the selected rows
+    Returns the full (n_rows x len(months)) consensus block after the rule
+    """
+    if rule not in BULK_RULES:
+        raise ValueError(f"Unknown bulk rule: {rule}")
+
+    cons_cols = [f'Cons_{m}' for m in months]
+    cons = df[cons_cols].to_numpy(dtype=float)
+    rofo = df[months].to_numpy(dtype=float)
+    l3m = df['L3M_Avg'].to_numpy(dtype=float) if 'L3M_Avg' in df.columns else np.zeros(len(df))
+
+    row_mask = np.asarray(row_mask, dtype=bool)
+    adjusted = BULK_RULES[rule](cons[row_mask], rofo[row_mask], l3m[row_mask], float(value))
+
+    result = cons.copy()
+    result[row_mask] = np.round(np.broadcast_to(adjusted, result[row_mask].shape), 0)
+    return result
+
+
+def bulk_preview(df, row_mask, months, new_cons):
+    """Before / after totals per month for the selected slice"""
+    row_mask = np.asarray(row_mask, dtype=bool)
+    before = df.loc[row_mask, [f'Cons_{m}' for m in months]].to_numpy(dtype=float)
+    after = new_cons[row_mask]
+    preview = pd.DataFrame({
+        'Month': months,
+        'Before': before.sum(axis=0),
+        'After': after.sum(axis=0),
+        'Rows Changed': (~np.isclose(before, after)).sum(axis=0),
+    })
+    preview['Δ'] = preview['After'] - preview['Before']
+    preview['Δ %'] = np.where(preview['Before'] != 0,
+                              (preview['Δ'] / preview['Before'].where(preview['Before'] != 0, 1) * 100).round(1), 0)
+    return preview
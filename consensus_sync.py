@@ -0,0 +1,198 @@
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from hash_join import encode_keys
+from snapshot_store import write_snapshot
+
+# ============================================================================
+# CONCURRENT CONSENSUS WRITES
+# ----------------------------------------------------------------------------
+# Pushes no longer overwrite consensus_rofo. Each push re-reads the sheet and
+# does a cell-level three-way merge between
+#   base   - the consensus the session started editing from
+#   local  - the session's current consensus
+#   remote - what is in the sheet right now
+# Only cells the session actually changed are written. A cell that another
+# planner changed since this session last synced (Last_Update moved and the
+# value is neither the base nor what this session pushed) is a conflict:
+# the remote value is kept and the cell is reported.
+#
+# A new session starts from the last pushed consensus, not from ROFO:
+# saved_consensus() lines consensus_rofo up with the dataset rows and keeps
+# only the cells that differ (a sparse overlay, like the edit journal).
+#
+# After each push the sheet state is also published to the snapshot store
+# (key consensus_rofo), so the read API serves it without touching Sheets.
+# ============================================================================
+KEY_COLS = ['sku_code', 'Channel']
+VERSION_COL = 'Last_Update'
+AUTHOR_COL = 'Updated_By'
+CONSENSUS_SNAPSHOT = "consensus_rofo"
+
+logger = logging.getLogger(__name__)
+
+MergeResult = namedtuple('MergeResult', ['to_write', 'conflicts', 'accepted_remote', 'written_cells'])
+
+
+def to_number(series):
+    """Parse sheet cell strings ('1,234', '1234.0', '') into floats (NaN when empty)"""
+    cleaned = series.astype(str).str.replace(r'[^0-9.\-]', '', regex=True)
+    return pd.to_numeric(cleaned.where(cleaned != '', None), errors='coerce')
+
+
+def _keyed(df, key_cols):
+    keyed = df.copy()
+    for k in key_cols:
+        keyed[k] = keyed[k].astype(str).str.strip()
+    return keyed.drop_duplicates(key_cols, keep='last').set_index(key_cols)
+
+
+def row_versions(remote_df, key_cols=KEY_COLS):
+    """Last_Update per key from a consensus_rofo read"""
+    if remote_df.empty or VERSION_COL not in remote_df.columns or not set(key_cols) <= set(remote_df.columns):
+        return pd.Series(dtype=object)
+    return _keyed(remote_df, key_cols)[VERSION_COL].astype(str)
+
+
+def merge_consensus(local_df, base_df, remote_df, cons_cols, seen_versions=None,
+                    pushed_df=None, updated_by="S&OP Dashboard", key_cols=KEY_COLS):
+    """
+    Three-way merge of this session's consensus into the current sheet state
+    local_df / base_df: same rows in the same order, key columns + cons_cols
+    remote_df: fresh read of consensus_rofo (strings as returned by the sheet)
+    seen_versions: Last_Update per key when this session loaded
+    pushed_df: values this session itself pushed earlier (keyed), so its own
+               writes are not mistaken for another planner's
+    """
+    n_rows, n_cols = len(local_df), len(cons_cols)
+    local = local_df[cons_cols].to_numpy(dtype=float)
+    base = base_df[cons_cols].to_numpy(dtype=float)
+    keys = pd.MultiIndex.from_frame(local_df[key_cols].astype(str).apply(lambda s: s.str.strip()))
+
+    # Align the sheet to the session's rows
+    if remote_df.empty or not set(key_cols) <= set(remote_df.columns):
+        remote = np.full((n_rows, n_cols), np.nan)
+        remote_exists = np.zeros(n_rows, dtype=bool)
+        remote_version = pd.Series([None] * n_rows, index=keys, dtype=object)
+        remote_author = remote_version
+    else:
+        keyed = _keyed(remote_df, key_cols).reindex(keys)
+        remote_exists = keyed.notna().any(axis=1).to_numpy()
+        remote = np.column_stack([
+            to_number(keyed[c]).to_numpy(dtype=float) if c in keyed.columns else np.full(n_rows, np.nan)
+            for c in cons_cols
+        ]) if n_cols else np.empty((n_rows, 0))
+        remote_version = keyed[VERSION_COL].astype(object) if VERSION_COL in keyed.columns else pd.Series([None] * n_rows, index=keys, dtype=object)
+        remote_author = keyed[AUTHOR_COL].astype(object) if AUTHOR_COL in keyed.columns else remote_version
+
+    seen = (seen_versions if seen_versions is not None else pd.Series(dtype=object)).reindex(keys)
+    row_moved = remote_exists & (remote_version.astype(str).to_numpy() != seen.astype(str).to_numpy())
+
+    if pushed_df is not None and not pushed_df.empty:
+        pushed = pushed_df.reindex(keys).reindex(columns=cons_cols).to_numpy(dtype=float)
+    else:
+        pushed = np.full((n_rows, n_cols), np.nan)
+
+    remote_missing = np.isnan(remote)
+    local_changed = ~np.isclose(local, base)
+    remote_changed = (row_moved[:, None] & ~remote_missing
+                      & ~np.isclose(remote, base) & ~np.isclose(remote, pushed))
+    conflict = local_changed & remote_changed & ~np.isclose(remote, local)
+
+    write_cell = (local_changed & ~conflict) | remote_missing
+    merged = np.where(remote_missing, local, remote)
+    merged = np.where(write_cell, local, merged)
+
+    write_row = write_cell.any(axis=1)
+    to_write = local_df.loc[write_row].copy()
+    to_write[cons_cols] = merged[write_row]
+    to_write[VERSION_COL] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    to_write[AUTHOR_COL] = updated_by
+
+    rows, cols = np.nonzero(conflict)
+    conflicts = pd.DataFrame({
+        **{k: local_df[k].to_numpy()[rows] for k in key_cols},
+        'Column': [cons_cols[c] for c in cols],
+        'Base': base[rows, cols],
+        'Yours': local[rows, cols],
+        'Sheet': remote[rows, cols],
+        'Sheet Updated By': remote_author.to_numpy()[rows],
+        'Sheet Last Update': remote_version.to_numpy()[rows],
+    })
+
+    # Cells where another planner's value is kept instead of this session's base
+    accepted = int((remote_changed & ~local_changed).sum())
+    return MergeResult(to_write, conflicts, accepted, int(write_cell.sum()))
+
+
+def saved_consensus(df, remote_df, cons_cols, key_cols=KEY_COLS):
+    """
+    Last pushed consensus (a consensus_rofo read) aligned to df's rows, sparse
+    One join on integer key codes; duplicate sheet rows keep the last one, as the merge does
+    Returns {cons_col: (row positions, values)} for the cells where the sheet
+    has a value that differs from df's current Cons_ value (the ROFO start)
+    """
+    if df.empty or remote_df.empty or not set(key_cols) <= set(remote_df.columns):
+        return {}
+    keys = df[key_cols].astype(str).apply(lambda s: s.str.strip())
+    remote_keys = remote_df[key_cols].astype(str).apply(lambda s: s.str.strip())
+    codes, remote_codes, n_keys = encode_keys(keys, remote_keys, key_cols)
+    remote_row = np.full(n_keys, -1)
+    remote_row[remote_codes] = np.arange(len(remote_codes))  # Later rows overwrite earlier ones
+    row = remote_row[codes]
+    matched = row >= 0
+
+    saved = {}
+    for col in cons_cols:
+        if col not in remote_df.columns or col not in df.columns:
+            continue
+        values = np.full(len(df), np.nan)
+        values[matched] = to_number(remote_df[col]).to_numpy(dtype=float)[row[matched]]
+        differs = ~np.isnan(values) & ~np.isclose(values, df[col].to_numpy(dtype=float))
+        positions = np.flatnonzero(differs).astype(np.int32)
+        saved[col] = (positions, values[positions])
+    return saved
+
+
+def apply_saved(df, saved):
+    """df with the saved consensus cells from saved_consensus() written into its Cons_ columns"""
+    if not saved:
+        return df
+    columns = {}
+    for col, (positions, values) in saved.items():
+        column = df[col].to_numpy(dtype=float, copy=True)
+        column[positions] = values
+        columns[col] = column
+    return df.assign(**columns)
+
+
+def sheet_after_push(remote_df, to_write, key_cols=KEY_COLS):
+    """consensus_rofo as it reads after upserting to_write into remote_df (cells as strings)"""
+    written = to_write.fillna('').astype(str).reset_index(drop=True)
+    if remote_df.empty or not set(key_cols) <= set(remote_df.columns):
+        return written
+    remote = remote_df.astype(str)
+    remote_keys = pd.MultiIndex.from_frame(remote[key_cols].apply(lambda s: s.str.strip()))
+    written_keys = pd.MultiIndex.from_frame(written[key_cols].apply(lambda s: s.str.strip()))
+    kept = remote[~remote_keys.isin(written_keys)]
+    return pd.concat([kept, written], ignore_index=True).fillna('')
+
+
+def publish_consensus(sheet_df, dataset=None, snapshot_dir=None):
+    """
+    Share a consensus_rofo state with the read API through the snapshot store
+    dataset: snapshot key of the cycle it was pushed from (the API's default)
+    Returns the pointer, or None when it could not be written (logged, never
+    raised: a push must not fail because of it)
+    """
+    try:
+        table = pa.Table.from_pandas(sheet_df.fillna('').astype(str), preserve_index=False)
+        return write_snapshot(table, CONSENSUS_SNAPSHOT, snapshot_dir, metadata={'dataset': dataset})
+    except OSError as e:
+        logger.warning("Could not publish consensus snapshot: %s", e)
+        return None
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# DATA-QUALITY RULES
+# ----------------------------------------------------------------------------
+# Each rule is one vectorized check over what ingest has already computed:
+# cell flags that come out of the same text pass as the numbers
+# (parse_quantity_frame), the hash-join reports and the merged frame.
+# run_rules() turns the findings into one compact issue table (rule,
+# severity, sheet, count, a few examples) that is stored with the dataset
+# and its snapshot, so reruns and other processes never recompute it.
+# A check yields (sheet, mask, raw, keys): mask is a boolean row vector or
+# a (rows x columns) cell matrix over raw; keys label the rows.
+# ============================================================================
+MAX_EXAMPLES = 3
+SEVERITY_ORDER = {"error": 0, "warning": 1, "info": 2}
+ISSUE_COLUMNS = ['Rule', 'Severity', 'Sheet', 'Count', 'Examples', 'Description']
+
+
+def _cells(flag):
+    return lambda ctx: [(sheet, block[flag], block['raw'], block['keys']) for sheet, block in ctx['blocks']]
+
+
+def _all(frame):
+    return np.ones(len(frame), dtype=bool)
+
+
+def _duplicates(ctx):
+    reports = [('sales_history', ctx['sales_rofo']['left_duplicates']),
+               ('rofo_current', ctx['sales_rofo']['right_duplicates'])]
+    if ctx['stock'] is not None:
+        reports.append(('stock_onhand', ctx['stock']['right_duplicates']))
+    for sheet, dups in reports:
+        labels = dups[[k for k in ctx['keys'] if k in dups.columns]]
+        yield sheet, _all(dups), None, labels.assign(Rows=dups['Rows'].astype(str) + ' rows')
+
+
+def _zero_floor_price(ctx):
+    merged = ctx['merged']
+    yield 'rofo_current', merged['floor_price'].to_numpy(dtype=float) == 0, None, merged[ctx['keys']]
+
+
+def _stock_without_sales(ctx):
+    if ctx['stock'] is not None:
+        unmatched = ctx['stock']['right_unmatched']
+        yield 'stock_onhand', _all(unmatched), None, unmatched[['sku_code']]
+
+
+def _missing_months(ctx):
+    months = pd.DataFrame({'Month': ctx['missing_months']})
+    yield 'rofo_current', _all(months), None, months
+
+
+# name: (severity, description, check)
+QUALITY_RULES = {
+    "Negative quantity": ("error", "Minus sign or (…) in a number; cleaning drops it, so the value loads as positive",
+                          _cells('negative')),
+    "Unparseable number": ("error", "Text in a number cell; loaded as 0 (or only its digits are kept)",
+                           _cells('unparseable')),
+    "Duplicate key": ("warning", "Key on more than one row; the first row is used", _duplicates),
+    "Zero floor price": ("warning", "floor_price is 0, so the row has no revenue", _zero_floor_price),
+    "Stock without sales": ("info", "Stock on hand for a SKU with no worksheet row", _stock_without_sales),
+    "Missing ROFO month": ("error", "Horizon month with no rofo_current column; its forecast is 0", _missing_months),
+}
+
+
+def _label(keys, row):
+    return " / ".join(str(v) for v in keys.iloc[row].tolist())
+
+
+def _examples(mask, raw, keys):
+    """First few flagged rows (or cells, as 'key column=value')"""
+    if mask.ndim == 2:
+        return [f"{_label(keys, r)} {raw.columns[c]}={raw.iat[r, c]!r}"
+                for r, c in np.argwhere(mask)[:MAX_EXAMPLES]]
+    return [_label(keys, r) for r in np.flatnonzero(mask)[:MAX_EXAMPLES]]
+
+
+def run_rules(ctx, rules=None):
+    """
+    Issue table with one row per rule and sheet that found something
+    ctx: blocks [(sheet, {raw, negative, unparseable, keys})], sales_rofo and
+    stock join reports, merged, keys, missing_months
+    """
+    rows = []
+    for name, (severity, description, check) in (rules or QUALITY_RULES).items():
+        for sheet, mask, raw, keys in check(ctx):
+            count = int(mask.sum())
+            if count:
+                rows.append({'Rule': name, 'Severity': severity, 'Sheet': sheet, 'Count': count,
+                             'Examples': "; ".join(_examples(mask, raw, keys)), 'Description': description})
+    issues = pd.DataFrame(rows, columns=ISSUE_COLUMNS)
+    order = issues['Severity'].map(SEVERITY_ORDER)
+    return issues.assign(_order=order).sort_values(['_order', 'Count'], ascending=[True, False]) \
+        .drop(columns='_order').reset_index(drop=True)
+
+
+def issue_summary(issues):
+    """'2 errors, 1 warning' style headline"""
+    if issues is None or issues.empty:
+        return "no issues"
+    counts = issues.groupby('Severity')['Rule'].size()
+    return ", ".join(f"{counts[s]} {s}{'s' if counts[s] > 1 else ''}" for s in SEVERITY_ORDER if s in counts)
+
+
+def issues_to_records(issues):
+    """JSON-safe form for the snapshot pointer metadata"""
+    return None if issues is None else issues.astype({'Count': int}).to_dict('records')
+
+
+def issues_from_records(records):
+    """Issue table back from snapshot metadata; None for snapshots written before the rules existed"""
+    return None if records is None else pd.DataFrame(records, columns=ISSUE_COLUMNS)
@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+
+from snapshot_store import SNAPSHOT_TTL
+
+# ============================================================================
+# STALE-WHILE-REVALIDATE DATASET REFRESH
+# ----------------------------------------------------------------------------
+# Script runs only ever read the last good dataset per key; a daemon thread
+# rebuilds each key REFRESH_AFTER seconds after it was loaded (ahead of the
+# snapshot TTL) and swaps the new one in under a lock. A failed or deferred
+# rebuild keeps the old dataset; deferred ones are retried on the next check,
+# failed ones after RETRY_AFTER seconds. Keys no session has asked for in
+# IDLE_AFTER seconds stop being refreshed.
+#
+# prefetch() queues keys a session is likely to ask for next (neighbouring
+# start months, the other month mode); the same thread builds them
+# speculatively. All keys share one byte budget: least recently used out
+# first, speculative keys nobody opened before the rest. A speculative key that
+# is evicted or fails to build is not queued again for SPECULATIVE_COOLDOWN
+# seconds (doubled on each repeat), and nothing is prefetched while the
+# budget is already full, so reruns do not rebuild and evict the same keys.
+# ============================================================================
+REFRESH_AFTER = int(os.environ.get("SOP_REFRESH_AFTER", SNAPSHOT_TTL * 0.8))
+CHECK_INTERVAL = 15
+RETRY_AFTER = 60
+SPECULATIVE_COOLDOWN = 10 * 60
+IDLE_AFTER = 60 * 60
+INPUT_REUSE = 60  # One download of the inputs serves every key built within this many seconds
+CACHE_BUDGET = int(float(os.environ.get("SOP_DATASET_CACHE_MB", 256)) * 1024 * 1024)
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetRefresher:
+    def __init__(self, fetch, build, defer=None, refresh_after=REFRESH_AFTER, check_interval=CHECK_INTERVAL,
+                 idle_after=IDLE_AFTER, budget=CACHE_BUDGET):
+        """
+        fetch() -> inputs shared by every key (the raw sheets)
+        build(params, inputs) -> dataset, where inputs() returns fetch()'s result, downloaded
+        at most once per INPUT_REUSE seconds. Both run on the refresher thread (no Streamlit calls)
+        defer() -> reason string to skip this round (e.g. Sheets quota low), or None
+        """
+        self._fetch = fetch
+        self._build = build
+        self._defer = defer
+        self.refresh_after = refresh_after
+        self.check_interval = check_interval
+        self.idle_after = idle_after
+        self.budget = budget
+        # key -> dict(params, dataset, last_used, refreshing, error, deferred, due, retry_at, speculative)
+        self._entries = {}
+        self._cooldown = {}  # speculative key -> (not before, strikes) after an eviction or failed build
+        self._load_locks = {}
+        self._inputs = None  # (fetched_at, value)
+        self._inputs_lock = threading.Lock()
+        self.hits = 0  # Speculative keys a session went on to open
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _new_entry(params, speculative=False):
+        return {'params': params, 'dataset': None, 'last_used': time.time(), 'refreshing': False,
+                'error': None, 'deferred': None, 'due': False, 'retry_at': 0.0, 'speculative': speculative}
+
+    # ------------------------------------------------------------------
+    # Script side
+    # ------------------------------------------------------------------
+    def get(self, key):
+        """Last good dataset for key, or None if it is not built yet"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['dataset'] is None:
+                return None
+            entry['last_used'] = time.time()
+            if entry['speculative']:
+                entry['speculative'] = False
+                self.hits += 1
+            return entry['dataset']
+
+    def loading(self, key):
+        """Lock held while key is being built, so a script run and the thread never build it twice"""
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def publish(self, key, params, dataset):
+        """Serve dataset for key from now on and keep it refreshed with build(params)"""
+        with self._lock:
+            entry = self._entries.setdefault(key, self._new_entry(params))
+            entry.update(params=params, dataset=dataset, last_used=time.time(), speculative=False)
+            self._cooldown.pop(key, None)
+            self._evict()
+        self._ensure_thread()
+
+    def prefetch(self, params_by_key):
+        """
+        Queue keys for a speculative build; keys already known or cooling down are left
+        alone, and nothing is queued while the datasets held already fill the budget
+        """
+        if self.budget <= 0:
+            return []
+        now = time.time()
+        with self._lock:
+            if sum(e['dataset'].nbytes for e in self._entries.values() if e['dataset'] is not None) >= self.budget:
+                return []
+            added = [k for k in params_by_key
+                     if k not in self._entries and self._cooldown.get(k, (0.0, 0))[0] <= now]
+            for key in added:
+                self._entries[key] = self._new_entry(params_by_key[key], speculative=True)
+        if added:
+            self._ensure_thread()
+            self._wake.set()
+        return added
+
+    def request_refresh(self, key=None):
+        """Rebuild key (or every key) on the next pass without dropping what is served"""
+        with self._inputs_lock:
+            self._inputs = None
+        with self._lock:
+            for k, entry in self._entries.items():
+                if key is None or k == key:
+                    entry['due'] = True
+        self._wake.set()
+
+    def forget(self, key=None):
+        """Drop key (or everything); the next script run loads it again"""
+        with self._inputs_lock:
+            self._inputs = None
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._cooldown.clear()
+            else:
+                self._entries.pop(key, None)
+                self._cooldown.pop(key, None)
+
+    def status(self, key):
+        """Freshness of key: age, refreshing, next refresh, last error or deferral reason"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['dataset'] is None:
+                return None
+            age = time.time() - entry['dataset'].loaded_at
+            return {
+                'age': age,
+                'version': entry['dataset'].version,
+                'refreshing': entry['refreshing'],
+                'next_refresh_in': 0 if entry['due'] else max(0.0, self.refresh_after - age),
+                'error': entry['error'],
+                'deferred': entry['deferred'],
+            }
+
+    def cache_info(self):
+        """Datasets held (speculative ones included), queued builds, bytes against the budget"""
+        with self._lock:
+            built = [e for e in self._entries.values() if e['dataset'] is not None]
+            return {
+                'datasets': len(built),
+                'speculative': sum(e['speculative'] for e in built),
+                'pending': len(self._entries) - len(built),
+                'hits': self.hits,
+                'nbytes': sum(e['dataset'].nbytes for e in built),
+                'budget': self.budget,
+            }
+
+    # ------------------------------------------------------------------
+    # Refresher thread
+    # ------------------------------------------------------------------
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="sop-dataset-refresher", daemon=True)
+            self._thread.start()
+
+    def _evict(self):
+        """Drop datasets until under budget, keeping the most recently used one (caller holds _lock)"""
+        built = [(k, e) for k, e in self._entries.items() if e['dataset'] is not None]
+        total = sum(e['dataset'].nbytes for _, e in built)
+        if total <= self.budget:
+            return
+        newest = max(built, key=lambda item: item[1]['last_used'])[0]
+        for key, entry in sorted(built, key=lambda item: (not item[1]['speculative'], item[1]['last_used'])):
+            if total <= self.budget:
+                break
+            if key != newest and not entry['refreshing']:
+                total -= entry['dataset'].nbytes
+                del self._entries[key]
+                if entry['speculative']:
+                    self._cool_down(key)
+
+    def _cool_down(self, key):
+        """Keep a dropped speculative key out of prefetch() for a while (caller holds _lock)"""
+        strikes = self._cooldown.get(key, (0.0, 0))[1] + 1
+        self._cooldown[key] = (time.time() + SPECULATIVE_COOLDOWN * 2 ** min(strikes - 1, 4), strikes)
+
+    def _due_keys(self):
+        """Stale keys first, then speculative keys not built yet"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if now - e['last_used'] > self.idle_after]:
+                del self._entries[key]
+            stale = [k for k, e in self._entries.items()
+                     if e['dataset'] is not None and not e['speculative'] and now >= e['retry_at']
+                     and (e['due'] or now - e['dataset'].loaded_at >= self.refresh_after)]
+            pending = [k for k, e in self._entries.items() if e['dataset'] is None and now >= e['retry_at']]
+            return stale + pending
+
+    def _run(self):
+        while True:
+            for key in self._due_keys():
+                self.refresh(key)
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+
+    def inputs(self):
+        """fetch() result, downloaded at most once per INPUT_REUSE seconds"""
+        with self._inputs_lock:
+            if self._inputs is None or time.time() - self._inputs[0] > INPUT_REUSE:
+                self._inputs = (time.time(), self._fetch())
+            return self._inputs[1]
+
+    def refresh(self, key):
+        """(Re)build one key now and swap it in; the old dataset stays on any failure"""
+        with self.loading(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or entry['refreshing']:
+                    return False
+                # A script run may have loaded it while we waited for the lock
+                if entry['dataset'] is not None and not entry['due'] and \
+                        time.time() - entry['dataset'].loaded_at < self.refresh_after:
+                    return False
+                reason = self._defer() if self._defer else None
+                entry['deferred'] = reason
+                if reason:
+                    return False
+                entry['refreshing'] = True
+                params = entry['params']
+            try:
+                dataset = self._build(params, self.inputs)
+                if dataset is None or dataset.empty:
+                    raise ValueError("build returned no rows")
+            except Exception as e:
+                logger.warning("Background build of %s failed: %s", key, e)
+                with self._lock:
+                    entry.update(refreshing=False, error=f"{type(e).__name__}: {e}", due=False,
+                                 retry_at=time.time() + RETRY_AFTER)
+                    # Nobody asked for a speculative key: back off instead of retrying every RETRY_AFTER
+                    if entry['speculative'] and self._entries.get(key) is entry:
+                        del self._entries[key]
+                        self._cool_down(key)
+                return False
+            with self._lock:
+                entry.update(dataset=dataset, refreshing=False, error=None, due=False)
+                if self._entries.get(key) is entry:
+                    self._evict()
+            return True
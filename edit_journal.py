@@ -0,0 +1,217 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# CONSENSUS EDIT JOURNAL
+# ----------------------------------------------------------------------------
+# Every consensus change is one compact record (row_id, column, old, new,
+# timestamp, batch) in growable numpy arrays. Session memory therefore grows
+# with the number of edited cells, not with rows x columns per save.
+# row_id is derived from the SKU x Channel key (stable_row_ids), so a journal
+# replays onto any build of the dataset; rows no longer in it are skipped.
+# Records [0, head) are applied; [head, size) are the redo stack and are
+# discarded as soon as a new edit is recorded.
+# ============================================================================
+_FIELDS = {
+    'row_id': np.int64,
+    'col': np.int16,
+    'old': np.float64,
+    'new': np.float64,
+    'ts': np.float64,
+    'batch': np.int32,
+}
+
+
+class EditJournal:
+    CHECKPOINT_EVERY = 500  # Records between materialized checkpoints
+
+    def __init__(self, capacity=256, base_state=None):
+        # Values inherited from a parent journal at fork time; never mutated
+        self._base_state = dict(base_state or {})
+        self._arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in _FIELDS.items()}
+        self._columns = []
+        self._size = 0
+        self._head = 0
+        self._next_batch = 0
+        self._checkpoints = []  # [(position, {col: Series of values by row_id})]
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    def _col_index(self, col):
+        if col not in self._columns:
+            self._columns.append(col)
+        return self._columns.index(col)
+
+    def _reserve(self, extra):
+        needed = self._head + extra
+        capacity = len(self._arrays['row_id'])
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        for name, arr in self._arrays.items():
+            grown = np.empty(new_capacity, dtype=arr.dtype)
+            grown[:self._head] = arr[:self._head]
+            self._arrays[name] = grown
+
+    def record(self, row_ids, col, old_values, new_values, batch=None):
+        """Append cell changes to a single column; returns the batch id (one undo step)"""
+        row_ids = np.asarray(row_ids)
+        n = len(row_ids)
+        if n == 0:
+            return batch
+
+        # A new edit invalidates everything that was undone
+        self._size = self._head
+        self._checkpoints = [cp for cp in self._checkpoints if cp[0] <= self._head]
+        self._reserve(n)
+
+        if batch is None:
+            batch = self._next_batch
+        self._next_batch = max(self._next_batch, batch + 1)
+
+        start, end = self._head, self._head + n
+        self._arrays['row_id'][start:end] = row_ids
+        self._arrays['col'][start:end] = self._col_index(col)
+        self._arrays['old'][start:end] = old_values
+        self._arrays['new'][start:end] = new_values
+        self._arrays['ts'][start:end] = time.time()
+        self._arrays['batch'][start:end] = batch
+        self._head = self._size = end
+
+        last_checkpoint = self._checkpoints[-1][0] if self._checkpoints else 0
+        if self._head - last_checkpoint >= self.CHECKPOINT_EVERY:
+            self._checkpoints.append((self._head, self.current_values()))
+        return batch
+
+    def record_batch(self, changes):
+        """Record several columns as one undo step: changes = [(row_ids, col, old, new)]"""
+        batch = self._next_batch
+        for row_ids, col, old, new in changes:
+            self.record(row_ids, col, old, new, batch=batch)
+        return batch if len(self) and self._arrays['batch'][self._head - 1] == batch else None
+
+    # ------------------------------------------------------------------
+    # Undo / redo
+    # ------------------------------------------------------------------
+    def _batch_bounds(self, pos, step):
+        """Start (step < 0) or end (step > 0) of the batch adjacent to `pos`"""
+        batches = self._arrays['batch']
+        if step < 0:
+            other = np.flatnonzero(batches[:pos] != batches[pos - 1])
+            return int(other[-1]) + 1 if len(other) else 0
+        other = np.flatnonzero(batches[pos:self._size] != batches[pos])
+        return pos + int(other[0]) if len(other) else self._size
+
+    @property
+    def can_undo(self):
+        return self._head > 0
+
+    @property
+    def can_redo(self):
+        return self._head < self._size
+
+    def undo(self):
+        """Step back one batch; returns False if there is nothing to undo"""
+        if not self.can_undo:
+            return False
+        self._head = self._batch_bounds(self._head, -1)
+        return True
+
+    def redo(self):
+        """Re-apply the next undone batch; returns False if there is nothing to redo"""
+        if not self.can_redo:
+            return False
+        self._head = self._batch_bounds(self._head, 1)
+        return True
+
+    def clear(self):
+        self.__init__(base_state=self._base_state)
+
+    def fork(self):
+        """New journal starting from this one's current values (shares the Series, no copy)"""
+        return EditJournal(base_state=self.current_values())
+
+    # ------------------------------------------------------------------
+    # Replay
+    # ------------------------------------------------------------------
+    def current_values(self):
+        """Last value per (column, row_id) for all applied records"""
+        base_pos, state = 0, dict(self._base_state)
+        for pos, snapshot in reversed(self._checkpoints):
+            if pos <= self._head:
+                base_pos, state = pos, dict(snapshot)
+                break
+
+        tail = slice(base_pos, self._head)
+        if tail.stop > tail.start:
+            entries = pd.DataFrame({
+                'row_id': self._arrays['row_id'][tail],
+                'col': self._arrays['col'][tail],
+                'new': self._arrays['new'][tail],
+            }).drop_duplicates(['col', 'row_id'], keep='last')
+            for col_idx, group in entries.groupby('col'):
+                col = self._columns[col_idx]
+                latest = pd.Series(group['new'].to_numpy(), index=group['row_id'].to_numpy())
+                previous = state.get(col, pd.Series(dtype=float))
+                state[col] = pd.concat([previous[~previous.index.isin(latest.index)], latest])
+        return state
+
+    def replay(self, df):
+        """
+        Apply the journal onto a baseline frame that carries a row_id column
+        Only the edited columns are copied; every other column stays shared
+        with the baseline
+        """
+        state = self.current_values()
+        if not state or 'row_id' not in df.columns:
+            return df
+        df = df.copy(deep=False)
+        row_pos = pd.Series(np.arange(len(df)), index=df['row_id'].to_numpy())
+        for col, values in state.items():
+            if col not in df.columns:
+                continue
+            values = values[values.index.isin(row_pos.index)]
+            column = df[col].to_numpy(dtype=float, copy=True)
+            column[row_pos[values.index].to_numpy()] = values.to_numpy()
+            df[col] = column
+        return df
+
+    # ------------------------------------------------------------------
+    # Introspection
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return self._head
+
+    def to_frame(self):
+        """Applied records as a DataFrame (for export / display)"""
+        head = slice(0, self._head)
+        return pd.DataFrame({
+            'row_id': self._arrays['row_id'][head],
+            'Column': [self._columns[i] for i in self._arrays['col'][head]],
+            'Old': self._arrays['old'][head],
+            'New': self._arrays['new'][head],
+            'Timestamp': pd.to_datetime(self._arrays['ts'][head], unit='s'),
+            'Batch': self._arrays['batch'][head],
+        })
+
+    def memory_usage(self, seen=None):
+        """
+        Bytes held by the journal, checkpoints and inherited values
+        seen: set of Series ids already counted (forks share their parent's Series)
+        """
+        seen = set() if seen is None else seen
+        size = sum(arr.nbytes for arr in self._arrays.values())
+        states = [self._base_state] + [snapshot for _, snapshot in self._checkpoints]
+        for state in states:
+            for series in state.values():
+                if id(series) not in seen:
+                    seen.add(id(series))
+                    size += series.memory_usage(index=True)
+        return size
+
+    @property
+    def nbytes(self):
+        return self.memory_usage()
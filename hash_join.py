@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# HASH JOIN ON INTEGER SURROGATE KEYS
+# ----------------------------------------------------------------------------
+# The composite key (up to six string columns) is factorized once over both
+# frames into one dense integer code per row. Everything after that works on
+# the codes: bincount gives the rows per key on each side, and from those
+# the unmatched keys, duplicate keys and the exact output size, before any
+# row is materialized. A stable argsort of the right-hand codes gives the
+# row positions to gather. Memory is O(rows) whatever the key cardinality.
+# Same output as pd.merge (left row order, right rows in sheet order per
+# key, _x/_y suffixes), except that fan-out is refused instead of silent.
+# ============================================================================
+MAX_EXAMPLES = 5
+
+
+class FanoutError(ValueError):
+    """The join would multiply rows: a key duplicated on both sides, or more rows than max_rows"""
+
+
+def encode_keys(left, right, on):
+    """(left_codes, right_codes, n_keys): one dense code per distinct composite key across both frames"""
+    n_left = len(left)
+    combined = np.zeros(n_left + len(right), dtype=np.int64)
+    cardinality = 1
+    for col in on:
+        # Missing keys get a code of their own and match each other, as in pd.merge
+        codes, uniques = pd.factorize(pd.concat([left[col], right[col]], ignore_index=True), use_na_sentinel=False)
+        n = max(len(uniques), 1)
+        if cardinality * n >= 2 ** 62:
+            # Re-densify before the mixed-radix code could overflow
+            combined, seen = pd.factorize(combined)
+            cardinality = len(seen)
+        combined = combined * n + codes
+        cardinality *= n
+    codes, uniques = pd.factorize(combined)
+    return codes[:n_left], codes[n_left:], len(uniques)
+
+
+def _first_occurrence(codes):
+    return ~pd.Series(codes).duplicated(keep='first').to_numpy()
+
+
+def _key_rows(frame, on, codes, counts, mask):
+    """
+    Distinct keys of frame where mask holds, with their row count in frame
+    Indexed by the frame's label of each key's first row
+    """
+    if not mask.any():
+        return pd.DataFrame({**{c: frame[c].iloc[:0] for c in on}, 'Rows': np.zeros(0, dtype=np.int64)})
+    pick = mask & _first_occurrence(codes)
+    keys = frame.loc[pick, on]
+    keys['Rows'] = counts[codes[pick]]
+    return keys
+
+
+def hash_join(left, right, on, how='inner', unique=(), max_rows=None, suffixes=('_x', '_y')):
+    """
+    Join right onto left on the key columns `on` (how = 'inner' or 'left')
+    unique: sides ('left', 'right') whose keys must be unique; later
+    duplicates are dropped (first row kept) and reported
+    Raises FanoutError when a key is still duplicated on both sides, or the
+    output would exceed max_rows
+    Returns (joined_df, report)
+    """
+    if how not in ('inner', 'left'):
+        raise ValueError(f"Unsupported join type: {how}")
+    left_codes, right_codes, n_keys = encode_keys(left, right, on)
+    left_counts = np.bincount(left_codes, minlength=n_keys)
+    right_counts = np.bincount(right_codes, minlength=n_keys)
+
+    report = {
+        'left_rows': len(left),
+        'right_rows': len(right),
+        'left_duplicates': _key_rows(left, on, left_codes, left_counts, left_counts[left_codes] > 1),
+        'right_duplicates': _key_rows(right, on, right_codes, right_counts, right_counts[right_codes] > 1),
+        'left_dropped': 0,
+        'right_dropped': 0,
+    }
+
+    # Drop duplicate keys on the sides that must be unique
+    if 'left' in unique and len(report['left_duplicates']):
+        keep = _first_occurrence(left_codes)
+        report['left_dropped'] = int((~keep).sum())
+        left, left_codes = left[keep], left_codes[keep]
+        left_counts = np.minimum(left_counts, 1)
+    if 'right' in unique and len(report['right_duplicates']):
+        keep = _first_occurrence(right_codes)
+        report['right_dropped'] = int((~keep).sum())
+        right, right_codes = right[keep], right_codes[keep]
+        right_counts = np.minimum(right_counts, 1)
+
+    # Fan-out guard, before anything is materialized
+    many_to_many = (left_counts > 1) & (right_counts > 1)
+    if many_to_many.any():
+        keys = _key_rows(left, on, left_codes, left_counts, many_to_many[left_codes]).head(MAX_EXAMPLES)
+        raise FanoutError(f"{int(many_to_many.sum()):,} keys are duplicated on both sides of the join, "
+                          f"e.g. {keys[on].to_dict('records')}")
+    matches = right_counts[left_codes]
+    out_per_row = np.maximum(matches, 1) if how == 'left' else matches
+    output_rows = int(out_per_row.sum())
+    if max_rows is not None and output_rows > max_rows:
+        raise FanoutError(f"Join would produce {output_rows:,} rows (limit {max_rows:,})")
+
+    report.update({
+        'output_rows': output_rows,
+        'matched_keys': int(((left_counts > 0) & (right_counts > 0)).sum()),
+        'left_unmatched': _key_rows(left, on, left_codes, left_counts, matches == 0),
+        'right_unmatched': _key_rows(right, on, right_codes, right_counts, left_counts[right_codes] == 0),
+    })
+
+    # Row positions: every left row repeated once per match, right rows grouped by key
+    left_idx = np.repeat(np.arange(len(left)), out_per_row)
+    if len(right):
+        order = np.argsort(right_codes, kind='stable')
+        starts = np.cumsum(right_counts) - right_counts
+        offsets = np.arange(output_rows) - np.repeat(np.cumsum(out_per_row) - out_per_row, out_per_row)
+        right_pos = np.repeat(starts[left_codes], out_per_row) + offsets
+        right_idx = np.where(np.repeat(matches > 0, out_per_row), order[np.minimum(right_pos, len(order) - 1)], -1)
+    else:
+        right_idx = np.full(output_rows, -1)
+
+    value_cols = [c for c in right.columns if c not in on]
+    overlap = set(value_cols) & (set(left.columns) - set(on))
+    out = left.take(left_idx).reset_index(drop=True)
+    out.columns = [f"{c}{suffixes[0]}" if c in overlap else c for c in out.columns]
+    if value_cols:
+        if len(right):
+            right_part = right[value_cols].take(np.maximum(right_idx, 0)).set_axis(out.index)
+            unmatched = right_idx < 0
+            if unmatched.any():
+                right_part = right_part.where(np.broadcast_to(~unmatched[:, None], right_part.shape))
+        else:
+            right_part = pd.DataFrame(np.nan, index=out.index, columns=value_cols)
+        right_part.columns = [f"{c}{suffixes[1]}" if c in overlap else c for c in value_cols]
+        out = pd.concat([out, right_part], axis=1)
+    return out, report
+
+
+def report_summary(report):
+    """One line per join: output rows, dropped duplicates, unmatched keys on each side"""
+    return (f"{report['output_rows']:,} rows; {report['matched_keys']:,} keys matched; "
+            f"duplicates dropped {report['left_dropped']:,} / {report['right_dropped']:,}; "
+            f"unmatched {len(report['left_unmatched']):,} / {len(report['right_unmatched']):,}")
+
+
+def compact_report(report, max_rows=50):
+    """
+    JSON-safe summary of a join report, stored with the dataset and its snapshot:
+    the counts, and the first max_rows rows of each key table
+    (<table>_count holds the full number of keys)
+    """
+    if report is None:
+        return None
+    summary = {name: int(report[name]) for name in
+               ['left_rows', 'right_rows', 'left_dropped', 'right_dropped', 'output_rows', 'matched_keys']}
+    for name in ['left_duplicates', 'right_duplicates', 'left_unmatched', 'right_unmatched']:
+        summary[f'{name}_count'] = len(report[name])
+        summary[name] = report[name].head(max_rows).to_dict('records')
+    return summary
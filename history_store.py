@@ -0,0 +1,203 @@
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# ============================================================================
+# INCREMENTAL SALES HISTORY
+# ----------------------------------------------------------------------------
+# sales_history grows by one month column a month, so it is mirrored locally
+# (cells as formatted text, one Arrow file per sheet) and each read fetches
+# only what can have changed:
+#   - the header row, as the diff against the local copy
+#   - the key columns, the month columns not seen before and the last
+#     REFETCH_MONTHS months (late postings), in one batch_get by column range
+#   - rows appended below the local copy, full width
+# Everything older comes from the mirror, so the fetch stays the same size as
+# history grows. A full read replaces the mirror when there is none, when the
+# key columns or existing rows changed, and every FULL_RELOAD_AFTER seconds
+# (edits to old months). The result is the frame read_records would return.
+#   <dir>/<sheet>.arrow   all columns as strings, in sheet order
+#   <dir>/<sheet>.json    header, rows, full_at, updated_at
+# ============================================================================
+HISTORY_DIR = os.environ.get("SOP_HISTORY_DIR", os.path.join(".sop_data", "history"))
+INCREMENTAL_SHEETS = ["sales_history"]
+REFETCH_MONTHS = int(os.environ.get("SOP_HISTORY_REFETCH", 3))
+FULL_RELOAD_AFTER = 7 * 24 * 3600
+MONTH_HEADER = re.compile(r'^[A-Za-z]{3}-\d{2}$')  # Same month columns build_dataset reads
+
+_memory = {}  # data path -> (mtime_ns, frame, meta); skips re-reading the mirror every load
+_lock = threading.Lock()
+
+
+def _paths(sheet_name, store_dir=None):
+    base = os.path.join(store_dir or HISTORY_DIR, sheet_name)
+    return f"{base}.arrow", f"{base}.json"
+
+
+def load_mirror(sheet_name, store_dir=None):
+    """(frame of strings, meta) of the local copy, or (None, None)"""
+    data_path, meta_path = _paths(sheet_name, store_dir)
+    try:
+        mtime = os.stat(data_path).st_mtime_ns
+        with _lock:
+            cached = _memory.get(data_path)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        with open(meta_path) as f:
+            meta = json.load(f)
+        frame = feather.read_table(data_path).to_pandas()
+    except (OSError, ValueError, pa.ArrowInvalid):
+        return None, None
+    if list(frame.columns) != meta.get('header'):
+        return None, None
+    with _lock:
+        _memory[data_path] = (mtime, frame, meta)
+    return frame, meta
+
+
+def save_mirror(sheet_name, frame, full, store_dir=None):
+    """Replace the local copy (data file first, meta last); full: this was a whole-sheet read"""
+    data_path, meta_path = _paths(sheet_name, store_dir)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    _, old_meta = load_mirror(sheet_name, store_dir)
+    now = time.time()
+    meta = {
+        'header': list(frame.columns),
+        'rows': len(frame),
+        'full_at': now if full or not old_meta else old_meta['full_at'],
+        'updated_at': now,
+    }
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    feather.write_feather(pa.Table.from_pandas(frame.astype(str), preserve_index=False),
+                          data_path + suffix, compression='zstd')
+    os.replace(data_path + suffix, data_path)
+    with open(meta_path + suffix, 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + suffix, meta_path)
+    return meta
+
+
+def invalidate(sheet_name=None, store_dir=None):
+    """Drop the local copy of one sheet (or all), so the next read is a full one"""
+    for name in [sheet_name] if sheet_name else INCREMENTAL_SHEETS:
+        for path in _paths(name, store_dir):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _month_order(label):
+    try:
+        return datetime.strptime(label.strip(), "%b-%y")
+    except ValueError:
+        return datetime(1900, 1, 1)
+
+
+def _column_letter(position):
+    """1-based column position -> A1 letters"""
+    from gspread.utils import rowcol_to_a1
+    return rowcol_to_a1(1, position)[:-1]
+
+
+def _spans(positions):
+    """Consecutive runs of sorted 1-based positions, as (first, last)"""
+    spans = []
+    for p in sorted(positions):
+        if spans and p == spans[-1][1] + 1:
+            spans[-1][1] = p
+        else:
+            spans.append([p, p])
+    return spans
+
+
+def _padded(values, width):
+    return [list(row) + [''] * (width - len(row)) for row in values]
+
+
+def records_frame(frame, month_cols):
+    """Cells as read_records returns them: numbers parsed except in month columns (cleaned later from the text)"""
+    from gspread.utils import numericise
+    out = frame.copy()
+    for col in out.columns:
+        if col not in month_cols:
+            out[col] = pd.Series([numericise(v) for v in out[col]], index=out.index)
+    return out
+
+
+def read_all_records(worksheet):
+    """
+    Whole worksheet through get_all_records, with month cells kept as the sheet
+    formats them (records_frame's rule), so '1.000' cleans the same on every path
+    """
+    records = worksheet.get_all_records(value_render_option='FORMATTED_VALUE', numericise_ignore=['all'])
+    df = pd.DataFrame(records)
+    return records_frame(df, [c for c in df.columns if MONTH_HEADER.match(str(c).strip())])
+
+
+def read_history(worksheet, store_dir=None, refetch=REFETCH_MONTHS):
+    """
+    worksheet as read_records returns it, fetching only new or recent month columns
+    Returns (df, stats) with stats = mode ('full' or 'incremental'), reason, cells fetched
+    """
+    header = [str(h) for h in worksheet.row_values(1)]
+    if not header or len(set(header)) != len(header):
+        # Nothing to diff against; get_all_records reports duplicate headers itself
+        return read_all_records(worksheet), {'mode': 'full', 'reason': 'no usable header', 'cells': None}
+
+    months = [h for h in header if MONTH_HEADER.match(h.strip())]
+    keys = [h for h in header if h not in months]
+    frame, meta = load_mirror(worksheet.title, store_dir)
+    reason = None
+    if frame is None:
+        reason = "no local copy"
+    elif time.time() - meta['full_at'] > FULL_RELOAD_AFTER:
+        reason = "periodic full read"
+    elif [h for h in meta['header'] if not MONTH_HEADER.match(h.strip())] != keys:
+        reason = "key columns changed"
+
+    if reason is None:
+        recent = set(sorted(months, key=_month_order)[-refetch:]) if refetch > 0 else set()
+        wanted = [h for h in header if h in keys or h not in frame.columns or h in recent]
+        spans = _spans(header.index(h) + 1 for h in wanted)
+        ranges = [f"{_column_letter(a)}2:{_column_letter(b)}" for a, b in spans]
+        blocks = worksheet.batch_get(ranges, major_dimension='COLUMNS', value_render_option='FORMATTED_VALUE')
+        fetched = {}
+        for (a, b), block in zip(spans, blocks):
+            block = list(block)
+            for offset in range(b - a + 1):
+                fetched[header[a - 1 + offset]] = list(block[offset]) if offset < len(block) else []
+        n_rows = max(len(v) for v in fetched.values())
+        cells = sum(len(v) for v in fetched.values())
+        fresh = pd.DataFrame({h: pd.Series(v + [''] * (n_rows - len(v)), dtype=object) for h, v in fetched.items()})
+
+        n_old = len(frame)
+        if n_rows < n_old or not fresh[keys].iloc[:n_old].astype(str).equals(frame[keys]):
+            reason = "rows changed"
+        else:
+            merged = frame.reindex(columns=header, fill_value='')
+            if n_rows > n_old:
+                # Appended rows: all their columns, in one range below the mirror
+                last = _column_letter(len(header))
+                appended = worksheet.get(f"A{n_old + 2}:{last}{n_rows + 1}", value_render_option='FORMATTED_VALUE')
+                appended = pd.DataFrame(_padded(appended, len(header))[:n_rows - n_old], columns=header)
+                cells += appended.size
+                merged = pd.concat([merged, appended.reindex(range(n_rows - n_old))], ignore_index=True)
+            for h, values in fresh.items():
+                merged[h] = values.to_numpy()
+            merged = merged.fillna('').astype(str)
+            save_mirror(worksheet.title, merged, full=False, store_dir=store_dir)
+            return records_frame(merged, months), {'mode': 'incremental', 'reason': None, 'cells': cells}
+
+    values = worksheet.get_all_values(value_render_option='FORMATTED_VALUE')
+    rows = _padded(values[1:], len(header))
+    full = pd.DataFrame([row[:len(header)] for row in rows], columns=header, dtype=object).astype(str)
+    save_mirror(worksheet.title, full, full=True, store_dir=store_dir)
+    return records_frame(full, months), {'mode': 'full', 'reason': reason, 'cells': full.size + len(header)}
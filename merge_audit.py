@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from hash_join import encode_keys
+
+# ============================================================================
+# MERGE AUDIT (ANTI-JOINS)
+# ----------------------------------------------------------------------------
+# Keys that the sales x ROFO inner join drops, from both sides, with the
+# likely cause:
+#   Attribute mismatch   same sku_code + Channel, other key columns differ
+#   Channel mismatch     sku_code is on the other sheet, under other channels
+#   Key typo             sku_code matches after normalising case, spaces,
+#                        punctuation and leading zeros
+#   New launch           ROFO SKU with no sales history at all (kept in the
+#                        worksheet with L3M 0)
+#   No forecast          sales SKU missing from ROFO altogether
+# Classification looks only at the unmatched keys (hash-encoded lookups
+# against the other sheet), so it costs nothing when the sheets line up.
+# ============================================================================
+NEW_LAUNCH = "New launch"
+CAUSES = ["Attribute mismatch", "Channel mismatch", "Key typo", NEW_LAUNCH, "No forecast"]
+
+
+def normalize_sku(values):
+    """sku_code as compared for typos: upper case, letters and digits only, no leading zeros in numbers"""
+    return (values.astype(str).str.upper().str.replace(r'[^0-9A-Z]', '', regex=True)
+            .str.replace(r'(?<![0-9])0+(?=[0-9])', '', regex=True))
+
+
+def _present(frame, other, cols):
+    """Which rows of frame have their cols key somewhere in other"""
+    codes, other_codes, n_keys = encode_keys(frame, other, cols)
+    seen = np.zeros(n_keys, dtype=bool)
+    seen[other_codes] = True
+    return seen[codes]
+
+
+def _attribute_hint(col, mine, theirs):
+    """How the other sheet's value of one key column differs, or '' when it does not"""
+    if mine == theirs:
+        return ""
+    if mine.strip().casefold() == theirs.strip().casefold():
+        return f"{col} {theirs!r} (differs only in whitespace/case)"
+    return f"{col} {theirs!r}"
+
+
+def classify_unmatched(unmatched, other, keys, missing_cause):
+    """
+    Cause and hint for each unmatched key of one sheet
+    unmatched: keys missing from `other` (the other sheet's key frame)
+    missing_cause: label when the SKU is nowhere on the other sheet
+    """
+    out = unmatched[keys].copy()
+    out['Cause'] = missing_cause
+    out['Hint'] = ""
+    if out.empty or 'sku_code' not in keys:
+        return out
+
+    sku_found = _present(out, other, ['sku_code'])
+    if 'Channel' in keys:
+        pair_found = _present(out, other, ['sku_code', 'Channel'])
+        attr = sku_found & pair_found
+        channel = sku_found & ~pair_found
+    else:
+        attr, channel = sku_found, np.zeros(len(out), dtype=bool)
+
+    if attr.any():
+        # Key columns that differ from the other sheet's row with the same sku_code (+ Channel)
+        pair = ['sku_code', 'Channel'] if 'Channel' in keys else ['sku_code']
+        cols = [k for k in keys if k not in pair]
+        mine = out.loc[attr].set_index(pair)[cols]
+        ref = other.drop_duplicates(pair).set_index(pair)[cols].reindex(mine.index)
+        # Values shown with repr() so a stray space is visible; the join compares them exactly
+        hints = [[_attribute_hint(c, a, b) for a, b in zip(mine[c].astype(str), ref[c].astype(str))] for c in cols]
+        out.loc[attr, 'Cause'] = "Attribute mismatch"
+        out.loc[attr, 'Hint'] = ["other sheet has " + ", ".join(filter(None, row)) if any(row)
+                                 else "other sheet has these values on another row with this key"
+                                 for row in zip(*hints)]
+
+    if channel.any():
+        channels = other.groupby('sku_code', sort=False)['Channel'].agg(lambda s: ", ".join(map(str, pd.unique(s))))
+        out.loc[channel, 'Cause'] = "Channel mismatch"
+        out.loc[channel, 'Hint'] = ("other sheet has " + out.loc[channel, 'sku_code'].map(channels)).to_numpy()
+
+    rest = ~sku_found
+    if rest.any():
+        other_norm = normalize_sku(other['sku_code'])
+        lookup = pd.Series(other['sku_code'].astype(str).to_numpy(), index=other_norm.to_numpy())
+        lookup = lookup[~lookup.index.duplicated()]
+        match = normalize_sku(out.loc[rest, 'sku_code']).map(lookup)
+        typo = match.notna().to_numpy()
+        rows = out.index[rest][typo]
+        out.loc[rows, 'Cause'] = "Key typo"
+        out.loc[rows, 'Hint'] = ("other sheet has sku_code '" + match[typo] + "'").to_numpy()
+    return out
+
+
+def audit_merge(report, sales_keys, rofo_keys, keys):
+    """
+    Both anti-joins of the sales x ROFO merge, classified
+    report: hash_join report of that merge; sales_keys / rofo_keys: the key
+    columns of each sheet. Indexed by the row label in the sheet it came from
+    """
+    rofo_only = classify_unmatched(report['right_unmatched'], sales_keys, keys, NEW_LAUNCH)
+    sales_only = classify_unmatched(report['left_unmatched'], rofo_keys, keys, "No forecast")
+    return pd.concat([rofo_only.assign(Sheet='rofo_current'), sales_only.assign(Sheet='sales_history')])
+
+
+def audit_to_records(audit):
+    """JSON-safe form for the snapshot pointer metadata"""
+    return None if audit is None else audit.to_dict('records')
+
+
+def audit_from_records(records):
+    """Audit back from snapshot metadata; None for snapshots written before it was stored"""
+    return None if records is None else pd.DataFrame(records)
+
+
+def cause_counts(audit):
+    """Unmatched keys per sheet and cause"""
+    if audit is None or audit.empty:
+        return pd.DataFrame(columns=['Sheet', 'Cause', 'Keys'])
+    return (audit.groupby(['Sheet', 'Cause'], sort=False).size().rename('Keys').reset_index()
+            .sort_values(['Sheet', 'Keys'], ascending=[True, False], ignore_index=True))
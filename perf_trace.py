@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+
+import pandas as pd
+
+# ============================================================================
+# STAGE TIMING SPANS
+# ----------------------------------------------------------------------------
+#   with span("merge sales x rofo", rows=len(df)):
+#       ...
+# Spans are recorded into the tracer active in the current context (one per
+# Streamlit script run). With no active tracer, span() returns a shared
+# no-op context manager, so instrumented code costs one ContextVar lookup.
+# Export as plain JSON or Chrome trace-event format (chrome://tracing,
+# Perfetto, speedscope).
+# ============================================================================
+_current = ContextVar("sop_tracer", default=None)
+_NOOP = nullcontext()
+TRACE_BY_DEFAULT = os.environ.get("SOP_TRACE", "").lower() in ("1", "true", "yes")
+
+
+class Tracer:
+    def __init__(self, name="run"):
+        self.name = name
+        self.origin = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []  # dicts: name, start, duration (seconds from origin), depth, thread, attrs
+        self._depth = 0
+
+    @contextmanager
+    def span(self, name, **attrs):
+        record = {'name': name, 'start': time.perf_counter() - self.origin, 'duration': None,
+                  'depth': self._depth, 'thread': threading.get_ident(), 'attrs': attrs}
+        self.spans.append(record)
+        self._depth += 1
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record['duration'] = time.perf_counter() - self.origin - record['start']
+
+    @property
+    def total(self):
+        ends = [s['start'] + (s['duration'] or 0) for s in self.spans]
+        return max(ends) if ends else 0.0
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+    def summary(self):
+        """Time per stage name (calls summed), slowest first"""
+        if not self.spans:
+            return pd.DataFrame(columns=['Stage', 'Calls', 'Total ms', 'Max ms'])
+        df = pd.DataFrame([{'Stage': '  ' * s['depth'] + s['name'], 'order': i, 'ms': (s['duration'] or 0) * 1000}
+                           for i, s in enumerate(self.spans)])
+        out = df.groupby('Stage', sort=False).agg(Calls=('ms', 'size'), total=('ms', 'sum'),
+                                                   Max=('ms', 'max'), order=('order', 'min'))
+        out = out.sort_values('order').drop(columns='order').reset_index()
+        return out.rename(columns={'total': 'Total ms', 'Max': 'Max ms'})
+
+    def to_json(self):
+        return json.dumps({
+            'name': self.name,
+            'started_at': self.started_at,
+            'spans': [{**s, 'attrs': {k: str(v) for k, v in s['attrs'].items()}} for s in self.spans],
+        }, indent=2)
+
+    def to_trace_events(self):
+        """Chrome trace-event JSON (complete 'X' events, microseconds)"""
+        pid = os.getpid()
+        events = [{
+            'name': s['name'], 'cat': self.name, 'ph': 'X', 'pid': pid, 'tid': s['thread'],
+            'ts': round((self.started_at + s['start']) * 1e6), 'dur': round((s['duration'] or 0) * 1e6),
+            'args': {k: str(v) for k, v in s['attrs'].items()},
+        } for s in self.spans]
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+
+def start_trace(name="run"):
+    """Make a new tracer current for this context (script run / thread) and return it"""
+    tracer = Tracer(name)
+    _current.set(tracer)
+    return tracer
+
+
+def stop_trace():
+    _current.set(None)
+
+
+def current_tracer():
+    return _current.get()
+
+
+def span(name, **attrs):
+    """Timed block in the current trace; a no-op when tracing is off"""
+    tracer = _current.get()
+    if tracer is None:
+        return _NOOP
+    return tracer.span(name, **attrs)
+
+
+def traced(name=None):
+    """Decorator form of span()"""
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _current.get()
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with tracer.span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,346 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from arrow_data import to_pandas_view
+from consensus_sync import CONSENSUS_SNAPSHOT, saved_consensus, apply_saved
+from snapshot_store import list_pointers, read_snapshot
+from sop_pipeline import horizon_for
+from sql_query import CUBE_DIMS
+
+# ============================================================================
+# LOCAL READ API
+# ----------------------------------------------------------------------------
+# Downstream systems (replenishment, finance) read the plan over HTTP instead
+# of scraping consensus_rofo. Everything is served from the snapshot store,
+# never from Google Sheets:
+#   GET /v1/datasets                   published datasets (key, version, rows)
+#   GET /v1/rofo                       ROFO per SKU x Channel x horizon month
+#   GET /v1/consensus                  consensus per SKU x Channel (last push over ROFO)
+#   GET /v1/cube?by=Brand,Channel      ROFO / Stat / Consensus summed per group and month
+# Parameters: dataset (snapshot key; default the cycle of the last consensus
+# push, else the newest snapshot), months, and
+# sku_code / Channel / Brand / Brand_Group / SKU_Tier / Product_Focus filters
+# (comma-separated values); format=json (records) or parquet, or a .parquet
+# suffix. /v1/consensus answers 503 until a consensus has been published;
+# X-Consensus-Version says which push the other endpoints' Consensus
+# measures come from ("none": the ROFO start). The ETag is derived from the
+# dataset and consensus snapshot versions plus the query, so If-None-Match
+# is answered from the pointer files alone (304) and each body is built
+# once per version and shared by every poller. JSON is gzipped for clients
+# that accept it.
+# Started with the dashboard when SOP_API_PORT is set, or sop_cli.py serve.
+# ============================================================================
+API_HOST = os.environ.get("SOP_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("SOP_API_PORT", 0))  # 0: the dashboard does not start it
+RESPONSE_CACHE_BYTES = int(os.environ.get("SOP_API_CACHE_MB", 256)) * 1024 * 1024
+PLAN_CACHE_ENTRIES = 4
+GZIP_MIN_BYTES = 1024
+FILTER_COLUMNS = ['sku_code', 'Channel', 'Brand', 'Brand_Group', 'SKU_Tier', 'Product_Focus']
+ROW_COLUMNS = ['sku_code', 'Product_Name', 'Brand', 'Brand_Group', 'SKU_Tier', 'Channel', 'Product_Focus']
+CONTENT_TYPES = {'json': "application/json", 'parquet': "application/vnd.apache.parquet"}
+
+logger = logging.getLogger(__name__)
+_plans = OrderedDict()      # (snapshot dir, dataset key) -> (versions, plan frame, horizon, adjustment months)
+_responses = OrderedDict()  # etag -> [content type, body, gzipped body or None]
+_lock = threading.Lock()
+
+
+class ApiError(Exception):
+    """A request that cannot be served; status and message go to the client"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ============================================================================
+# DATA
+# ============================================================================
+def _split(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def _resolve(query, pointers):
+    """(key, pointer) of the requested dataset, by default the one the consensus was last pushed from"""
+    datasets = {k: p for k, p in pointers.items() if k != CONSENSUS_SNAPSHOT}
+    requested = query.get('dataset')
+    if requested:
+        if requested not in datasets:
+            raise ApiError(404, f"Unknown dataset {requested!r}; see /v1/datasets")
+        return requested, datasets[requested]
+    if not datasets:
+        raise ApiError(404, "No dataset published yet; open the dashboard once to build one")
+    pushed_from = pointers.get(CONSENSUS_SNAPSHOT, {}).get('metadata', {}).get('dataset')
+    key = pushed_from if pushed_from in datasets else max(datasets, key=lambda k: datasets[k]['created'])
+    return key, datasets[key]
+
+
+def _months(pointer, df):
+    """(horizon, adjustment months) from the build parameters stored with the snapshot"""
+    params = pointer.get('metadata', {}).get('params')
+    if params:
+        return horizon_for(params[0], params[1])
+    # Snapshots written before the parameters were stored
+    return ([c[len('Stat_'):] for c in df.columns if c.startswith('Stat_')],
+            [c[len('Cons_'):] for c in df.columns if c.startswith('Cons_')])
+
+
+def load_plan(key, pointer, consensus_pointer, snapshot_dir=None):
+    """
+    Dataset snapshot with the published consensus written into its Cons_ columns
+    Built once per (dataset, consensus) version pair and shared by all requests
+    """
+    versions = (pointer['version'], consensus_pointer['version'] if consensus_pointer else None)
+    cache_key = (snapshot_dir, key)
+    with _lock:
+        cached = _plans.get(cache_key)
+    if cached and cached[0] == versions:
+        return cached[1:]
+
+    table, loaded = read_snapshot(key, snapshot_dir, max_age=None)
+    if table is None or loaded['version'] != pointer['version']:
+        raise ApiError(503, "The dataset is being replaced; retry")
+    df = to_pandas_view(table)
+    horizon, adjustment = _months(pointer, df)
+    if consensus_pointer:
+        sheet, _ = read_snapshot(CONSENSUS_SNAPSHOT, snapshot_dir, max_age=None)
+        if sheet is not None:
+            cons_cols = [f'Cons_{m}' for m in adjustment if f'Cons_{m}' in df.columns]
+            df = apply_saved(df, saved_consensus(df, sheet.to_pandas(), cons_cols))
+
+    with _lock:
+        _plans[cache_key] = (versions, df, horizon, adjustment)
+        _plans.move_to_end(cache_key)
+        while len(_plans) > PLAN_CACHE_ENTRIES:
+            _plans.popitem(last=False)
+    return df, horizon, adjustment
+
+
+def _filtered(df, query):
+    mask = np.ones(len(df), dtype=bool)
+    for col in FILTER_COLUMNS:
+        if query.get(col):
+            if col not in df.columns:
+                raise ApiError(400, f"The dataset has no {col} column")
+            mask &= df[col].astype(str).isin(_split(query[col])).to_numpy()
+    return df if mask.all() else df[mask]
+
+
+def _selected_months(months, query):
+    if not query.get('months'):
+        return months
+    wanted = _split(query['months'])
+    unknown = [m for m in wanted if m not in months]
+    if unknown:
+        raise ApiError(400, f"Not in this dataset's months: {', '.join(unknown)}")
+    return [m for m in months if m in wanted]
+
+
+def rofo_frame(df, horizon, query):
+    """ROFO quantity per SKU x Channel, one column per horizon month"""
+    months = [m for m in _selected_months(horizon, query) if m in df.columns]
+    rows = _filtered(df, query)
+    return rows[[c for c in ROW_COLUMNS if c in df.columns] + months].reset_index(drop=True)
+
+
+def consensus_frame(df, adjustment, query):
+    """Consensus per SKU x Channel, one Cons_ column per adjustable month"""
+    cons_cols = [f'Cons_{m}' for m in _selected_months(adjustment, query) if f'Cons_{m}' in df.columns]
+    rows = _filtered(df, query)
+    return rows[[c for c in ROW_COLUMNS if c in df.columns] + cons_cols].reset_index(drop=True)
+
+
+def cube_frame(df, horizon, query):
+    """
+    ROFO, Stat and Consensus summed per `by` group and month (by= empty: grand total)
+    Same measures as the SQL tab's cube; months without a Cons_ column use ROFO
+    """
+    by = _split(query.get('by', 'Brand'))
+    unknown = [d for d in by if d not in CUBE_DIMS or d not in df.columns]
+    if unknown:
+        raise ApiError(400, f"Cannot group by {', '.join(unknown)}; use {', '.join(CUBE_DIMS)}")
+    months = [m for m in _selected_months(horizon, query) if m in df.columns]
+    measures = {m: (f'Stat_{m}' if f'Stat_{m}' in df.columns else None,
+                    f'Cons_{m}' if f'Cons_{m}' in df.columns else m) for m in months}
+    cols = list(dict.fromkeys(months + [c for pair in measures.values() for c in pair if c]))
+
+    rows = _filtered(df, query)
+    if by:
+        sums = rows.groupby(by, sort=True, observed=True)[cols].sum().reset_index()
+    else:
+        sums = rows[cols].sum().to_frame().T
+    parts = [sums[by].assign(Month=m, ROFO=sums[m], Stat=sums[stat] if stat else np.nan, Consensus=sums[cons])
+             for m, (stat, cons) in measures.items()]
+    if not parts:
+        return pd.DataFrame(columns=by + ['Month', 'ROFO', 'Stat', 'Consensus'])
+    return pd.concat(parts, ignore_index=True)
+
+
+def datasets_frame(pointers):
+    return pd.DataFrame([{'dataset': key, 'version': p['version'], 'created': p['created'], 'rows': p['rows'],
+                          'params': p.get('metadata', {}).get('params')}
+                         for key, p in pointers.items() if key != CONSENSUS_SNAPSHOT],
+                        columns=['dataset', 'version', 'created', 'rows', 'params'])
+
+
+# ============================================================================
+# HTTP
+# ============================================================================
+ENDPOINTS = {
+    '/v1/rofo': lambda df, horizon, adjustment, query: rofo_frame(df, horizon, query),
+    '/v1/consensus': lambda df, horizon, adjustment, query: consensus_frame(df, adjustment, query),
+    '/v1/cube': lambda df, horizon, adjustment, query: cube_frame(df, horizon, query),
+}
+
+
+def _etag(*parts):
+    return '"' + hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:20] + '"'
+
+
+def _matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def _format(path, query, headers):
+    if path.endswith('.parquet') or path.endswith('.json'):
+        path, fmt = path.rsplit('.', 1)
+    else:
+        fmt = query.get('format') or ('parquet' if CONTENT_TYPES['parquet'] in headers.get('Accept', '') else 'json')
+    if fmt not in CONTENT_TYPES:
+        raise ApiError(400, f"Unknown format {fmt!r}; use json or parquet")
+    return path.rstrip('/') or '/', fmt
+
+
+def encode(frame, fmt):
+    if fmt == 'parquet':
+        buffer = io.BytesIO()
+        frame.to_parquet(buffer, index=False, compression='zstd')
+        return buffer.getvalue()
+    return frame.to_json(orient='records').encode()
+
+
+def _cached(etag, build, content_type):
+    """Body for an ETag, built on the first request and kept within RESPONSE_CACHE_BYTES"""
+    with _lock:
+        entry = _responses.get(etag)
+        if entry is not None:
+            _responses.move_to_end(etag)
+            return entry
+    entry = [content_type, build(), None]
+    with _lock:
+        _responses[etag] = entry
+        while len(_responses) > 1 and sum(len(e[1]) + len(e[2] or b'') for e in _responses.values()) > RESPONSE_CACHE_BYTES:
+            _responses.popitem(last=False)
+    return entry
+
+
+def respond(path, query, headers, snapshot_dir=None):
+    """
+    (status, headers, body) for one GET; headers: request headers with .get
+    Kept free of the socket handling so it can be called directly
+    """
+    try:
+        path, fmt = _format(path, query, headers)
+        if path == '/health':
+            return 200, {'Content-Type': CONTENT_TYPES['json']}, b'{"status": "ok"}'
+        pointers = list_pointers(snapshot_dir)
+        if path == '/v1/datasets':
+            versions = sorted((k, p['version']) for k, p in pointers.items())
+            etag = _etag(snapshot_dir, path, fmt, versions)
+            dataset_version = consensus_pointer = None
+            build = lambda: encode(datasets_frame(pointers), fmt)
+        elif path in ENDPOINTS:
+            key, pointer = _resolve(query, pointers)
+            consensus_pointer = pointers.get(CONSENSUS_SNAPSHOT)
+            if consensus_pointer is None and path == '/v1/consensus':
+                # Cons_ would only be the ROFO start; do not pass that off as consensus
+                raise ApiError(503, "No consensus published yet; push from the dashboard or open it once")
+            dataset_version = pointer['version']
+            etag = _etag(snapshot_dir, path, fmt, sorted(query.items()), key, dataset_version,
+                         consensus_pointer['version'] if consensus_pointer else None)
+            build = lambda: encode(ENDPOINTS[path](*load_plan(key, pointer, consensus_pointer, snapshot_dir), query), fmt)
+        else:
+            raise ApiError(404, f"Unknown path {path}; use /v1/datasets, /v1/rofo, /v1/consensus or /v1/cube")
+
+        response_headers = {'ETag': etag, 'Cache-Control': "no-cache", 'Vary': "Accept, Accept-Encoding"}
+        if dataset_version:
+            response_headers['X-Dataset-Version'] = dataset_version
+            # "none": Consensus measures are the ROFO start, no push has been published
+            response_headers['X-Consensus-Version'] = consensus_pointer['version'] if consensus_pointer else "none"
+        if _matches(headers.get('If-None-Match'), etag):
+            return 304, response_headers, b''
+
+        entry = _cached(etag, build, CONTENT_TYPES[fmt])
+        response_headers['Content-Type'] = entry[0]
+        body = entry[1]
+        if fmt == 'json' and len(body) >= GZIP_MIN_BYTES and 'gzip' in headers.get('Accept-Encoding', ''):
+            if entry[2] is None:
+                entry[2] = gzip.compress(body, compresslevel=6)
+            body = entry[2]
+            response_headers['Content-Encoding'] = "gzip"
+        return 200, response_headers, body
+    except ApiError as e:
+        return e.status, {'Content-Type': CONTENT_TYPES['json']}, json.dumps({'error': str(e)}).encode()
+    except Exception as e:
+        logger.exception("Read API request failed: %s", path)
+        return 500, {'Content-Type': CONTENT_TYPES['json']}, json.dumps({'error': f"Internal error: {e}"}).encode()
+
+
+class ReadApiHandler(BaseHTTPRequestHandler):
+    server_version = "SOPReadAPI/1.0"
+    protocol_version = "HTTP/1.1"  # Keep-alive for pollers; every response has a Content-Length
+
+    def do_GET(self):
+        self._reply(send_body=True)
+
+    def do_HEAD(self):
+        self._reply(send_body=False)
+
+    def _reply(self, send_body):
+        url = urlsplit(self.path)
+        status, headers, body = respond(url.path, dict(parse_qsl(url.query, keep_blank_values=True)), self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body and body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def make_server(host=API_HOST, port=API_PORT):
+    server = ThreadingHTTPServer((host, port), ReadApiHandler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(host=API_HOST, port=API_PORT):
+    """
+    Serve from a daemon thread next to the dashboard
+    Returns the server, or None when the port is taken (another server
+    process behind the load balancer already serves it)
+    """
+    try:
+        server = make_server(host, port)
+    except OSError as e:
+        logger.warning("Read API not started on %s:%s: %s", host, port, e)
+        return None
+    threading.Thread(target=server.serve_forever, name="sop-read-api", daemon=True).start()
+    return server
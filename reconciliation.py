@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# HIERARCHICAL RECONCILIATION
+# ----------------------------------------------------------------------------
+# Leaves are the worksheet rows (SKU x Channel). Every aggregate node is one
+# row of a sparse summing matrix S, so bottom-up totals are S @ leaves and
+# top-down allocation is a scatter of node targets back through the same
+# indicator structure. No per-node Python loops.
+# ============================================================================
+HIERARCHY = ['Brand_Group', 'Brand']
+RECONCILE_LEVELS = {
+    'Total': [],
+    'Brand Group': ['Brand_Group'],
+    'Brand': ['Brand'],
+    'Channel': ['Channel'],
+    'Brand × Channel': ['Brand', 'Channel'],
+}
+ALLOCATION_BASIS = ['L3M_Avg', 'ROFO', 'Consensus']
+
+
+def level_codes(df, level_cols):
+    """Integer node code per row plus the node labels for one level (no columns: the Total node)"""
+    if not level_cols:
+        return np.zeros(len(df), dtype=np.int64), pd.Index(['Total'])
+    keys = df[level_cols].fillna('').astype(str)
+    if len(level_cols) == 1:
+        codes, labels = pd.factorize(keys[level_cols[0]], sort=True)
+        return codes, pd.Index(labels)
+    codes, labels = pd.MultiIndex.from_frame(keys).factorize(sort=True)
+    return codes, labels
+
+
+def indicator_matrix(codes, n_nodes):
+    """Sparse (n_nodes x n_rows) 0/1 matrix mapping rows to their node"""
+    from scipy import sparse
+    n_rows = len(codes)
+    return sparse.csr_matrix(
+        (np.ones(n_rows), (codes, np.arange(n_rows))), shape=(n_nodes, n_rows))
+
+
+def build_summing_matrix(df, levels=HIERARCHY):
+    """
+    Stack Total, each hierarchy level and the leaves into one summing matrix
+    Returns (S, nodes) where nodes has Level / Node columns aligned to S rows
+    """
+    from scipy import sparse  # scipy loads only when a hierarchy is built
+    n_rows = len(df)
+    blocks = [sparse.csr_matrix(np.ones((1, n_rows)))]
+    node_frames = [pd.DataFrame({'Level': ['Total'], 'Node': ['Total']})]
+
+    for level in levels:
+        cols = level if isinstance(level, list) else [level]
+        cols = [c for c in cols if c in df.columns]
+        if not cols:
+            continue
+        codes, labels = level_codes(df, cols)
+        blocks.append(indicator_matrix(codes, len(labels)))
+        node_frames.append(pd.DataFrame({
+            'Level': ' × '.join(cols),
+            'Node': [' × '.join(l) if isinstance(l, tuple) else l for l in labels],
+        }))
+
+    blocks.append(sparse.identity(n_rows, format='csr'))
+    node_frames.append(pd.DataFrame({'Level': 'Leaf', 'Node': np.arange(n_rows).astype(str)}))
+
+    return sparse.vstack(blocks, format='csr'), pd.concat(node_frames, ignore_index=True)
+
+
+def bottom_up(S, leaf_values):
+    """Aggregate leaf values (n_rows x n_months) to every node"""
+    return np.asarray(S @ leaf_values)
+
+
+def _round_preserving_totals(values, codes, totals):
+    """Round allocations to whole units while keeping each node's total"""
+    floored = np.floor(values)
+    frac = values - floored
+    n_nodes = len(totals)
+    shortfall = np.rint(totals - np.bincount(codes, weights=floored, minlength=n_nodes)).astype(int)
+
+    # Rank rows inside their node by fractional part, biggest first
+    order = np.lexsort((-frac, codes))
+    sorted_codes = codes[order]
+    group_start = np.searchsorted(sorted_codes, sorted_codes)
+    rank = np.empty(len(codes), dtype=int)
+    rank[order] = np.arange(len(codes)) - group_start
+    return floored + (rank < shortfall[codes])
+
+
+def top_down(df, level_cols, targets, current, basis):
+    """
+    Allocate node targets down to the leaves proportional to `basis`
+    targets: DataFrame indexed by node label, one column per month
+             (NaN / missing node = leave that node's leaves unchanged)
+    current: (n_rows x n_months) consensus before allocation
+    basis: (n_rows,) or (n_rows x n_months) allocation weights
+    """
+    codes, labels = level_codes(df, level_cols)
+    n_nodes = len(labels)
+    A = indicator_matrix(codes, n_nodes)
+
+    current = np.asarray(current, dtype=float)
+    weights = np.asarray(basis, dtype=float)
+    if weights.ndim == 1:
+        weights = np.repeat(weights[:, None], current.shape[1], axis=1)
+    weights = np.clip(np.nan_to_num(weights), 0, None)
+
+    node_weight = np.asarray(A @ weights)
+    node_count = np.asarray(A.sum(axis=1)).ravel()
+    # Nodes with no basis at all are split evenly
+    share = np.where(node_weight[codes] > 0,
+                     weights / np.where(node_weight[codes] > 0, node_weight[codes], 1),
+                     1.0 / node_count[codes][:, None])
+
+    target_mat = targets.reindex(labels).to_numpy(dtype=float)
+    result = current.copy()
+    for j in range(current.shape[1]):
+        node_target = target_mat[:, j]
+        has_target = ~np.isnan(node_target)
+        if not has_target.any():
+            continue
+        allocated = _round_preserving_totals(
+            share[:, j] * np.nan_to_num(node_target)[codes], codes, np.nan_to_num(node_target))
+        rows = has_target[codes]
+        result[rows, j] = allocated[rows]
+    return result
+
+
+def levels_above(level_cols, hierarchy=HIERARCHY):
+    """
+    Levels whose totals an allocation at level_cols changes (Total is always
+    part of the summing matrix): the hierarchy levels other than this one,
+    plus each column of a crossed level (Brand × Channel rolls up to Brand
+    and to Channel)
+    """
+    levels = [l for l in hierarchy if [l] != list(level_cols)]
+    if len(level_cols) > 1:
+        levels += [c for c in level_cols if c not in levels]
+    return levels
+
+
+def middle_out(df, level_cols, targets, current, basis, upper_levels=None):
+    """
+    Set numbers at a middle level: allocate down to the leaves, then
+    re-aggregate every level above from the new leaves
+    upper_levels: default levels_above(level_cols)
+    Returns (new_leaves, upper_totals)
+    """
+    leaves = top_down(df, level_cols, targets, current, basis)
+    if upper_levels is None:
+        upper_levels = levels_above(level_cols)
+    S, nodes = build_summing_matrix(df, levels=upper_levels)
+    totals = bottom_up(S, leaves)
+    upper = nodes['Level'] != 'Leaf'
+    return leaves, pd.concat([nodes[upper].reset_index(drop=True),
+                              pd.DataFrame(totals[upper.to_numpy()])], axis=1)
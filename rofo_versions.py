@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from hash_join import encode_keys
+from sop_pipeline import clean_currency_frame, sort_month_columns, standardize_columns
+
+# ============================================================================
+# ROFO VERSIONS & CHANGE WATERFALL
+# ----------------------------------------------------------------------------
+# rofo_current is overwritten every cycle, so each read that differs from the
+# last stored version is kept as a compact snapshot: one row per
+# SKU x Channel, the attributes used for grouping, and the month quantities
+# as float32, zstd-compressed Arrow. Identical reads are recognised by a
+# content hash and stored once.
+#   <dir>/rofo_<YYYYmmddHHMMSS>_<hash>.arrow
+# diff_versions() aligns two versions on integer key codes and compares the
+# month matrices in one pass; waterfall() rolls the diff up into added SKUs,
+# removed SKUs and volume up / down per brand. Versions are immutable, so a
+# diff computed once can be cached by the two version ids.
+# ============================================================================
+ROFO_VERSION_DIR = os.environ.get("SOP_ROFO_VERSION_DIR", os.path.join(".sop_data", "rofo_versions"))
+KEEP_VERSIONS = int(os.environ.get("SOP_ROFO_KEEP_VERSIONS", 36))
+VERSION_KEYS = ['sku_code', 'Channel']
+VERSION_ATTRS = ['Product_Name', 'Brand', 'Brand_Group', 'SKU_Tier']
+MONTH_HEADER = re.compile(r'^[A-Za-z]{3}-\d{2}$')
+VERSION_FILE = re.compile(r'^rofo_(\d{14})_([0-9a-f]{12})\.arrow$')
+
+logger = logging.getLogger(__name__)
+_recorded = {}  # hash of a raw read -> its version; unchanged re-reads skip the compaction
+
+
+def compact_rofo(rofo_df):
+    """
+    rofo_current as stored: keys, attributes and numeric month columns
+    Duplicate keys keep the first row, as in the merge
+    """
+    rofo_df = standardize_columns(rofo_df.copy())
+    keys = [k for k in VERSION_KEYS if k in rofo_df.columns]
+    if not keys or rofo_df.empty:
+        return pd.DataFrame()
+    months = sort_month_columns([c for c in rofo_df.columns if MONTH_HEADER.match(str(c))])
+    attrs = [a for a in VERSION_ATTRS if a in rofo_df.columns]
+    out = rofo_df[keys + attrs].astype(str)
+    out[months] = clean_currency_frame(rofo_df[months]).astype(np.float32)
+    return out[~out.duplicated(keys)].reset_index(drop=True)
+
+
+def content_hash(compact):
+    return hashlib.sha1(pd.util.hash_pandas_object(compact, index=False).to_numpy().tobytes()
+                        + "|".join(compact.columns).encode()).hexdigest()[:12]
+
+
+def list_versions(version_dir=None):
+    """[(version, created)] oldest first; version = 'YYYYmmddHHMMSS_hash'"""
+    version_dir = version_dir or ROFO_VERSION_DIR
+    if not os.path.isdir(version_dir):
+        return []
+    versions = []
+    for name in sorted(os.listdir(version_dir)):
+        match = VERSION_FILE.match(name)
+        if match:
+            created = time.mktime(time.strptime(match.group(1), "%Y%m%d%H%M%S"))
+            versions.append((f"{match.group(1)}_{match.group(2)}", created))
+    return versions
+
+
+def record_version(rofo_df, version_dir=None, keep=KEEP_VERSIONS):
+    """
+    Store a rofo_current read as a new version unless it equals the latest one
+    Returns (version, is_new); version is None when there is nothing to store
+    or the version directory is not writable (logged, never raised: a read
+    must not fail because its snapshot could not be kept)
+    """
+    version_dir = version_dir or ROFO_VERSION_DIR
+    versions = list_versions(version_dir)
+    raw_digest = (version_dir, content_hash(rofo_df))
+    if versions and _recorded.get(raw_digest) == versions[-1][0]:
+        return versions[-1][0], False
+
+    compact = compact_rofo(rofo_df)
+    if compact.empty:
+        return None, False
+    digest = content_hash(compact)
+    if versions and versions[-1][0].endswith(digest):
+        _recorded[raw_digest] = versions[-1][0]
+        return versions[-1][0], False
+
+    version = f"{time.strftime('%Y%m%d%H%M%S')}_{digest}"
+    path = os.path.join(version_dir, f"rofo_{version}.arrow")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(version_dir, exist_ok=True)
+        feather.write_feather(pa.Table.from_pandas(compact, preserve_index=False), tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Could not store ROFO version %s: %s", version, e)
+        return None, False
+    _recorded[raw_digest] = version
+    for old, _ in versions[:max(0, len(versions) + 1 - keep)]:
+        try:
+            os.remove(os.path.join(version_dir, f"rofo_{old}.arrow"))
+        except FileNotFoundError:
+            pass
+    return version, True
+
+
+@lru_cache(maxsize=8)
+def load_version(version, version_dir=None):
+    """One stored version (cached; files never change)"""
+    path = os.path.join(version_dir or ROFO_VERSION_DIR, f"rofo_{version}.arrow")
+    return feather.read_table(path).to_pandas()
+
+
+def _month_matrix(frame, codes, n_keys, months):
+    matrix = np.zeros((n_keys, len(months)), dtype=np.float64)
+    present = [m for m in months if m in frame.columns]
+    if present:
+        cols = [months.index(m) for m in present]
+        matrix[np.ix_(codes, cols)] = frame[present].to_numpy(dtype=np.float64)
+    return matrix
+
+
+def diff_versions(old, new, months=None):
+    """
+    Changes per SKU x Channel x Month between two compact versions
+    months: defaults to the months both versions cover (a new cycle shifts the horizon)
+    Returns long frame: keys, attributes, Month, Old, New, Delta, Change
+    (Added SKU, Removed SKU, Up, Down); unchanged cells are left out
+    """
+    keys = [k for k in VERSION_KEYS if k in old.columns and k in new.columns]
+    months = shared_months(old, new) if months is None else list(months)
+    old_codes, new_codes, n_keys = encode_keys(old, new, keys)
+    in_old = np.zeros(n_keys, dtype=bool)
+    in_old[old_codes] = True
+    in_new = np.zeros(n_keys, dtype=bool)
+    in_new[new_codes] = True
+
+    old_qty = _month_matrix(old, old_codes, n_keys, months)
+    new_qty = _month_matrix(new, new_codes, n_keys, months)
+    delta = new_qty - old_qty
+    rows, cols = np.nonzero(delta)
+
+    # Labels per key code: the new version's row, else the old one's
+    attrs = [a for a in VERSION_ATTRS if a in old.columns and a in new.columns]
+    labels = pd.concat([new[keys + attrs].set_axis(new_codes), old[keys + attrs].set_axis(old_codes)])
+    labels = labels[~labels.index.duplicated()]
+
+    change = np.where(~in_old[rows], "Added SKU",
+                      np.where(~in_new[rows], "Removed SKU", np.where(delta[rows, cols] > 0, "Up", "Down")))
+    out = labels.loc[rows].reset_index(drop=True)
+    out['Month'] = np.asarray(months, dtype=object)[cols] if len(months) else np.array([], dtype=object)
+    out['Old'] = old_qty[rows, cols]
+    out['New'] = new_qty[rows, cols]
+    out['Delta'] = delta[rows, cols]
+    out['Change'] = change
+    return out
+
+
+def waterfall(diff, old_total, new_total, by='Brand'):
+    """
+    Steps from the old total to the new one: Added SKUs, Removed SKUs, then
+    the net change of continuing SKUs per `by` group, largest first
+    Returns frame: Step, Value, Measure ('absolute', 'relative', 'total')
+    """
+    steps = [("Previous ROFO", old_total, 'absolute')]
+    steps.append(("Added SKUs", float(diff.loc[diff['Change'] == "Added SKU", 'Delta'].sum()), 'relative'))
+    steps.append(("Removed SKUs", float(diff.loc[diff['Change'] == "Removed SKU", 'Delta'].sum()), 'relative'))
+    continuing = diff[diff['Change'].isin(["Up", "Down"])]
+    if by in continuing.columns:
+        net = continuing.groupby(by, sort=False)['Delta'].sum()
+        net = net[net != 0]
+        net = net.reindex(net.abs().sort_values(ascending=False).index)
+        steps += [(f"{group} {'up' if value > 0 else 'down'}", float(value), 'relative') for group, value in net.items()]
+    steps.append(("Current ROFO", new_total, 'total'))
+    return pd.DataFrame(steps, columns=['Step', 'Value', 'Measure'])
+
+
+def shared_months(old, new):
+    return [c for c in old.columns if MONTH_HEADER.match(str(c)) and c in new.columns]
+
+
+def change_summary(old, new, months=None, by='Brand'):
+    """(diff, waterfall, totals) for two loaded versions, by default over the months they share"""
+    months = shared_months(old, new) if months is None else list(months)
+    diff = diff_versions(old, new, months)
+    old_total = float(old[[m for m in months if m in old.columns]].to_numpy(dtype=np.float64).sum())
+    new_total = float(new[[m for m in months if m in new.columns]].to_numpy(dtype=np.float64).sum())
+    return diff, waterfall(diff, old_total, new_total, by), {'old': old_total, 'new': new_total, 'months': months}
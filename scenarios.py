@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from edit_journal import EditJournal
+
+# ============================================================================
+# WHAT-IF SCENARIOS
+# ----------------------------------------------------------------------------
+# All scenarios share the loaded baseline (Cons_ = ROFO). A scenario is only
+# an EditJournal of the cells it changed; a new scenario forks its parent's
+# current values by reference, so memory grows with edits, not with the
+# number of scenarios x dataset size.
+# ============================================================================
+BASE_SCENARIO = "Base"
+
+
+class ScenarioStore:
+    def __init__(self):
+        self._journals = {BASE_SCENARIO: EditJournal()}
+        self.active = BASE_SCENARIO
+
+    @property
+    def names(self):
+        return list(self._journals.keys())
+
+    def journal(self, name=None):
+        return self._journals[name or self.active]
+
+    def create(self, name, from_name=None):
+        """Fork a new scenario from an existing one (default: the active one)"""
+        name = name.strip()
+        if not name:
+            raise ValueError("Scenario name is empty")
+        if name in self._journals:
+            raise ValueError(f"Scenario '{name}' already exists")
+        self._journals[name] = self.journal(from_name).fork()
+        self.active = name
+        return self._journals[name]
+
+    def delete(self, name):
+        if name == BASE_SCENARIO:
+            raise ValueError("The Base scenario cannot be deleted")
+        self._journals.pop(name, None)
+        if self.active == name:
+            self.active = BASE_SCENARIO
+
+    def switch(self, name):
+        if name not in self._journals:
+            raise KeyError(name)
+        self.active = name
+
+    @property
+    def nbytes(self):
+        """Memory held by all scenarios; Series shared between forks are counted once"""
+        seen = set()
+        return sum(journal.memory_usage(seen) for journal in self._journals.values())
+
+    def compare(self, baseline_df, cons_cols, by, names=None):
+        """
+        Consensus totals per group for several scenarios side by side
+        Baseline totals are computed once; each scenario only adds the
+        deltas of the cells it changed
+        """
+        names = names or self.names
+        by = [c for c in ([by] if isinstance(by, str) else by) if c in baseline_df.columns]
+        cons_cols = [c for c in cons_cols if c in baseline_df.columns]
+        if not by or not cons_cols:
+            return pd.DataFrame()
+
+        codes, labels = pd.MultiIndex.from_frame(baseline_df[by].fillna('').astype(str)).factorize(sort=True)
+        baseline = baseline_df[cons_cols].to_numpy(dtype=float)
+        base_totals = np.bincount(codes, weights=baseline.sum(axis=1), minlength=len(labels))
+        row_pos = pd.Series(np.arange(len(baseline_df)), index=baseline_df['row_id'].to_numpy())
+
+        result = labels.to_frame(index=False)
+        result.columns = by
+        for name in names:
+            totals = base_totals.copy()
+            for col, values in self.journal(name).current_values().items():
+                if col not in cons_cols:
+                    continue
+                values = values[values.index.isin(row_pos.index)]
+                pos = row_pos[values.index].to_numpy()
+                delta = values.to_numpy() - baseline[pos, cons_cols.index(col)]
+                totals += np.bincount(codes[pos], weights=delta, minlength=len(labels))
+            result[name] = totals
+        return result
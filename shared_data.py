@@ -0,0 +1,105 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from arrow_data import to_arrow, to_pandas_view, project, take_rows
+
+# Copy-on-write makes shallow copies and column slices share memory with the
+# shared frame until someone writes to them (default from pandas 3.0)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# ============================================================================
+# SHARED READ-ONLY DATASET
+# ----------------------------------------------------------------------------
+# The merged planning frame is built once per process and handed to every
+# session by reference. Sessions never modify it: they keep a sparse edit
+# overlay (EditJournal) and a row selection vector, and build short-lived
+# views that only materialise the columns they change.
+# The canonical copy is a pyarrow Table; the pandas frame is a view over its
+# buffers (zero-copy for numeric columns) for code that needs pandas.
+# ============================================================================
+
+
+class SharedDataset:
+    def __init__(self, df):
+        self.table = to_arrow(df) if not df.empty else None
+        self._df = to_pandas_view(self.table) if self.table is not None else df
+        self.loaded_at = time.time()
+        self.version = f"{int(self.loaded_at)}-{len(df)}x{df.shape[1]}"
+        self.nbytes = int(self.table.nbytes) if self.table is not None else 0
+        self.source = "sheets"
+        self.quality = None  # data_quality issue table of the build, if known
+        self.merge_audit = None  # keys dropped by the sales x ROFO merge, if known
+        self.new_launches = 0
+        self.join_reports = {}  # compact_report per merge
+        self.missing_months = None  # horizon months with no ROFO column, if known
+
+    @classmethod
+    def from_arrow(cls, table, version, loaded_at=None):
+        """Wrap an existing Arrow table (e.g. a memory-mapped snapshot) without copying it"""
+        dataset = cls.__new__(cls)
+        dataset.table = table
+        dataset._df = to_pandas_view(table)
+        dataset.loaded_at = loaded_at or time.time()
+        dataset.version = version
+        dataset.nbytes = int(table.nbytes)
+        dataset.source = "snapshot"
+        dataset.quality = None
+        dataset.merge_audit = None
+        dataset.new_launches = 0
+        dataset.join_reports = {}
+        dataset.missing_months = None
+        return dataset
+
+    @property
+    def empty(self):
+        return self._df.empty
+
+    def __len__(self):
+        return len(self._df)
+
+    def view(self, columns=None):
+        """Shallow view of the shared frame; writes to it never reach the original"""
+        df = self._df if columns is None else self._df[[c for c in columns if c in self._df.columns]]
+        return df.copy(deep=False)
+
+    def select(self, row_positions, columns=None):
+        """Rows picked by a selection vector (positions into the shared frame)"""
+        return self.view(columns).iloc[row_positions]
+
+    def arrow(self, row_positions=None, columns=None):
+        """Arrow table for display: zero-copy projection, sliced or taken rows"""
+        table = self.table if columns is None else project(self.table, columns)
+        return table if row_positions is None else take_rows(table, row_positions)
+
+
+def estimate_nbytes(obj):
+    """Rough in-memory size of a session_state value"""
+    if isinstance(obj, (pd.DataFrame,)):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if hasattr(obj, 'nbytes') and not isinstance(obj, type):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(k) + estimate_nbytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+def session_memory_table(session_state):
+    """Per-key memory of one session, largest first"""
+    rows = []
+    for key in list(session_state.keys()):
+        try:
+            rows.append({'Item': str(key), 'Bytes': estimate_nbytes(session_state[key])})
+        except Exception:
+            continue
+    table = pd.DataFrame(rows, columns=['Item', 'Bytes'])
+    return table.sort_values('Bytes', ascending=False, ignore_index=True)
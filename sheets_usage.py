@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# SHEETS API ACCOUNTING
+# ----------------------------------------------------------------------------
+# Every HTTP request gspread makes goes through MeteredHTTPClient, which
+# records method (the GSheetConnector call it belongs to), read/write, bytes
+# in/out, latency and throttling into one process-wide ledger. All sessions
+# share the same service account, so they share the per-minute quota too.
+# Quota headroom = what is left of the per-minute read/write quota over the
+# last 60 seconds; a 429 in that window counts as no headroom.
+# ============================================================================
+READ_QUOTA_PER_MIN = int(os.environ.get("SOP_SHEETS_READ_QUOTA", 60))
+WRITE_QUOTA_PER_MIN = int(os.environ.get("SOP_SHEETS_WRITE_QUOTA", 60))
+LOW_HEADROOM = float(os.environ.get("SOP_SHEETS_MIN_HEADROOM", 0.25))
+WINDOW_SECONDS = 15 * 60  # Latency percentiles are over this rolling window
+MAX_EVENTS = 5000
+
+_method = ContextVar("sheets_api_method", default="other")
+
+
+class ApiLedger:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=MAX_EVENTS)  # (ts, method, kind, status, bytes_in, bytes_out, seconds)
+        self.total_requests = 0
+
+    def record(self, method, kind, status, bytes_in, bytes_out, seconds):
+        with self._lock:
+            self._events.append((time.time(), method, kind, status, bytes_in, bytes_out, seconds))
+            self.total_requests += 1
+
+    def events(self, window=WINDOW_SECONDS):
+        cutoff = time.time() - window
+        with self._lock:
+            rows = [e for e in self._events if e[0] >= cutoff]
+        return pd.DataFrame(rows, columns=['ts', 'method', 'kind', 'status', 'bytes_in', 'bytes_out', 'seconds'])
+
+    def summary(self, window=WINDOW_SECONDS):
+        """Per-method requests, errors, bytes and latency percentiles over the window"""
+        events = self.events(window)
+        if events.empty:
+            return pd.DataFrame(columns=['Method', 'Requests', 'Errors', 'KB In', 'KB Out', 'p50 ms', 'p95 ms', 'Max ms'])
+        rows = []
+        for method, group in events.groupby('method', sort=False):
+            ms = group['seconds'].to_numpy() * 1000
+            rows.append({
+                'Method': method,
+                'Requests': len(group),
+                'Errors': int(((group['status'] >= 400) | (group['status'] == 0)).sum()),
+                'KB In': group['bytes_in'].sum() / 1024,
+                'KB Out': group['bytes_out'].sum() / 1024,
+                'p50 ms': float(np.percentile(ms, 50)),
+                'p95 ms': float(np.percentile(ms, 95)),
+                'Max ms': float(ms.max()),
+            })
+        return pd.DataFrame(rows).sort_values('Requests', ascending=False, ignore_index=True)
+
+    def headroom(self):
+        """Share of the per-minute read / write quota still free, and 429s in the last minute"""
+        events = self.events(60)  # quotas are per minute
+        reads = int((events['kind'] == 'read').sum())
+        writes = int((events['kind'] == 'write').sum())
+        throttled = int((events['status'] == 429).sum())
+        return {
+            'reads': reads,
+            'writes': writes,
+            'throttled': throttled,
+            'read_headroom': 0.0 if throttled else max(0.0, 1 - reads / READ_QUOTA_PER_MIN),
+            'write_headroom': 0.0 if throttled else max(0.0, 1 - writes / WRITE_QUOTA_PER_MIN),
+        }
+
+    def low_headroom(self, kind='read'):
+        return self.headroom()[f'{kind}_headroom'] < LOW_HEADROOM
+
+
+LEDGER = ApiLedger()
+
+
+def api_method(name):
+    """Attribute the HTTP requests made inside the decorated call to `name`"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = _method.set(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _method.reset(token)
+        return wrapper
+    return decorator
+
+
+def _payload_size(data, json_body):
+    if data is not None:
+        return len(data)
+    if json_body is not None:
+        return len(json.dumps(json_body, separators=(',', ':')))
+    return 0
+
+
+@lru_cache(maxsize=None)
+def metered_http_client():
+    """gspread HTTPClient subclass that records every request in LEDGER"""
+    from gspread.http_client import HTTPClient
+    from gspread.exceptions import APIError
+
+    class MeteredHTTPClient(HTTPClient):
+        def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+            kind = 'read' if method.upper() == 'GET' else 'write'
+            bytes_out = _payload_size(data, json)
+            t0 = time.perf_counter()
+            try:
+                response = super().request(method, endpoint, params=params, data=data, json=json,
+                                           files=files, headers=headers)
+            except APIError as e:
+                status = getattr(e.response, 'status_code', 500)
+                LEDGER.record(_method.get(), kind, status, len(getattr(e.response, 'content', b'') or b''),
+                              bytes_out, time.perf_counter() - t0)
+                raise
+            except Exception:
+                # Network failure: no response at all
+                LEDGER.record(_method.get(), kind, 0, 0, bytes_out, time.perf_counter() - t0)
+                raise
+            LEDGER.record(_method.get(), kind, response.status_code, len(response.content or b''),
+                          bytes_out, time.perf_counter() - t0)
+            return response
+
+    return MeteredHTTPClient
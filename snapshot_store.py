@@ -0,0 +1,148 @@
+import glob
+import json
+import os
+import re
+import time
+
+import pyarrow as pa
+
+# ============================================================================
+# MEMORY-MAPPED DATASET SNAPSHOTS
+# ----------------------------------------------------------------------------
+# The worker that ingests the sheets writes the merged dataset as a versioned
+# Arrow IPC file and then flips a small pointer file to it. Every Streamlit
+# process (behind the load balancer) memory-maps the file the pointer names,
+# read-only, instead of downloading and merging the sheets itself.
+#   <dir>/<key>.<version>.arrow   immutable data files
+#   <dir>/<key>.current           JSON pointer, replaced atomically
+# Old versions are unlinked only after a newer one is live; processes that
+# still map them keep their pages until they drop the table (POSIX).
+# ============================================================================
+SNAPSHOT_DIR = os.environ.get("SOP_SNAPSHOT_DIR", os.path.join(".sop_data", "snapshots"))
+SNAPSHOT_TTL = 600  # Seconds a snapshot is served before a re-ingest (matches the sheet cache)
+KEEP_VERSIONS = 2
+
+
+def snapshot_key(start_date_str, all_months=False, stat_model=""):
+    """File-safe key for one load_data_v5 parameter set"""
+    raw = f"{start_date_str}_{'all' if all_months else 'adj'}_{stat_model}"
+    return re.sub(r'[^A-Za-z0-9_-]+', '-', raw).strip('-')
+
+
+def _pointer_path(key, snapshot_dir=None):
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f"{key}.current")
+
+
+def _atomic_write(path, write):
+    """Write via a temp file in the same directory, then rename over the target"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def write_snapshot(table, key, snapshot_dir=None, metadata=None):
+    """
+    Publish a new version of the dataset: data file first, pointer last,
+    so readers only ever see complete files. Returns the pointer dict
+    """
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    created = time.time()
+    version = f"{int(created * 1000)}-{os.getpid()}"
+    data_file = f"{key}.{version}.arrow"
+
+    def write_table(path):
+        # Uncompressed so the file can be mapped without decoding
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    _atomic_write(os.path.join(snapshot_dir, data_file), write_table)
+
+    pointer = {
+        'file': data_file,
+        'version': version,
+        'created': created,
+        'rows': table.num_rows,
+        'metadata': metadata or {},
+    }
+
+    def write_pointer(path):
+        with open(path, 'w') as f:
+            json.dump(pointer, f)
+
+    _atomic_write(_pointer_path(key, snapshot_dir), write_pointer)
+    _prune(key, snapshot_dir, keep=data_file)
+    return pointer
+
+
+def read_pointer(key, snapshot_dir=None):
+    """Current pointer for a key, or None"""
+    try:
+        with open(_pointer_path(key, snapshot_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_pointers(snapshot_dir=None):
+    """{key: pointer} of every published key"""
+    pointers = {}
+    for path in sorted(glob.glob(os.path.join(snapshot_dir or SNAPSHOT_DIR, "*.current"))):
+        key = os.path.basename(path)[:-len(".current")]
+        pointer = read_pointer(key, snapshot_dir)
+        if pointer is not None:
+            pointers[key] = pointer
+    return pointers
+
+
+def read_snapshot(key, snapshot_dir=None, max_age=SNAPSHOT_TTL):
+    """
+    Memory-map the current version read-only
+    Returns (table, pointer), or (None, pointer) when missing or older than max_age
+    """
+    pointer = read_pointer(key, snapshot_dir)
+    if pointer is None:
+        return None, None
+    if max_age is not None and time.time() - pointer['created'] > max_age:
+        return None, pointer
+
+    path = os.path.join(snapshot_dir or SNAPSHOT_DIR, pointer['file'])
+    try:
+        source = pa.memory_map(path, 'r')
+        table = pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowInvalid):
+        # Pruned between reading the pointer and opening the file
+        return None, pointer
+    return table, pointer
+
+
+def invalidate(snapshot_dir=None, keep=()):
+    """
+    Drop all pointers so the next load re-ingests (data files are pruned on the next write)
+    keep: keys whose pointers stay, e.g. published state that is not rebuilt from the sheets
+    """
+    for path in glob.glob(os.path.join(snapshot_dir or SNAPSHOT_DIR, "*.current")):
+        if os.path.basename(path)[:-len(".current")] in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _prune(key, snapshot_dir, keep):
+    """Remove all but the newest KEEP_VERSIONS data files of a key"""
+    files = sorted(glob.glob(os.path.join(snapshot_dir, f"{glob.escape(key)}.*.arrow")),
+                   key=os.path.getmtime, reverse=True)
+    for path in files[KEEP_VERSIONS:]:
+        if os.path.basename(path) != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
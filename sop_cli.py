@@ -0,0 +1,195 @@
+"""
+Headless S&OP pipeline
+
+    python sop_cli.py load --start Oct-26 --out out/consensus_Oct-26.parquet
+    python sop_cli.py load --start Oct-26 --adjust adjustments.csv --push --updated-by "Nightly job"
+    python sop_cli.py batch --start Oct-26 --count 6 --out-dir out/ --workers 4
+    python sop_cli.py serve --port 8765
+
+Credentials come from the same [gsheets] block the dashboard uses
+(.streamlit/secrets.toml), or SOP_SHEET_ID + SOP_SERVICE_ACCOUNT_FILE.
+--input-dir reads <sheet>.csv files instead of Google Sheets.
+serve runs the read API (read_api.py) over the published snapshots on its own.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tomllib
+from datetime import datetime
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from stat_forecast import STAT_MODELS, DEFAULT_STAT_MODEL
+from sop_pipeline import (SHEETS, PipelineError, open_spreadsheet, read_records, build_dataset, build_many,
+                          apply_adjustments, write_output, push_consensus)
+from hash_join import report_summary
+from merge_audit import cause_counts
+from data_quality import issue_summary
+from rofo_versions import record_version
+from read_api import API_HOST, make_server
+from snapshot_store import snapshot_key
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", file=sys.stderr)
+
+
+# ============================================================================
+# INPUTS
+# ============================================================================
+def sheet_credentials(secrets_path):
+    """(sheet_id, service_account_info) from env or the Streamlit secrets file"""
+    if os.environ.get("SOP_SHEET_ID") and os.environ.get("SOP_SERVICE_ACCOUNT_FILE"):
+        with open(os.environ["SOP_SERVICE_ACCOUNT_FILE"]) as f:
+            return os.environ["SOP_SHEET_ID"], json.load(f)
+    if not os.path.exists(secrets_path):
+        raise PipelineError(f"No credentials: set SOP_SHEET_ID/SOP_SERVICE_ACCOUNT_FILE or provide {secrets_path}")
+    with open(secrets_path, 'rb') as f:
+        gsheets = tomllib.load(f)["gsheets"]
+    info = gsheets["service_account_info"]
+    return gsheets["sheet_id"], json.loads(info) if isinstance(info, str) else info
+
+
+def read_sheets(args):
+    """sales_history, rofo_current, stock_onhand as DataFrames"""
+    if args.input_dir:
+        frames = []
+        for name in SHEETS:
+            path = os.path.join(args.input_dir, f"{name}.csv")
+            frames.append(pd.read_csv(path) if os.path.exists(path) else pd.DataFrame())
+        return frames
+    spreadsheet = open_spreadsheet(*sheet_credentials(args.secrets))
+    sheets = [read_records(spreadsheet, name) for name in SHEETS]
+    version, is_new = record_version(sheets[SHEETS.index("rofo_current")])
+    if is_new:
+        log(f"Stored ROFO version {version}")
+    return sheets
+
+
+def read_table(path):
+    return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+
+
+def start_months(start, count):
+    first = datetime.strptime(start, "%b-%y")
+    return [(first + relativedelta(months=i)).strftime("%b-%y") for i in range(count)]
+
+
+# ============================================================================
+# COMMANDS
+# ============================================================================
+def cmd_load(args):
+    t0 = time.perf_counter()
+    sheets = read_sheets(args)
+    log(f"Read {', '.join(f'{n} ({len(df):,} rows)' for n, df in zip(SHEETS, sheets))} "
+        f"in {time.perf_counter() - t0:.1f}s")
+
+    df, info = build_dataset(*sheets, args.start, args.all_months, args.stat_model)
+    cons_cols = [f'Cons_{m}' for m in info['adjustment_months']]
+    log(f"Merged {len(df):,} rows, horizon {info['horizon_months'][0]} - {info['horizon_months'][-1]}")
+    if info['missing_months']:
+        log(f"Missing months in ROFO: {', '.join(info['missing_months'])}")
+    for name, report in info['join_reports'].items():
+        if report is not None:
+            log(f"Join {name}: {report_summary(report)}")
+    for _, row in cause_counts(info['merge_audit']).iterrows():
+        log(f"Unmatched in {row['Sheet']}: {row['Keys']:,} keys ({row['Cause']})")
+    if info['new_launches']:
+        log(f"Kept {info['new_launches']:,} new-launch keys with L3M 0")
+    log(f"Data quality: {issue_summary(info['quality'])}")
+    for _, row in info['quality'].iterrows():
+        log(f"  [{row['Severity']}] {row['Rule']} in {row['Sheet']}: {row['Count']:,} (e.g. {row['Examples']})")
+
+    if args.adjust:
+        df, applied, unmatched = apply_adjustments(df, read_table(args.adjust))
+        log(f"Applied {applied:,} adjustments; {len(unmatched):,} rows did not match a SKU/Channel/month")
+
+    if args.out:
+        write_output(df, args.out)
+        log(f"Wrote {args.out}")
+
+    if args.push:
+        spreadsheet = open_spreadsheet(*sheet_credentials(args.secrets))
+        merge, message = push_consensus(spreadsheet, df, cons_cols, updated_by=args.updated_by,
+                                        dataset=snapshot_key(args.start, args.all_months, args.stat_model))
+        log(f"Pushed {merge.written_cells:,} cells to consensus_rofo. {message}")
+    return 0
+
+
+def cmd_batch(args):
+    sheets = read_sheets(args)
+    months = start_months(args.start, args.count)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    failed = 0
+    t0 = time.perf_counter()
+    for month, df, info, error in build_many(*sheets, months, args.all_months, args.stat_model,
+                                              max_workers=args.workers):
+        if error:
+            failed += 1
+            log(f"{month}: {error}")
+            continue
+        path = write_output(df, os.path.join(args.out_dir, f"consensus_{month}.{args.format}"))
+        log(f"{month}: {len(df):,} rows -> {path}")
+    log(f"{len(months) - failed}/{len(months)} start months in {time.perf_counter() - t0:.1f}s")
+    return 1 if failed else 0
+
+
+def cmd_serve(args):
+    server = make_server(args.host, args.port)
+    log(f"Read API on http://{args.host}:{server.server_address[1]}/v1/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless S&OP ingest, merge and consensus export")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"),
+                        help="Streamlit secrets file with the [gsheets] block")
+    parser.add_argument("--input-dir", help="Read <sheet>.csv files from this directory instead of Google Sheets")
+    parser.add_argument("--all-months", action="store_true", help="Make all 12 months adjustable (Cons_ columns)")
+    parser.add_argument("--stat-model", default=DEFAULT_STAT_MODEL, choices=list(STAT_MODELS.keys()))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="Build one start month, optionally adjust, export and push")
+    load.add_argument("--start", required=True, help="Forecast start month, e.g. Oct-26")
+    load.add_argument("--adjust", help="Adjustment file (CSV/Parquet): sku_code, Channel, Month, Consensus or Change_Pct")
+    load.add_argument("--out", help="Output path (.parquet or .csv)")
+    load.add_argument("--push", action="store_true", help="Upsert the consensus into consensus_rofo")
+    load.add_argument("--updated-by", default="S&OP Pipeline", help="Recorded as Updated_By on pushed rows")
+    load.set_defaults(func=cmd_load)
+
+    batch = sub.add_parser("batch", help="Build consecutive start months in parallel")
+    batch.add_argument("--start", required=True, help="First start month, e.g. Oct-26")
+    batch.add_argument("--count", type=int, default=3, help="Number of consecutive start months")
+    batch.add_argument("--out-dir", required=True)
+    batch.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    batch.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    batch.set_defaults(func=cmd_batch)
+
+    serve = sub.add_parser("serve", help="Serve consensus, ROFO and cube from the snapshots over HTTP")
+    serve.add_argument("--host", default=API_HOST)
+    serve.add_argument("--port", type=int, default=8765)
+    serve.set_defaults(func=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except PipelineError as e:
+        log(str(e))
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
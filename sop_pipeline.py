@@ -0,0 +1,583 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from stat_forecast import DEFAULT_STAT_MODEL, forecast_baseline
+from consensus_sync import KEY_COLS, merge_consensus, row_versions, sheet_after_push, publish_consensus
+from data_quality import run_rules
+from hash_join import FanoutError, hash_join
+from history_store import INCREMENTAL_SHEETS, read_history, read_all_records
+from merge_audit import NEW_LAUNCH, audit_merge
+from perf_trace import span
+from sheets_usage import metered_http_client
+
+# ============================================================================
+# S&OP DATA PIPELINE (no Streamlit)
+# ----------------------------------------------------------------------------
+# Sheet access, cleaning, the sales x ROFO merge, stock join, Month_Cover and
+# Cons_ initialisation as plain functions. app.py wraps them with caching and
+# st.* messages; sop_cli.py runs them headless for nightly jobs.
+# Problems the user should see are raised as PipelineError.
+# ============================================================================
+SHEETS = ["sales_history", "rofo_current", "stock_onhand"]
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+HORIZON_LENGTH = 12
+ADJUSTABLE_MONTHS = 3
+
+
+class PipelineError(Exception):
+    """A data problem to report to the user; level is 'error' or 'warning'"""
+    def __init__(self, message, level="error"):
+        super().__init__(message)
+        self.level = level
+
+
+# ============================================================================
+# SHEET ACCESS
+# ============================================================================
+def open_spreadsheet(sheet_id, service_account_info):
+    """Authorised gspread Spreadsheet"""
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    creds = Credentials.from_service_account_info(service_account_info, scopes=SCOPES)
+    return gspread.authorize(creds, http_client=metered_http_client()).open_by_key(sheet_id)
+
+
+def read_records(spreadsheet, sheet_name, incremental=True):
+    """
+    One worksheet as a DataFrame (formatted values, like the dashboard reads them)
+    incremental: sales_history is served from its local mirror plus the new
+    and recent month columns (history_store)
+    """
+    worksheet = spreadsheet.worksheet(sheet_name)
+    if incremental and sheet_name in INCREMENTAL_SHEETS:
+        with span(f"incremental read {sheet_name}") as record:
+            df, stats = read_history(worksheet)
+            if record is not None:
+                record['attrs'].update(stats)
+        return df
+    return read_all_records(worksheet)
+
+
+def upsert_rows(worksheet, df, key_cols, existing_values=None):
+    """
+    Write only the given rows, matched on key_cols; every other row and
+    column in the sheet is left untouched. New keys are appended.
+    Returns a short summary message
+    """
+    values = existing_values if existing_values is not None else worksheet.get_all_values()
+    header = list(values[0]) if values else []
+    new_cols = [c for c in df.columns if c not in header]
+    header.extend(new_cols)
+
+    # Sheet row number (1-based, header is row 1) per key
+    key_idx = [header.index(k) for k in key_cols]
+    row_lookup = {}
+    for i, row in enumerate(values[1:], start=2):
+        row = row + [''] * (len(header) - len(row))
+        row_lookup[tuple(str(row[j]).strip() for j in key_idx)] = (i, row)
+
+    df_clean = df.fillna('').astype(str)
+    col_pos = [header.index(c) for c in df_clean.columns]
+    updates, appends = [], []
+    for record in df_clean.itertuples(index=False):
+        key = tuple(str(record[df_clean.columns.get_loc(k)]).strip() for k in key_cols)
+        row_no, row = row_lookup.get(key, (None, [''] * len(header)))
+        row = list(row)
+        for pos, value in zip(col_pos, record):
+            row[pos] = value
+        if row_no:
+            updates.append({'range': f'A{row_no}', 'values': [row]})
+        else:
+            appends.append(row)
+
+    if len(header) > worksheet.col_count:
+        worksheet.add_cols(len(header) - worksheet.col_count)
+    if new_cols or not values:
+        updates.insert(0, {'range': 'A1', 'values': [header]})
+    if updates:
+        worksheet.batch_update(updates, value_input_option='USER_ENTERED')
+    if appends:
+        worksheet.append_rows(appends, value_input_option='USER_ENTERED')
+    return f"Updated {len(df) - len(appends)} rows, added {len(appends)} rows"
+
+
+# ============================================================================
+# CLEANING HELPERS
+# ============================================================================
+def clean_currency(val):
+    """Clean currency values from various formats"""
+    if pd.isna(val) or val == '' or val is None:
+        return 0
+    val_str = str(val)
+    # Remove Rp, spaces, commas, dots (thousand separators)
+    clean_str = re.sub(r'[^0-9]', '', val_str)
+    try:
+        return float(clean_str)
+    except:
+        return 0
+
+
+def clean_currency_frame(df):
+    """Vectorized clean_currency over a whole block of columns"""
+    return parse_quantity_frame(df)[0]
+
+
+# Cells that clean to exactly what they say: blank, or digits with separators (and an Rp prefix)
+PLAIN_NUMBER = r'\s*(?:Rp\.?\s*)?[0-9.,\s]*'
+NEGATIVE_NUMBER = r'^\s*(?:Rp\.?\s*)?[-−(]\s*(?:Rp\.?\s*)?[0-9]'
+CURRENCY_PREFIX = r'^\s*(?:Rp|IDR)\.?'
+
+
+def parse_quantity_frame(df):
+    """
+    clean_currency_frame plus two boolean cell masks from the same text pass:
+    negative (minus sign or parentheses, which cleaning drops) and unparseable
+    (text that is not a number; loaded as 0 or as its digits only)
+    Only cells that are not a plain number are looked at twice
+    Returns (values, negative, unparseable)
+    """
+    if df.shape[1] == 0:
+        empty = np.zeros((len(df), 0), dtype=bool)
+        return pd.DataFrame(index=df.index), empty, empty
+    text = df.fillna('').astype(str)
+    digits = text.replace(r'[^0-9]', '', regex=True)
+    values = digits.apply(pd.to_numeric, errors='coerce').fillna(0).astype(float)
+
+    negative = np.zeros(df.shape, dtype=bool)
+    unparseable = np.zeros(df.shape, dtype=bool)
+    for j, col in enumerate(text.columns):
+        odd = ~text.iloc[:, j].str.fullmatch(PLAIN_NUMBER).to_numpy(dtype=bool)
+        if not odd.any():
+            continue
+        cells = text.iloc[:, j][odd]
+        negative[odd, j] = cells.str.contains(NEGATIVE_NUMBER).to_numpy(dtype=bool)
+        letters = cells.str.replace(CURRENCY_PREFIX, '', regex=True, case=False).str.contains('[A-Za-z]')
+        unparseable[odd, j] = (digits.iloc[:, j][odd] == '').to_numpy() | letters.to_numpy(dtype=bool)
+    return values, negative, unparseable
+
+
+def parse_month_year(date_str):
+    """Parse month-year string to datetime for sorting"""
+    try:
+        return datetime.strptime(date_str, "%b-%y")
+    except:
+        return datetime(1900, 1, 1)  # Default for invalid dates
+
+
+def months_between(from_month, to_month):
+    """Number of months from one 'Mon-YY' label to another"""
+    a, b = parse_month_year(from_month), parse_month_year(to_month)
+    return (b.year - a.year) * 12 + (b.month - a.month)
+
+
+def find_matching_column(target_month, available_columns):
+    """Find matching month column with fuzzy matching"""
+    if target_month in available_columns:
+        return target_month
+
+    # Create clean versions for comparison
+    target_clean = target_month.lower().replace('-', '').replace(' ', '').replace('_', '')
+
+    for col in available_columns:
+        col_str = str(col)
+        col_clean = col_str.lower().replace('-', '').replace(' ', '').replace('_', '')
+        if target_clean in col_clean or col_clean in target_clean:
+            return col
+
+    return None
+
+
+def sort_month_columns(columns):
+    """Sort month columns chronologically (Oct-25, Nov-25, Dec-25, etc.)"""
+    month_cols = [c for c in columns if re.match(r'^[A-Za-z]{3}-\d{2}$', str(c))]
+
+    # Sort by date
+    month_cols.sort(key=lambda x: parse_month_year(x))
+
+    return month_cols
+
+
+KEY_MAP = {
+    'Product Name': 'Product_Name',
+    'Brand Group': 'Brand_Group',
+    'SKU Tier': 'SKU_Tier',
+    'product name': 'Product_Name',
+    'brand group': 'Brand_Group',
+    'sku tier': 'SKU_Tier'
+}
+
+
+def standardize_columns(df):
+    """Strip header whitespace and map key column aliases in place"""
+    if not df.empty:
+        df.columns = [str(c).strip() for c in df.columns]
+        df.rename(columns=lambda x: KEY_MAP.get(x, x), inplace=True)
+    return df
+
+
+# ============================================================================
+# MERGE
+# ============================================================================
+def stable_row_ids(df, key_cols):
+    """
+    Row ids derived from the key values, so the edit journal lands on the same
+    SKU x Channel in any build (another start month, a newer sheet read)
+    53-bit hashes: they survive the round trip through the grid's JS numbers;
+    repeated keys are told apart by their occurrence number
+    """
+    keys = df[key_cols].astype(str).assign(_n=df.groupby(key_cols, sort=False, dropna=False).cumcount().to_numpy())
+    return (pd.util.hash_pandas_object(keys, index=False).to_numpy() & np.uint64((1 << 53) - 1)).astype(np.int64)
+
+
+def horizon_for(start_date_str, all_months=False):
+    """(horizon_months, adjustment_months) for a 'Mon-YY' start month"""
+    try:
+        start_date = datetime.strptime(start_date_str, "%b-%y")
+    except (TypeError, ValueError):
+        raise PipelineError("Invalid date format")
+    horizon_months = [(start_date + relativedelta(months=i)).strftime("%b-%y") for i in range(HORIZON_LENGTH)]
+    # Default: first 3 months for adjustment, the rest display only
+    adjustment_months = horizon_months if all_months else horizon_months[:ADJUSTABLE_MONTHS]
+    return horizon_months, adjustment_months
+
+
+def build_dataset(sales_df, rofo_df, stock_df, start_date_str, all_months=False, stat_model=DEFAULT_STAT_MODEL):
+    """
+    Merged planning frame (one row per SKU x Channel) for one start month
+    Inputs are sheet reads as DataFrames and are not modified
+    Returns (merged_df, info) with info = horizon_months, adjustment_months, missing_months,
+    join_reports (hash_join report per merge; stock is None without a stock sheet),
+    merge_audit (keys dropped by the sales x ROFO merge, by cause), new_launches,
+    quality (data_quality issue table)
+    """
+    # Check if essential data exists
+    if sales_df.empty:
+        raise PipelineError("⚠️ Sales history data is empty")
+    if rofo_df.empty:
+        raise PipelineError("⚠️ ROFO data is empty")
+
+    sales_df, rofo_df, stock_df = sales_df.copy(), rofo_df.copy(), stock_df.copy()
+
+    # Standardize column names
+    for df in [sales_df, rofo_df, stock_df]:
+        if not df.empty:
+            df.columns = [str(c).strip() for c in df.columns]
+
+    horizon_months, adjustment_months = horizon_for(start_date_str, all_months)
+
+    # Number blocks as read, with their cell flags, for the quality rules
+    quality_blocks = []
+
+    def parse_block(sheet, df, cols):
+        values, negative, unparseable = parse_quantity_frame(df[cols])
+        label_cols = [c for c in ['sku_code', 'Channel'] if c in df.columns]
+        quality_blocks.append((sheet, {'raw': df[cols], 'negative': negative, 'unparseable': unparseable,
+                                       'keys': df[label_cols]}))
+        return values
+
+    # Process floor price
+    with span("floor price"):
+        if 'floor_price' not in rofo_df.columns:
+            floor_cols = [c for c in rofo_df.columns if 'floor' in c.lower()]
+            if floor_cols:
+                rofo_df.rename(columns={floor_cols[0]: 'floor_price'}, inplace=True)
+        if 'floor_price' in rofo_df.columns:
+            rofo_df['floor_price'] = parse_block('rofo_current', rofo_df, ['floor_price'])['floor_price']
+        else:
+            rofo_df['floor_price'] = 0
+
+    # Standardize column names
+    for df in [sales_df, rofo_df]:
+        standardize_columns(df)
+
+    # Identify common keys for merging
+    possible_keys = ['sku_code', 'Product_Name', 'Brand', 'Brand_Group', 'SKU_Tier', 'Channel']
+    valid_keys = [k for k in possible_keys if k in sales_df.columns and k in rofo_df.columns]
+
+    if not valid_keys:
+        raise PipelineError("❌ No common columns found for merging sales and ROFO data")
+
+    # Get sales date columns and sort them chronologically
+    sales_date_cols = [c for c in sales_df.columns if re.search(r'^[A-Za-z]{3}-\d{2}$', str(c))]
+    sales_date_cols = sort_month_columns(sales_date_cols)
+
+    # Get LAST 3 months for L3M calculation (correct order: Oct-25, Nov-25, Dec-25)
+    if len(sales_date_cols) >= 3:
+        l3m_cols = sales_date_cols[-3:]  # Last 3 months in chronological order
+    else:
+        l3m_cols = sales_date_cols
+
+    # Parse the full history once as a numeric matrix (SKU x month)
+    with span("clean sales history"):
+        sales_hist = parse_block('sales_history', sales_df, sales_date_cols)
+
+        if l3m_cols:
+            # Calculate L3M average correctly
+            sales_df['L3M_Avg'] = sales_hist[l3m_cols].mean(axis=1).round(0)
+        else:
+            sales_df['L3M_Avg'] = 0
+
+    # Statistical baseline for every horizon month, all SKUs in one pass
+    with span("stat baseline"):
+        stat_cols = [f'Stat_{m}' for m in horizon_months]
+        if sales_date_cols:
+            steps = [months_between(sales_date_cols[-1], m) for m in horizon_months]
+            stat_fc = forecast_baseline(sales_hist.to_numpy(), steps, model=stat_model)
+            sales_df[stat_cols] = pd.DataFrame(stat_fc, index=sales_df.index, columns=stat_cols)
+        else:
+            sales_df[stat_cols] = 0
+
+    # Prepare sales subset
+    sales_subset_cols = valid_keys + ['L3M_Avg'] + stat_cols
+    if l3m_cols:
+        sales_subset_cols.extend(l3m_cols)
+    sales_subset = sales_df[sales_subset_cols].copy()
+
+    # Prepare ROFO subset
+    with span("map ROFO months"):
+        rofo_cols_to_fetch = valid_keys.copy()
+        for extra in ['Channel', 'Product_Focus', 'floor_price', 'category', 'sub_category']:
+            if extra in rofo_df.columns and extra not in rofo_cols_to_fetch:
+                rofo_cols_to_fetch.append(extra)
+
+        # Map month columns
+        month_mapping = {}
+        missing_months = []
+        for m in horizon_months:
+            real_col = find_matching_column(m, rofo_df.columns)
+            if real_col:
+                month_mapping[m] = real_col
+                if real_col not in rofo_cols_to_fetch:
+                    rofo_cols_to_fetch.append(real_col)
+            else:
+                missing_months.append(m)
+
+        rofo_subset = rofo_df[rofo_cols_to_fetch].copy()
+        inv_map = {v: k for k, v in month_mapping.items()}
+        rofo_subset.rename(columns=inv_map, inplace=True)
+
+    # Merge data: one row per key on each side; pasted-twice rows are dropped and reported
+    with span("merge sales x rofo", keys=len(valid_keys)):
+        try:
+            merged_df, sales_rofo_report = hash_join(sales_subset, rofo_subset, valid_keys, unique=('left', 'right'))
+        except FanoutError as e:
+            raise PipelineError(f"❌ Sales x ROFO merge: {e}")
+
+    # Keys the inner join dropped, by cause; ROFO SKUs with no history at all are new launches
+    # and stay in the worksheet with L3M 0
+    with span("merge audit", unmatched=len(sales_rofo_report['left_unmatched']) + len(sales_rofo_report['right_unmatched'])):
+        merge_audit = audit_merge(sales_rofo_report, sales_subset[valid_keys], rofo_subset[valid_keys], valid_keys)
+        launch_labels = merge_audit.index[(merge_audit['Sheet'] == 'rofo_current') & (merge_audit['Cause'] == NEW_LAUNCH)]
+        if len(launch_labels):
+            launches = rofo_subset.loc[launch_labels]
+            no_history = pd.DataFrame({
+                c: launches[c] if c in valid_keys else (0 if pd.api.types.is_numeric_dtype(sales_subset[c]) else "0")
+                for c in sales_subset.columns
+            }, index=launches.index)
+            launch_rows, _ = hash_join(no_history, launches, valid_keys)
+            merged_df = pd.concat([merged_df, launch_rows], ignore_index=True)
+
+    if merged_df.empty:
+        raise PipelineError("⚠️ No matching records found after merging sales and ROFO data", level="warning")
+
+    # Handle missing columns
+    with span("clean horizon months"):
+        if 'Product_Focus' not in merged_df.columns:
+            merged_df['Product_Focus'] = ""
+        else:
+            merged_df['Product_Focus'] = merged_df['Product_Focus'].fillna("").astype(str)
+
+        if 'floor_price' not in merged_df.columns:
+            merged_df['floor_price'] = 0
+        else:
+            merged_df['floor_price'] = merged_df['floor_price'].fillna(0)
+
+        # Ensure all horizon months exist
+        present = [m for m in horizon_months if m in merged_df.columns]
+        merged_df[present] = parse_block('rofo_current', merged_df, present)
+        for m in horizon_months:
+            if m not in merged_df.columns:
+                merged_df[m] = 0
+
+    # Merge stock data
+    with span("stock join"):
+        if not stock_df.empty and 'sku_code' in stock_df.columns:
+            stock_col = next((c for c in ['Stock_Qty', 'stock_qty', 'Stock On Hand', 'stock_on_hand']
+                            if c in stock_df.columns), stock_df.columns[1] if len(stock_df.columns) > 1 else 'stock_qty')
+
+            stock_df_clean = stock_df[['sku_code', stock_col]].copy()
+            stock_df_clean.columns = ['sku_code', 'Stock_Qty']
+            stock_df_clean['Stock_Qty'] = parse_block('stock_onhand', stock_df_clean, ['Stock_Qty'])['Stock_Qty']
+
+            try:
+                merged_df, stock_report = hash_join(merged_df, stock_df_clean, ['sku_code'], how='left', unique=('right',))
+            except FanoutError as e:
+                raise PipelineError(f"❌ Stock merge: {e}")
+        else:
+            merged_df['Stock_Qty'] = 0
+            stock_report = None
+
+        merged_df['Stock_Qty'] = merged_df['Stock_Qty'].fillna(0)
+
+    # Calculate month cover
+    with span("month cover & consensus"):
+        merged_df['Month_Cover'] = np.where(
+            merged_df['L3M_Avg'] > 0,
+            (merged_df['Stock_Qty'] / merged_df['L3M_Avg']).round(1),
+            0
+        )
+        merged_df['Month_Cover'] = merged_df['Month_Cover'].replace([np.inf, -np.inf], 0)
+
+        # Initialize consensus columns for adjustment months
+        for m in adjustment_months:
+            merged_df[f'Cons_{m}'] = merged_df[m]
+
+        # Add summary columns
+        merged_df['Total_Forecast'] = merged_df[adjustment_months].sum(axis=1)
+
+        # Row identifier for session edits, the same for a SKU x Channel in every build
+        merged_df['row_id'] = stable_row_ids(merged_df, [k for k in ['sku_code', 'Channel'] if k in merged_df.columns] or valid_keys)
+
+    # Every validation as one vectorized pass over what ingest already computed
+    with span("quality rules"):
+        quality = run_rules({
+            'blocks': quality_blocks,
+            'sales_rofo': sales_rofo_report,
+            'stock': stock_report,
+            'merged': merged_df,
+            'keys': [k for k in ['sku_code', 'Channel'] if k in merged_df.columns] or valid_keys,
+            'missing_months': missing_months,
+        })
+
+    info = {
+        'horizon_months': horizon_months,
+        'adjustment_months': adjustment_months,
+        'missing_months': missing_months,
+        'join_reports': {'sales x rofo': sales_rofo_report, 'stock': stock_report},
+        'merge_audit': merge_audit,
+        'new_launches': len(launch_labels),
+        'quality': quality,
+    }
+    return merged_df, info
+
+
+def _build_one(args):
+    sheets, start_date_str, all_months, stat_model = args
+    try:
+        merged_df, info = build_dataset(*sheets, start_date_str, all_months, stat_model)
+        return start_date_str, merged_df, info, None
+    except PipelineError as e:
+        return start_date_str, None, None, str(e)
+
+
+def build_many(sales_df, rofo_df, stock_df, start_months, all_months=False,
+               stat_model=DEFAULT_STAT_MODEL, max_workers=None):
+    """
+    build_dataset for several start months in parallel processes; the sheets
+    are read once by the caller. Yields (start_month, merged_df, info, error)
+    in the order given
+    """
+    jobs = [((sales_df, rofo_df, stock_df), m, all_months, stat_model) for m in start_months]
+    if max_workers == 1 or len(jobs) < 2:
+        yield from map(_build_one, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        yield from pool.map(_build_one, jobs)
+
+
+# ============================================================================
+# ADJUSTMENTS & OUTPUT
+# ============================================================================
+def apply_adjustments(df, adjustments, key_cols=KEY_COLS):
+    """
+    Apply an adjustment file to the Cons_ columns
+    adjustments: long format with key_cols, Month and either Consensus
+    (absolute units) or Change_Pct (relative to the current consensus)
+    Returns (adjusted_df, applied_count, unmatched_rows)
+    """
+    missing = [c for c in key_cols + ['Month'] if c not in adjustments.columns]
+    if missing:
+        raise PipelineError(f"Adjustment file is missing columns: {', '.join(missing)}")
+    if 'Consensus' not in adjustments.columns and 'Change_Pct' not in adjustments.columns:
+        raise PipelineError("Adjustment file needs a Consensus or Change_Pct column")
+
+    df = df.copy()
+    row_pos = pd.Series(np.arange(len(df)), index=pd.MultiIndex.from_frame(df[key_cols].astype(str)))
+    row_pos = row_pos[~row_pos.index.duplicated(keep='first')]
+    adj_keys = pd.MultiIndex.from_frame(adjustments[key_cols].astype(str).apply(lambda s: s.str.strip()))
+    pos = row_pos.reindex(adj_keys).to_numpy()
+
+    cons_col = 'Cons_' + adjustments['Month'].astype(str).str.strip()
+    matched = ~np.isnan(pos) & cons_col.isin(df.columns).to_numpy()
+
+    applied = 0
+    for col in cons_col[matched].unique():
+        sel = matched & (cons_col == col).to_numpy()
+        rows = pos[sel].astype(int)
+        values = df[col].to_numpy(dtype=float, copy=True)
+        if 'Consensus' in adjustments.columns:
+            new = pd.to_numeric(adjustments['Consensus'], errors='coerce').to_numpy()[sel]
+        else:
+            new = np.full(sel.sum(), np.nan)
+        if 'Change_Pct' in adjustments.columns:
+            pct = pd.to_numeric(adjustments['Change_Pct'], errors='coerce').to_numpy()[sel]
+            new = np.where(np.isnan(new), np.round(values[rows] * (1 + pct / 100)), new)
+        ok = ~np.isnan(new)
+        values[rows[ok]] = new[ok]
+        df[col] = values
+        applied += int(ok.sum())
+
+    adj_months = [c[len('Cons_'):] for c in df.columns if str(c).startswith('Cons_')]
+    if adj_months:
+        df['Total_Forecast'] = df[[f'Cons_{m}' for m in adj_months]].sum(axis=1)
+    return df, applied, adjustments.loc[~matched]
+
+
+def write_output(df, path):
+    """Write a frame as Parquet or CSV depending on the extension"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.drop(columns=['row_id'], errors='ignore').to_csv(path, index=False)
+    return path
+
+
+def push_consensus(spreadsheet, df, cons_cols, updated_by="S&OP Pipeline", sheet_name="consensus_rofo", dataset=None):
+    """
+    Upsert the consensus of df into consensus_rofo without a Streamlit session
+    The ROFO-initialised consensus is the merge base, so only cells that differ
+    from ROFO (or rows missing in the sheet) are written
+    dataset: snapshot key of the cycle, recorded with the consensus published for the read API
+    """
+    import gspread
+
+    keep_cols = [c for c in ['sku_code', 'Product_Name', 'Channel', 'Brand', 'SKU_Tier', 'Product_Focus'] if c in df.columns]
+    keep_cols.extend(cons_cols)
+    local = df[keep_cols].reset_index(drop=True)
+    base = local.copy()
+    for col in cons_cols:
+        base[col] = df[col[len('Cons_'):]].to_numpy()
+
+    try:
+        worksheet = spreadsheet.worksheet(sheet_name)
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=len(local) + 100, cols=len(keep_cols) + 5)
+    values = worksheet.get_all_values()
+    remote_df = pd.DataFrame(values[1:], columns=values[0]) if values else pd.DataFrame()
+
+    # Nothing in the sheet is newer than this read, so there are no conflicts to report
+    merge = merge_consensus(local, base, remote_df, cons_cols,
+                            seen_versions=row_versions(remote_df), updated_by=updated_by)
+    if merge.to_write.empty:
+        return merge, "Nothing new to write"
+    message = upsert_rows(worksheet, merge.to_write, KEY_COLS, existing_values=values)
+    publish_consensus(sheet_after_push(remote_df, merge.to_write), dataset=dataset)
+    return merge, message
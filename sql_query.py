@@ -0,0 +1,135 @@
+import re
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+# ============================================================================
+# SQL OVER THE PLANNING DATA (DuckDB, in process)
+# ----------------------------------------------------------------------------
+# The session's planning frame, the sales actuals and any other frame are
+# registered with an in-memory DuckDB connection as Arrow tables, which DuckDB
+# scans in place (pandas frames are wrapped with pa.Table.from_pandas, which
+# reuses their Arrow / numpy buffers; scanning pandas str columns directly is
+# far slower). Two views sit on top:
+#   plan_long  one row per SKU x Channel x horizon month (ROFO, Stat, Consensus);
+#              Month is the 'Mon-YY' label, Month_Start the DATE to sort by
+#   cube       plan_long summed over every combination of Brand, Channel,
+#              SKU_Tier and Month (GROUP BY CUBE; NULL = all)
+# Views are only evaluated by the queries that use them. Queries are
+# read-only: one SELECT-type statement, no file or network access.
+# duckdb is imported on first use, like the other heavy optional modules.
+# ============================================================================
+SQL_ROW_LIMIT = 10000
+READ_ONLY_STATEMENTS = ('select', 'with', 'from', 'describe', 'show', 'summarize', 'pivot', 'unpivot', 'values', 'table')
+CUBE_DIMS = ['Brand', 'Channel', 'SKU_Tier']
+
+
+class QueryError(ValueError):
+    """A query that was refused or failed; the message is shown to the user"""
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _plan_long_sql(columns, months):
+    """UNION ALL of one SELECT per horizon month over the plan table"""
+    dims = [c for c in ['sku_code', 'Product_Name', 'Brand', 'Brand_Group', 'SKU_Tier', 'Channel'] if c in columns]
+    parts = []
+    for m in months:
+        if m not in columns:
+            continue
+        stat = _quote(f'Stat_{m}') if f'Stat_{m}' in columns else 'NULL'
+        cons = _quote(f'Cons_{m}') if f'Cons_{m}' in columns else _quote(m)
+        start = datetime.strptime(m, "%b-%y").strftime("%Y-%m-%d")
+        parts.append(f"SELECT {', '.join(_quote(d) for d in dims)}{',' if dims else ''} '{m}' AS Month, "
+                     f"DATE '{start}' AS Month_Start, "
+                     f"{_quote(m)} AS ROFO, {stat} AS Stat, {cons} AS Consensus FROM plan")
+    return " UNION ALL ".join(parts)
+
+
+def _arrow(table):
+    return pa.Table.from_pandas(table, preserve_index=False) if isinstance(table, pd.DataFrame) else table
+
+
+def connect(plan, horizon_months, tables=None):
+    """
+    DuckDB connection with plan, plan_long, cube and the extra tables
+    {name: DataFrame or Arrow table} registered; external access off
+    """
+    import duckdb
+
+    con = duckdb.connect(":memory:")
+    plan = _arrow(plan)
+    con.register("plan", plan)
+    for name, table in (tables or {}).items():
+        con.register(name, _arrow(table))
+    long_sql = _plan_long_sql(plan.column_names, horizon_months)
+    if long_sql:
+        con.execute(f"CREATE VIEW plan_long AS {long_sql}")
+        dims = [d for d in CUBE_DIMS if d in plan.column_names] + ['Month']
+        con.execute(f"CREATE VIEW cube AS SELECT {', '.join(dims)}, "
+                    f"CAST(strptime(Month, '%b-%y') AS DATE) AS Month_Start, SUM(ROFO) AS ROFO, SUM(Stat) AS Stat, "
+                    f"SUM(Consensus) AS Consensus, COUNT(*) AS Rows "
+                    f"FROM plan_long GROUP BY CUBE ({', '.join(dims)})")
+    con.execute("SET enable_external_access = false")
+    con.execute("SET lock_configuration = true")
+    return con
+
+
+def _strip_comments(sql):
+    return re.sub(r'--[^\n]*|/\*.*?\*/', ' ', sql, flags=re.S).strip()
+
+
+def run_query(con, sql, limit=SQL_ROW_LIMIT):
+    """
+    Run one read-only statement
+    Returns (result DataFrame, milliseconds, truncated); raises QueryError
+    """
+    import duckdb
+
+    statement = _strip_comments(sql).rstrip(';').strip()
+    if not statement:
+        raise QueryError("Enter a query")
+    if ';' in statement:
+        raise QueryError("Run one statement at a time")
+    if statement.split(None, 1)[0].lower() not in READ_ONLY_STATEMENTS:
+        raise QueryError("Only read-only queries (SELECT, WITH, DESCRIBE, ...) are allowed")
+    t0 = time.perf_counter()
+    try:
+        result = con.sql(statement)
+        if result is None:
+            raise QueryError("The statement returned no result")
+        df = result.limit(limit + 1).df()
+    except duckdb.Error as e:
+        raise QueryError(str(e)) from None
+    elapsed = (time.perf_counter() - t0) * 1000
+    return df.head(limit), elapsed, len(df) > limit
+
+
+def table_columns(con):
+    """(table, column, type) for everything a query can read"""
+    return con.sql("SELECT table_name AS \"Table\", column_name AS \"Column\", data_type AS \"Type\" "
+                   "FROM information_schema.columns ORDER BY table_name, ordinal_position").df()
+
+
+def example_queries(adjustment_months):
+    """Label -> SQL, written against the current cycle's columns"""
+    m = adjustment_months[0]
+    return {
+        "Reseller Tier A: cover < 0.5, consensus > 130% of L3M":
+            f'SELECT sku_code, Product_Name, Brand, Month_Cover, L3M_Avg, "Cons_{m}"\nFROM plan\n'
+            f"WHERE Channel = 'Reseller' AND SKU_Tier = 'A' AND Month_Cover < 0.5\n"
+            f'  AND "Cons_{m}" > 1.3 * L3M_Avg\nORDER BY "Cons_{m}" DESC',
+        "Consensus vs ROFO by brand and month":
+            "SELECT Brand, Month, ROFO, Consensus, round(100 * (Consensus / NULLIF(ROFO, 0) - 1), 1) AS \"Change %\"\n"
+            "FROM cube\nWHERE Brand IS NOT NULL AND Channel IS NULL AND SKU_Tier IS NULL AND Month IS NOT NULL\n"
+            "ORDER BY Brand, Month_Start",
+        "Top 20 SKUs by consensus change":
+            "SELECT sku_code, Channel, SUM(Consensus - ROFO) AS Change\nFROM plan_long\n"
+            "GROUP BY ALL\nORDER BY abs(Change) DESC\nLIMIT 20",
+        "Monthly actuals by channel":
+            "SELECT Channel, Target_Month, SUM(Actual) AS Actual\nFROM actuals\nGROUP BY ALL\nORDER BY Channel",
+    }
@@ -0,0 +1,170 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# ============================================================================
+# BATCHED STATISTICAL BASELINE ENGINE
+# ----------------------------------------------------------------------------
+# Every model takes a (n_skus, n_months) history matrix and a list of steps
+# ahead, and returns a (n_skus, n_steps) forecast matrix. The recursions run
+# over the time axis only; each step is a vectorized update across all SKUs.
+# ============================================================================
+SEASON_LENGTH = 12
+PARALLEL_MIN_ROWS = 20000  # Below this, process startup costs more than it saves
+
+
+def _first_sale_index(hist):
+    """Index of the first non-zero month per SKU (n_months if never sold)"""
+    nonzero = hist > 0
+    first = nonzero.argmax(axis=1)
+    first[~nonzero.any(axis=1)] = hist.shape[1]
+    return first
+
+
+def _finish(fc):
+    """Clip negatives and round to whole units like L3M_Avg"""
+    return np.clip(np.nan_to_num(fc), 0, None).round(0)
+
+
+def moving_average(hist, steps, window=3):
+    """Flat forecast at the mean of the last `window` months"""
+    if hist.shape[1] == 0:
+        return np.zeros((hist.shape[0], len(steps)))
+    level = hist[:, -window:].mean(axis=1)
+    return _finish(np.repeat(level[:, None], len(steps), axis=1))
+
+
+def simple_exp_smoothing(hist, steps, alpha=0.3):
+    """Flat forecast at the exponentially smoothed level"""
+    n_rows, n_months = hist.shape
+    if n_months == 0:
+        return np.zeros((n_rows, len(steps)))
+
+    # The smoothed level is a weighted sum of history, so it collapses into a
+    # single matrix-vector product once each SKU's pre-launch months are masked
+    first = _first_sale_index(hist)
+    age = (n_months - 1) - np.arange(n_months)
+    weights = alpha * (1 - alpha) ** age
+    active = np.arange(n_months)[None, :] >= first[:, None]
+    level = (hist * active) @ weights
+
+    # Initial level (first sale) carries the leftover weight
+    first_clipped = np.minimum(first, n_months - 1)
+    init = hist[np.arange(n_rows), first_clipped]
+    leftover = (1 - alpha) ** (n_months - first_clipped)
+    level = level + np.where(first < n_months, init * leftover, 0)
+
+    return _finish(np.repeat(level[:, None], len(steps), axis=1))
+
+
+def holt_linear(hist, steps, alpha=0.3, beta=0.1):
+    """Holt's linear trend method, damped to zero before each SKU's first sale"""
+    n_rows, n_months = hist.shape
+    if n_months == 0:
+        return np.zeros((n_rows, len(steps)))
+
+    first = _first_sale_index(hist)
+    level = np.zeros(n_rows)
+    trend = np.zeros(n_rows)
+    for t in range(n_months):
+        y = hist[:, t]
+        starting = first == t
+        running = first < t
+        level_prev = level
+        level = np.where(starting, y, level)
+        new_level = alpha * y + (1 - alpha) * (level_prev + trend)
+        level = np.where(running, new_level, level)
+        trend = np.where(running, beta * (level - level_prev) + (1 - beta) * trend, trend)
+
+    h = np.asarray(steps, dtype=float)[None, :]
+    return _finish(level[:, None] + trend[:, None] * h)
+
+
+def seasonal_naive(hist, steps, season=SEASON_LENGTH):
+    """Same month last year; falls back to the last month when history is short"""
+    n_rows, n_months = hist.shape
+    if n_months == 0:
+        return np.zeros((n_rows, len(steps)))
+    if n_months < season:
+        return _finish(np.repeat(hist[:, -1:], len(steps), axis=1))
+
+    idx = [n_months - season + ((h - 1) % season) for h in steps]
+    return _finish(hist[:, idx])
+
+
+def _holt_winters_rows(hist, steps, alpha, beta, gamma, season):
+    """Additive Holt-Winters over a block of rows"""
+    n_rows, n_months = hist.shape
+    first_year = hist[:, :season]
+    level = first_year.mean(axis=1)
+    trend = (hist[:, season:2 * season].mean(axis=1) - level) / season
+    seasonal = first_year - level[:, None]
+
+    for t in range(season, n_months):
+        y = hist[:, t]
+        s = seasonal[:, t % season]
+        level_prev = level
+        level = alpha * (y - s) + (1 - alpha) * (level_prev + trend)
+        trend = beta * (level - level_prev) + (1 - beta) * trend
+        seasonal[:, t % season] = gamma * (y - level) + (1 - gamma) * s
+
+    fc = np.empty((n_rows, len(steps)))
+    for j, h in enumerate(steps):
+        fc[:, j] = level + h * trend + seasonal[:, (n_months + h - 1) % season]
+    return fc
+
+
+def holt_winters(hist, steps, alpha=0.3, beta=0.05, gamma=0.2,
+                 season=SEASON_LENGTH, n_jobs=None):
+    """
+    Additive Holt-Winters (level + trend + 12-month seasonality)
+    n_jobs: worker processes; None picks automatically based on row count
+    """
+    n_rows, n_months = hist.shape
+    if n_months < 2 * season:
+        # Not enough history to initialise a seasonal profile
+        return holt_linear(hist, steps, alpha=alpha, beta=beta)
+
+    if n_jobs is None:
+        n_jobs = (os.cpu_count() or 1) if n_rows >= PARALLEL_MIN_ROWS else 1
+
+    if n_jobs <= 1:
+        return _finish(_holt_winters_rows(hist.copy(), steps, alpha, beta, gamma, season))
+
+    chunks = np.array_split(hist, n_jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        parts = pool.map(_holt_winters_rows, chunks,
+                         [steps] * n_jobs, [alpha] * n_jobs, [beta] * n_jobs,
+                         [gamma] * n_jobs, [season] * n_jobs)
+        fc = np.vstack(list(parts))
+    return _finish(fc)
+
+
+STAT_MODELS = {
+    "Moving Average (3M)": moving_average,
+    "Exponential Smoothing": simple_exp_smoothing,
+    "Holt Trend": holt_linear,
+    "Seasonal Naive": seasonal_naive,
+    "Holt-Winters Seasonal": holt_winters,
+}
+DEFAULT_STAT_MODEL = "Exponential Smoothing"
+
+
+def forecast_baseline(hist, steps, model=DEFAULT_STAT_MODEL, **kwargs):
+    """
+    Run one baseline model over all SKUs at once
+    hist: (n_skus, n_months) numeric history in chronological order
+    steps: months ahead of the last history month for each forecast column
+    Columns with a step <= 0 (months the history already covers) are NaN:
+    there is no forecast for them, and the h=1 value must not stand in
+    """
+    if model not in STAT_MODELS:
+        raise ValueError(f"Unknown statistical model: {model}")
+    hist = np.asarray(hist, dtype=float)
+    steps = [int(h) for h in steps]
+    ahead = [i for i, h in enumerate(steps) if h >= 1]
+    fc = np.full((hist.shape[0], len(steps)), np.nan)
+    if ahead:
+        fc[:, ahead] = STAT_MODELS[model](hist, [steps[i] for i in ahead], **kwargs)
+    return fc
@@ -0,0 +1,130 @@
+"""
+Synthetic sales_history / rofo_current / stock_onhand sheets
+
+    python synthetic_data.py --rows 50000 --start Feb-26 --out-dir .sop_data/synthetic
+
+Values come out the way get_all_records returns a formatted sheet: IDR
+prices as "Rp 154,000", quantities with thousand separators, blank cells,
+month headers like "Feb-26". Some ROFO months are left out and some keys
+are duplicated, as in the real workbook.
+"""
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+CHANNELS = ['E-commerce', 'Reseller', 'Clinical']
+BRANDS = {
+    'Acne': ['Acneact', 'AC Clear'],
+    'Age': ['Age Corrector', 'Truwhite'],
+    'Hair': ['Hair Grow'],
+    'Sun': ['Sunscreen', 'Sun Protect'],
+    'Tru': ['Tru'],
+}
+TIERS = ['A', 'B', 'C']
+
+
+def _months(first, count):
+    return [(first + relativedelta(months=i)).strftime("%b-%y") for i in range(count)]
+
+
+def _fmt_qty(values, blank_rate, rng):
+    """Quantities as formatted sheet strings ('1,234'), some cells blank"""
+    text = pd.Series(np.round(values).astype(np.int64)).map('{:,}'.format).to_numpy(dtype=object)
+    text[rng.random(len(text)) < blank_rate] = ''
+    return text
+
+
+def generate_sheets(n_rows, start_month="Feb-26", history_months=24, horizon_months=12,
+                    missing_months=1, duplicate_rate=0.005, blank_rate=0.01, seed=0):
+    """
+    n_rows SKU x Channel rows; sales history ends the month before start_month
+    Returns {sheet_name: DataFrame of strings}
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime.strptime(start_month, "%b-%y")
+    hist_cols = _months(start - relativedelta(months=history_months), history_months)
+    rofo_cols = _months(start, horizon_months)
+
+    n_skus = -(-n_rows // len(CHANNELS))
+    sku_codes = np.array([f"SKU{i:06d}" for i in range(n_skus)])
+    groups = np.array(list(BRANDS.keys()))
+    sku_group = groups[rng.integers(0, len(groups), n_skus)]
+    sku_brand = np.array([BRANDS[g][rng.integers(0, len(BRANDS[g]))] for g in sku_group])
+    sku_tier = np.array(TIERS)[rng.choice(len(TIERS), n_skus, p=[0.2, 0.3, 0.5])]
+
+    sku_idx = np.repeat(np.arange(n_skus), len(CHANNELS))[:n_rows]
+    channel = np.tile(CHANNELS, n_skus)[:n_rows]
+    keys = pd.DataFrame({
+        'sku_code': sku_codes[sku_idx],
+        'Product_Name': [f"Product {i}" for i in sku_idx],
+        'Brand': sku_brand[sku_idx],
+        'Brand_Group': sku_group[sku_idx],
+        'SKU_Tier': sku_tier[sku_idx],
+        'Channel': channel,
+    })
+
+    # Demand: lognormal level x yearly seasonality x noise, trending slightly
+    level = rng.lognormal(mean=4.5, sigma=1.0, size=n_rows)
+    phase = rng.uniform(0, 2 * np.pi, n_rows)
+    t = np.arange(history_months + horizon_months)
+    season = 1 + 0.2 * np.sin(2 * np.pi * t[None, :] / 12 + phase[:, None])
+    trend = 1 + rng.normal(0.005, 0.01, n_rows)[:, None] * t[None, :]
+    demand = level[:, None] * season * np.clip(trend, 0.2, None)
+    demand *= rng.lognormal(0, 0.15, demand.shape)
+
+    sales = keys.copy()
+    for j, m in enumerate(hist_cols):
+        sales[m] = _fmt_qty(demand[:, j], blank_rate, rng)
+
+    rofo = keys.rename(columns={'Product_Name': 'Product Name', 'Brand_Group': 'Brand Group', 'SKU_Tier': 'SKU Tier'})
+    rofo['Product_Focus'] = np.where(rng.random(n_rows) < 0.15, 'Yes', '')
+    rofo['floor_price'] = pd.Series(rng.integers(50, 500, n_skus)[sku_idx] * 1000).map('Rp {:,}'.format).to_numpy()
+    dropped = set(rng.choice(rofo_cols[1:], size=min(missing_months, len(rofo_cols) - 1), replace=False)) if missing_months else set()
+    for j, m in enumerate(rofo_cols):
+        if m not in dropped:
+            rofo[m] = _fmt_qty(demand[:, history_months + j] * rng.normal(1.05, 0.1, n_rows), blank_rate, rng)
+
+    stock = pd.DataFrame({
+        'sku_code': sku_codes,
+        'Stock_Qty': _fmt_qty(rng.gamma(2.0, 1.0, n_skus) * level[::len(CHANNELS)], blank_rate, rng),
+    })
+
+    # Duplicate keys, as they show up when rows are pasted twice
+    n_dup = int(n_rows * duplicate_rate)
+    if n_dup:
+        sales = pd.concat([sales, sales.iloc[rng.choice(n_rows, n_dup, replace=False)]], ignore_index=True)
+        rofo = pd.concat([rofo, rofo.iloc[rng.choice(n_rows, n_dup, replace=False)]], ignore_index=True)
+
+    return {'sales_history': sales, 'rofo_current': rofo, 'stock_onhand': stock}
+
+
+def write_sheets(sheets, out_dir):
+    """One <sheet>.csv per sheet (readable by sop_cli.py --input-dir)"""
+    os.makedirs(out_dir, exist_ok=True)
+    for name, df in sheets.items():
+        df.to_csv(os.path.join(out_dir, f"{name}.csv"), index=False)
+    return out_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic S&OP sheets")
+    parser.add_argument("--rows", type=int, default=5000, help="SKU x Channel rows")
+    parser.add_argument("--start", default=datetime.now().strftime("%b-%y"), help="Forecast start month")
+    parser.add_argument("--history", type=int, default=24, help="Months of sales history")
+    parser.add_argument("--missing-months", type=int, default=1, help="ROFO months left out")
+    parser.add_argument("--duplicate-rate", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", default=os.path.join(".sop_data", "synthetic"))
+    args = parser.parse_args(argv)
+
+    sheets = generate_sheets(args.rows, args.start, args.history, missing_months=args.missing_months,
+                             duplicate_rate=args.duplicate_rate, seed=args.seed)
+    print(write_sheets(sheets, args.out_dir))
+
+
+if __name__ == "__main__":
+    main()